@@ -66,6 +66,22 @@ defaults = {
             'concurrent_max': 16,
         },
         'episodes': 200,  # max episodes per feed
+        'feed_updates': {
+            'concurrent': 4,  # number of feeds fetched in parallel
+            'concurrent_per_host': 2,  # parallel fetches from the same server
+            'honor_cache_headers': True,  # don't fetch feeds while still fresh (Cache-Control/Expires)
+        },
+        'feed_parsing': {
+            'processes': 0,  # worker processes for parsing large feeds (0: parse in the updating thread)
+            'min_size': 512,  # kB, smaller feeds are always parsed in the updating thread
+        },
+    },
+
+    # Storage of the podcast and episode database
+    'database': {
+        'wal': False,  # write-ahead logging: reading doesn't wait for writes (needs a local file system)
+        'write_behind': False,  # save changes on a background thread, committing every few seconds
+        'vacuum_threshold': 0.25,  # share of free pages for a full VACUUM on exit (else freed incrementally)
     },
 
     # Behavior of downloads
@@ -78,6 +94,8 @@ defaults = {
         'update': {
             'enabled': False,
             'frequency': 20,  # minutes
+            'adaptive': True,  # check podcasts that publish rarely less often
+            'max_interval': 24 * 60,  # minutes
         },
 
         'cleanup': {
@@ -242,6 +260,10 @@ defaults = {
         'proxy_use_username_password': False,
         'proxy_username': '',
         'proxy_password': '',
+        'connection_pool': {
+            'hosts': 32,  # number of hosts to keep connections open to
+            'per_host': 10,  # number of connections kept open per host
+        },
     },
 
     'extensions': {
@@ -258,6 +280,10 @@ logger = logging.getLogger(__name__)
 # Global variable for network proxies. Updated when the network proxy in the config changes
 _proxies = None
 
+# Global variable for the size of HTTP connection pools: (hosts, connections per host).
+# Updated together with _proxies when the network settings in the config change
+_connection_pool = (32, 10)
+
 
 def get_network_proxy_observer(config):
     """Return an observer function inside a closure containing given config instance."""
@@ -275,9 +301,13 @@ def get_network_proxy_observer(config):
         return proxies
 
     def network_proxy_observer(name, old_value, new_value):
-        global _proxies
+        global _proxies, _connection_pool
         if name.startswith("network."):
             _proxies = get_proxies_from_config(config)
+            _connection_pool = (max(1, config.network.connection_pool.hosts),
+                                max(1, config.network.connection_pool.per_host))
+            # Pooled connections may have been opened with the old settings
+            util.reset_sessions()
 
     return network_proxy_observer
 
@@ -33,10 +33,12 @@ class Core(object):
         # Initialize the gPodder home directory
         util.make_directory(gpodder.home)
 
-        # Open the database and configuration file
-        self.db = database_class(gpodder.database_file)
-        self.model = model_class(self.db)
+        # Open the configuration file and database
         self.config = config_class(gpodder.config_file)
+        self.db = database_class(gpodder.database_file, wal=self.config.database.wal,
+                                 write_behind=self.config.database.write_behind,
+                                 vacuum_threshold=self.config.database.vacuum_threshold)
+        self.model = model_class(self.db)
 
         # Load extension modules and install the extension manager
         gpodder.user_extensions = extensions.ExtensionManager(self)
@@ -47,9 +49,28 @@ class Core(object):
         # Update the current device in the configuration
         self.config.mygpo.device.type = util.detect_device_type()
 
+        # Apply the feed update and parsing settings to the fetcher
+        self._on_config_changed('limit.feed_parsing', None, None)
+        self._on_config_changed('limit.feed_updates', None, None)
+        self.config.add_observer(self._on_config_changed)
+
+    def _on_config_changed(self, name, old_value, new_value):
+        if name.startswith('limit.feed_parsing'):
+            model.PodcastChannel.feed_fetcher.set_parse_processes(
+                max(0, self.config.limit.feed_parsing.processes),
+                1024 * max(0, self.config.limit.feed_parsing.min_size))
+        elif name.startswith('limit.feed_updates'):
+            model.PodcastChannel.feed_fetcher.honor_cache_headers = self.config.limit.feed_updates.honor_cache_headers
+
     def shutdown(self):
         # Notify all extensions that we are being shut down
         gpodder.user_extensions.shutdown()
 
+        # Don't wait for YouTube durations that were not looked up yet
+        self.model.youtube_durations.shutdown()
+
+        # Stop the feed parsing processes
+        model.PodcastChannel.feed_fetcher.shutdown()
+
         # Close the database and store outstanding changes
         self.db.close()
@@ -24,59 +24,251 @@
 # 2010-04-24 Thomas Perl <thp@gpodder.org>
 #
 
+import collections
+import contextlib
+import itertools
 import logging
+import operator
+import os
+import queue
 import threading
+import time
+import urllib.request
 from sqlite3 import dbapi2 as sqlite
 
 import gpodder
-from gpodder import schema, util
+from gpodder import schema, telemetry, util
 
 _ = gpodder.gettext
 
 logger = logging.getLogger(__name__)
 
 
+class LRUCache(object):
+    """Dict keeping the "size" most recently used items (thread-safe)"""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
 class Database(object):
     TABLE_PODCAST = 'podcast'
     TABLE_EPISODE = 'episode'
+    TABLE_YOUTUBE_DURATION = 'youtube_duration'
+    TABLE_PODCAST_STATISTICS = 'podcast_statistics'
+    TABLE_PODCAST_COVER_THUMB = 'podcast_cover_thumb'
+
+    # Number of IDs per "id IN (...)" statement, below SQLite's variable limit
+    MAX_IDS_PER_STATEMENT = 500
+
+    # Number of episodes whose lazy columns (descriptions, chapters) are cached
+    EPISODE_TEXT_CACHE_SIZE = 500
+
+    # Number of podcasts whose cover thumbnail is cached
+    COVER_THUMB_CACHE_SIZE = 200
 
-    def __init__(self, filename):
+    # Write-behind: seconds until pending saves are written and committed,
+    # unless there are this many of them before
+    WRITE_BEHIND_DELAY = 2.0
+    WRITE_BEHIND_MAX_PENDING = 500
+
+    # Free pages given back to the file system by each incremental vacuum step
+    INCREMENTAL_VACUUM_PAGES = 1000
+
+    # Value of "PRAGMA auto_vacuum" for incremental vacuum
+    AUTO_VACUUM_INCREMENTAL = 2
+
+    def __init__(self, filename, wal=False, write_behind=False, vacuum_threshold=0.25):
         self.database_file = filename
         self._db = None
         self.lock = threading.RLock()
+        self._deferred_commits = 0
+
+        # A full VACUUM is only done on close when this share of the pages is free
+        self.vacuum_threshold = vacuum_threshold
+
+        # With write-behind, saves of existing rows and commits are done by
+        # a writer thread. Saves of the same row are written together.
+        self.write_behind = write_behind
+        # (table, id(object)) -> (object, columns), in the order of the first save
+        self._pending = collections.OrderedDict()
+        self._pending_condition = threading.Condition()
+        self._commit_requested = False
+        self._writer_thread = None
+        self._stopping = False
+
+        # With write-ahead logging, reads that don't need to see uncommitted
+        # changes use read-only connections and don't wait for the writer
+        self.wal = wal and filename != ':memory:'
+        self._readers = queue.LifoQueue()
+        # Threads that wrote since the last commit, they read from the writer
+        self._writing_threads = set()
+
+        # Podcast ID -> statistics tuple, read at once and dropped after writes
+        self._statistics = None
+        self._statistics_generation = 0
+
+        # Episode ID -> dict of schema.EpisodeLazyColumns
+        self._episode_texts = LRUCache(self.EPISODE_TEXT_CACHE_SIZE)
+
+        # Podcast ID -> cover thumbnail (bytes or None)
+        self._cover_thumbs = LRUCache(self.COVER_THUMB_CACHE_SIZE)
 
     def close(self):
-        self.commit()
+        self._stop_writer()
+        self.flush()
+
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+        with self.lock:
+            statistics = self.get_page_statistics()
+            if self._vacuum_needed(statistics):
+                logger.info('Vacuuming the database (%d of %d pages free)', statistics['freelist_count'],
+                            statistics['page_count'])
+                self._vacuum()
+            else:
+                self.incremental_vacuum()
+
+        self._db.close()
+        self._db = None
 
+    def get_page_statistics(self):
+        """Return a dict with the page_count, freelist_count, page_size and auto_vacuum values"""
+        with self.lock:
+            return {name: self.db.execute('PRAGMA %s' % name).fetchone()[0]
+                    for name in ('page_count', 'freelist_count', 'page_size', 'auto_vacuum')}
+
+    def _vacuum_needed(self, statistics):
+        return statistics['freelist_count'] > self.vacuum_threshold * statistics['page_count']
+
+    @telemetry.timed('db')
+    def _vacuum(self):
+        # Also switches the database to incremental vacuum, see "db"
         with self.lock:
             self.db.isolation_level = None
             self.db.execute('VACUUM')
             self.db.isolation_level = ''
 
-        self._db.close()
-        self._db = None
+    @telemetry.timed('db')
+    def incremental_vacuum(self, pages=None):
+        """Give some free pages back to the file system
+
+        Cheap enough to be done when idle and on close, a full VACUUM is
+        only needed when many pages are free (see vacuum_threshold).
+        """
+        if pages is None:
+            pages = self.INCREMENTAL_VACUUM_PAGES
+
+        with self.lock:
+            # It commits, not in the middle of deferred_commits()
+            if self._deferred_commits or not self.db.execute('PRAGMA freelist_count').fetchone()[0]:
+                return
+            # execute() would only free one page, executescript() runs it to the end
+            self.db.executescript('PRAGMA incremental_vacuum(%d)' % pages)
+            self._commit()
+
+    def recount_statistics(self):
+        """Rebuild the podcast_statistics table from the episodes"""
+        with self.lock:
+            cur = self._write_cursor()
+            cur.execute('DELETE FROM %s' % self.TABLE_PODCAST_STATISTICS)
+            cur.execute('INSERT INTO %s %s' % (self.TABLE_PODCAST_STATISTICS, schema.statistics_count_sql()))
+            cur.close()
+
+    def maintenance(self):
+        """Recount the podcast statistics, update the statistics of the query planner and free unused pages
+
+        A full VACUUM is done above the vacuum_threshold, and for databases
+        that don't use incremental vacuum yet. Returns the page statistics
+        (see get_page_statistics) before and after.
+        """
+        self.flush()
+        with self.lock:
+            before = self.get_page_statistics()
+            self.recount_statistics()
+            self.db.execute('ANALYZE')
+            self.db.execute('PRAGMA optimize')
+            self._commit()
+
+            if self._vacuum_needed(before) or before['auto_vacuum'] != self.AUTO_VACUUM_INCREMENTAL:
+                self._vacuum()
+            else:
+                self.db.executescript('PRAGMA incremental_vacuum')
+                self._commit()
+
+            after = self.get_page_statistics()
+
+        return before, after
 
+    @telemetry.timed('db')
     def purge(self, max_episodes, podcast_id):
         """
         Deletes old episodes.  Should be called
         before adding new episodes to a podcast.
+
+        Returns the IDs of the deleted episodes.
         """
         if max_episodes == 0:
-            return
+            return []
 
         with self.lock:
-            cur = self.cursor()
+            cur = self._write_cursor()
 
             logger.debug('Purge requested for podcast %d', podcast_id)
+            # Walks idx_episode_podcast_published past the newest episodes,
+            # instead of sorting all episodes of the podcast
             sql = """
-                DELETE FROM %s
-                WHERE podcast_id = ?
-                AND state <> ?
-                AND id NOT IN
-                (SELECT id FROM %s WHERE podcast_id = ?
-                ORDER BY published DESC LIMIT ?)""" % (self.TABLE_EPISODE, self.TABLE_EPISODE)
-            cur.execute(sql, (podcast_id, gpodder.STATE_DOWNLOADED, podcast_id, max_episodes))
+                SELECT id FROM
+                (SELECT id, state FROM %s WHERE podcast_id = ?
+                ORDER BY published DESC LIMIT -1 OFFSET ?)
+                WHERE state <> ?""" % (self.TABLE_EPISODE,)
+            cur.execute(sql, (podcast_id, max_episodes, gpodder.STATE_DOWNLOADED))
+            ids = [row[0] for row in cur]
+            cur.close()
+
+            self.delete_episodes(ids)
 
+        return ids
+
+    @telemetry.timed('db')
+    def delete_episodes(self, ids):
+        """Delete the episodes with the given IDs"""
+        ids = list(ids)
+        self._forget_episode_texts(ids)
+        with self.lock:
+            cur = self._write_cursor()
+            for start in range(0, len(ids), self.MAX_IDS_PER_STATEMENT):
+                chunk = ids[start:start + self.MAX_IDS_PER_STATEMENT]
+                cur.execute('DELETE FROM %s WHERE id IN (%s)' % (self.TABLE_EPISODE, ', '.join('?' * len(chunk))),
+                            chunk)
             cur.close()
 
     @property
@@ -84,34 +276,235 @@ class Database(object):
         if self._db is None:
             self._db = sqlite.connect(self.database_file, check_same_thread=False)
 
+            # Used by new databases, existing ones switch with the next VACUUM
+            self._db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
             # Check schema version, upgrade if necessary
             schema.upgrade(self._db, self.database_file)
 
+            self._set_journal_mode()
+
             # Sanity checks for the data in the database
             schema.check_data(self)
 
             logger.debug('Database opened.')
         return self._db
 
+    def _set_journal_mode(self):
+        journal_mode = self._db.execute('PRAGMA journal_mode').fetchone()[0].lower()
+        if self.wal and journal_mode != 'wal':
+            journal_mode = self._db.execute('PRAGMA journal_mode = WAL').fetchone()[0].lower()
+            if journal_mode != 'wal':
+                logger.warning('Cannot use write-ahead logging (journal mode: %s)', journal_mode)
+                self.wal = False
+        elif not self.wal and journal_mode == 'wal':
+            # The journal mode is stored in the database file
+            self._db.execute('PRAGMA journal_mode = DELETE')
+
+        if self.wal:
+            # Safe with WAL: a power loss can only lose the last commits
+            self._db.execute('PRAGMA synchronous = NORMAL')
+
     def cursor(self):
+        # Queries on the writer connection see the pending saves
+        self._write_pending()
         return self.db.cursor()
 
+    def _write_cursor(self):
+        self._writing_threads.add(threading.get_ident())
+        self._forget_statistics()
+        return self.cursor()
+
+    def _connect_reader(self):
+        uri = 'file:%s?mode=ro' % urllib.request.pathname2url(os.path.abspath(self.database_file))
+        return sqlite.connect(uri, uri=True, check_same_thread=False)
+
+    @contextlib.contextmanager
+    def _read_cursor(self):
+        """Cursor for queries that don't modify the database
+
+        Without write-ahead logging, or if this thread has uncommitted
+        changes, this is a cursor of the writer connection (holding the
+        lock). Otherwise it is a cursor of a read-only connection from a
+        pool, which sees the last committed state of the database.
+        """
+        # Open (and upgrade) the database before any reader
+        self.db
+
+        if not self.wal or threading.get_ident() in self._writing_threads:
+            with self.lock:
+                cur = self.cursor()
+                try:
+                    yield cur
+                finally:
+                    cur.close()
+            return
+
+        try:
+            reader = self._readers.get_nowait()
+        except queue.Empty:
+            reader = self._connect_reader()
+
+        cur = reader.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+            self._readers.put(reader)
+
+    @contextlib.contextmanager
+    def deferred_commits(self):
+        """Turn commit() calls into a single commit at the end
+
+        For bulk operations that call code committing after every
+        podcast, like subscribing to many podcasts at once.
+        """
+        with self.lock:
+            self._deferred_commits += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._deferred_commits -= 1
+            self.commit()
+
     def commit(self):
+        """Commit the changes (with write-behind: soon, on the writer thread)"""
+        if self.write_behind:
+            with self._pending_condition:
+                self._commit_requested = True
+                self._start_writer()
+                self._pending_condition.notify()
+        else:
+            self._commit()
+
+    def flush(self):
+        """Write the pending saves and commit now
+
+        For shutdown and for code that needs the changes to be in the
+        database file (e.g. for other processes).
+        """
+        self._write_pending()
+        self._commit()
+
+    def _queue_save(self, o, table, columns):
+        if not o.get_changed_columns(columns):
+            return
+
+        # This thread reads from the writer, where it sees the pending saves
+        self._writing_threads.add(threading.get_ident())
+        self._forget_statistics()
+        with self._pending_condition:
+            # Saving the same object again adds nothing: its changed columns are
+            # written together (the key is the object, it is kept alive here)
+            self._pending.setdefault((table, id(o)), (o, columns))
+            self._start_writer()
+            if len(self._pending) >= self.WRITE_BEHIND_MAX_PENDING:
+                self._pending_condition.notify()
+
+    @telemetry.timed('db')
+    def _write_pending(self):
+        with self._pending_condition:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, collections.OrderedDict()
+
+        groups = collections.defaultdict(list)
+        for (table, key), (o, columns) in pending.items():
+            groups[(table, columns)].append(o)
+
+        with self.lock:
+            for (table, columns), objects in groups.items():
+                self._save_objects(objects, table, columns)
+                if table == self.TABLE_EPISODE:
+                    self._forget_episode_texts(o.id for o in objects)
+
+    def _start_writer(self):
+        # Called with _pending_condition held
+        if self._writer_thread is None and not self._stopping:
+            self._writer_thread = threading.Thread(target=self._writer, name='DatabaseWriter', daemon=True)
+            self._writer_thread.start()
+
+    def _stop_writer(self):
+        with self._pending_condition:
+            self._stopping = True
+            self._pending_condition.notify()
+            thread, self._writer_thread = self._writer_thread, None
+        if thread is not None:
+            thread.join()
+
+    def _writer(self):
+        while True:
+            with self._pending_condition:
+                while not (self._pending or self._commit_requested or self._stopping):
+                    self._pending_condition.wait()
+
+                # Let more saves of the same rows come in
+                deadline = time.monotonic() + self.WRITE_BEHIND_DELAY
+                while not self._stopping and len(self._pending) < self.WRITE_BEHIND_MAX_PENDING:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._pending_condition.wait(timeout)
+
+                self._commit_requested = False
+                if self._stopping:
+                    return
+
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('Cannot write pending changes: %s', e, exc_info=True)
+
+    @telemetry.timed('db')
+    def _commit(self):
         with self.lock:
+            if self._deferred_commits:
+                return
+
             try:
                 logger.debug('Commit.')
                 self.db.commit()
             except Exception as e:
                 logger.error('Cannot commit: %s', e, exc_info=True)
+            self._writing_threads.clear()
+            # Readers of other threads can see the committed changes now
+            self._forget_statistics()
 
     def get_content_types(self, pid):
         """Given a podcast ID, returns the content types"""
-        with self.lock:
-            cur = self.cursor()
+        with self._read_cursor() as cur:
             cur.execute('SELECT mime_type FROM %s WHERE podcast_id = ?' % self.TABLE_EPISODE, (pid,))
-            for (mime_type,) in cur:
-                yield mime_type
-            cur.close()
+            mime_types = [mime_type for (mime_type,) in cur]
+
+        yield from mime_types
+
+    def _forget_statistics(self):
+        self._statistics_generation += 1
+        self._statistics = None
+
+    def _get_all_statistics(self):
+        """Return a dict: podcast ID -> (total, deleted, new, downloaded, unplayed)
+
+        The podcast_statistics table (kept up to date by triggers) is read
+        at once and cached until the next change of the database.
+        """
+        # With WAL, a thread that has uncommitted changes sees more than the others
+        shared = not self.wal or threading.get_ident() not in self._writing_threads
+        statistics = self._statistics
+        if statistics is not None and shared:
+            return statistics
+
+        generation = self._statistics_generation
+        with self._read_cursor() as cur:
+            cur.execute('SELECT podcast_id, %s FROM %s' % (', '.join(name for name, condition in schema.StatisticsCounters),
+                                                           self.TABLE_PODCAST_STATISTICS))
+            statistics = {row[0]: row[1:] for row in cur}
+
+        # Don't keep it if the database has changed while reading
+        if shared and generation == self._statistics_generation:
+            self._statistics = statistics
+        return statistics
 
     def get_podcast_statistics(self, podcast_id=None):
         """Given a podcast ID, returns the statistics for it
@@ -121,36 +514,16 @@ class Database(object):
 
         Returns a tuple (total, deleted, new, downloaded, unplayed)
         """
-        total, deleted, new, downloaded, unplayed = 0, 0, 0, 0, 0
-
-        with self.lock:
-            cur = self.cursor()
-            if podcast_id is not None:
-                cur.execute('SELECT COUNT(*), state, is_new FROM %s '
-                            'WHERE podcast_id = ? GROUP BY state, is_new'
-                            % self.TABLE_EPISODE, (podcast_id,))
-            else:
-                cur.execute('SELECT COUNT(*), state, is_new FROM %s '
-                            'GROUP BY state, is_new' % self.TABLE_EPISODE)
-            for count, state, is_new in cur:
-                total += count
-                if state == gpodder.STATE_DELETED:
-                    deleted += count
-                elif state == gpodder.STATE_NORMAL and is_new:
-                    new += count
-                elif state == gpodder.STATE_DOWNLOADED:
-                    downloaded += count
-                    if is_new:
-                        unplayed += count
-
-            cur.close()
+        statistics = self._get_all_statistics()
+        if podcast_id is not None:
+            return statistics.get(podcast_id, (0, 0, 0, 0, 0))
 
-        return (total, deleted, new, downloaded, unplayed)
+        return tuple(map(sum, zip((0, 0, 0, 0, 0), *statistics.values())))
 
     def load_podcasts(self, factory):
         logger.info('Loading podcasts')
 
-        sql = 'SELECT * FROM %s' % self.TABLE_PODCAST
+        sql = 'SELECT %s FROM %s' % (', '.join(('id',) + schema.PodcastColumns), self.TABLE_PODCAST)
 
         with self.lock:
             cur = self.cursor()
@@ -162,47 +535,274 @@ class Database(object):
 
         return result
 
+    @telemetry.timed('db')
     def load_episodes(self, podcast, factory):
         assert podcast.id
 
         logger.info('Loading episodes for podcast %d', podcast.id)
 
-        sql = 'SELECT * FROM %s WHERE podcast_id = ? ORDER BY published DESC' % self.TABLE_EPISODE
+        sql = 'SELECT %s FROM %s WHERE podcast_id = ? ORDER BY published DESC' % (self._episode_columns(), self.TABLE_EPISODE)
         args = (podcast.id,)
 
-        with self.lock:
-            cur = self.cursor()
+        with self._read_cursor() as cur:
             cur.execute(sql, args)
 
             keys = [desc[0] for desc in cur.description]
-            result = [factory(dict(list(zip(keys, row)))) for row in cur]
-            cur.close()
+            rows = cur.fetchall()
+
+        result = [factory(dict(list(zip(keys, row)))) for row in rows]
 
         return result
 
+    def _episode_columns(self):
+        # The lazy columns are loaded by get_episode_texts() when needed
+        return ', '.join(('id',) + tuple(name for name in schema.EpisodeColumns if name not in schema.EpisodeLazyColumns))
+
+    @telemetry.timed('db')
+    def load_all_episodes(self, factories):
+        """Load the episodes of many podcasts with one query
+
+        "factories" maps podcast IDs to the episode factory of each
+        podcast, it can be all podcasts or a chunk of them. The episodes
+        are read in one scan ordered by podcast and grouped; for more than
+        MAX_IDS_PER_STATEMENT podcasts, the whole table is scanned.
+
+        Returns a dict: podcast ID -> list of episodes (newest first)
+        """
+        result = {podcast_id: [] for podcast_id in factories}
+        if not result:
+            return result
+
+        logger.info('Loading episodes for %d podcasts', len(result))
+
+        sql = 'SELECT %s FROM %s' % (self._episode_columns(), self.TABLE_EPISODE)
+        args = []
+        if len(result) <= self.MAX_IDS_PER_STATEMENT:
+            sql += ' WHERE podcast_id IN (%s)' % ', '.join('?' * len(result))
+            args = list(result)
+        sql += ' ORDER BY podcast_id, published DESC'
+
+        with self._read_cursor() as cur:
+            cur.execute(sql, args)
+
+            keys = [desc[0] for desc in cur.description]
+            for podcast_id, rows in itertools.groupby(cur, key=operator.itemgetter(keys.index('podcast_id'))):
+                factory = factories.get(podcast_id)
+                if factory is not None:
+                    result[podcast_id] = [factory(dict(zip(keys, row))) for row in rows]
+
+        return result
+
+    @telemetry.timed('db')
+    def get_episode_texts(self, episode_id):
+        """Return the lazy columns of an episode
+
+        Returns a dict with the values of schema.EpisodeLazyColumns.
+        The recently used ones are cached, the dict can also hold values
+        derived from them (they are dropped together).
+        """
+        texts = self._episode_texts.get(episode_id)
+        if texts is not None:
+            return texts
+
+        with self._read_cursor() as cur:
+            cur.execute('SELECT %s FROM %s WHERE id = ?' % (', '.join(schema.EpisodeLazyColumns), self.TABLE_EPISODE),
+                        (episode_id,))
+            row = cur.fetchone()
+
+        if row is None:
+            row = ('', '', None)
+        texts = dict(zip(schema.EpisodeLazyColumns, row))
+        self._episode_texts.put(episode_id, texts)
+        return texts
+
+    def load_episode_texts(self, episode_ids):
+        """Return the lazy columns of many episodes
+
+        Reads them with one query per MAX_IDS_PER_STATEMENT episodes,
+        without caching them. Returns a dict: episode ID -> dict like
+        get_episode_texts() (without the derived values).
+        """
+        ids = list(episode_ids)
+        result = {}
+        with self._read_cursor() as cur:
+            for start in range(0, len(ids), self.MAX_IDS_PER_STATEMENT):
+                chunk = ids[start:start + self.MAX_IDS_PER_STATEMENT]
+                cur.execute('SELECT id, %s FROM %s WHERE id IN (%s)' % (', '.join(schema.EpisodeLazyColumns),
+                            self.TABLE_EPISODE, ', '.join('?' * len(chunk))), chunk)
+                for row in cur:
+                    result[row[0]] = dict(zip(schema.EpisodeLazyColumns, row[1:]))
+        return result
+
+    def _forget_episode_texts(self, ids=None):
+        """Drop cached lazy columns of the given episode IDs (None: all)"""
+        if ids is None:
+            self._episode_texts.clear()
+        else:
+            for episode_id in ids:
+                self._episode_texts.pop(episode_id)
+
+    @telemetry.timed('db')
+    def get_cover_thumb(self, podcast_id):
+        """Return the cover thumbnail of a podcast (PNG data) or None"""
+        data = self._cover_thumbs.get(podcast_id, False)
+        if data is not False:
+            return data
+
+        with self._read_cursor() as cur:
+            cur.execute('SELECT data FROM %s WHERE podcast_id = ?' % self.TABLE_PODCAST_COVER_THUMB, (podcast_id,))
+            row = cur.fetchone()
+
+        data = bytes(row[0]) if row is not None else None
+        self._cover_thumbs.put(podcast_id, data)
+        return data
+
+    @telemetry.timed('db')
+    def save_cover_thumb(self, podcast_id, data):
+        """Store (or with data=None, remove) the cover thumbnail of a podcast"""
+        if self.get_cover_thumb(podcast_id) == data:
+            return
+
+        with self.lock:
+            cur = self._write_cursor()
+            if data is None:
+                cur.execute('DELETE FROM %s WHERE podcast_id = ?' % self.TABLE_PODCAST_COVER_THUMB, (podcast_id,))
+            else:
+                cur.execute('INSERT OR REPLACE INTO %s (podcast_id, data) VALUES (?, ?)' % self.TABLE_PODCAST_COVER_THUMB,
+                            (podcast_id, data))
+            cur.close()
+            self._cover_thumbs.put(podcast_id, data)
+
     def delete_podcast(self, podcast):
         assert podcast.id
 
+        self._forget_episode_texts()
+        self._cover_thumbs.pop(podcast.id)
         with self.lock:
-            cur = self.cursor()
+            cur = self._write_cursor()
             logger.debug('delete_podcast: %d (%s)', podcast.id, podcast.url)
 
             cur.execute("DELETE FROM %s WHERE id = ?" % self.TABLE_PODCAST, (podcast.id, ))
             cur.execute("DELETE FROM %s WHERE podcast_id = ?" % self.TABLE_EPISODE, (podcast.id, ))
 
             cur.close()
-            self.db.commit()
+            self.commit()
 
     def save_podcast(self, podcast):
-        self._save_object(podcast, self.TABLE_PODCAST, schema.PodcastColumns)
+        self.save_podcasts([podcast])
 
     def save_episode(self, episode):
-        self._save_object(episode, self.TABLE_EPISODE, schema.EpisodeColumns)
+        self.save_episodes([episode])
+
+    def save_podcasts(self, podcasts):
+        self._save(podcasts, self.TABLE_PODCAST, schema.PodcastColumns)
+
+    def save_episodes(self, episodes):
+        self._forget_episode_texts(episode.id for episode in episodes if episode.id is not None)
+        self._save(episodes, self.TABLE_EPISODE, schema.EpisodeColumns)
+
+    def _save(self, objects, table, columns):
+        if not self.write_behind:
+            if len(objects) == 1:
+                self._save_object(objects[0], table, columns)
+            else:
+                self._save_objects(objects, table, columns)
+            return
+
+        # New objects need their ID now, they are inserted right away
+        existing = [o for o in objects if o.id is not None]
+        inserts = [o for o in objects if o.id is None]
+        if inserts:
+            self._save_objects(inserts, table, columns)
+        for o in existing:
+            self._queue_save(o, table, columns)
+
+    @telemetry.timed('db')
+    def _save_objects(self, objects, table, columns):
+        """Save many objects using one statement per kind of change
+
+        New objects are inserted with a single executemany() and get
+        consecutive IDs assigned. Existing objects are grouped by the
+        set of columns that changed, each group is one executemany().
+        Nothing is written (and no IDs are assigned) if one of them fails.
+        """
+        with self.lock:
+            # Changes made while saving are written by the next save
+            inserts = []
+            updates = collections.defaultdict(list)
+            for o in objects:
+                changed = tuple(o.take_changed_columns(columns))
+                if o.id is None:
+                    inserts.append(o)
+                elif changed:
+                    updates[changed].append(o)
+
+            if not inserts and not updates:
+                return
+
+            savepoint = False
+            try:
+                cur = self._write_cursor()
+                # The savepoint would commit when released outside of a transaction
+                if not self.db.in_transaction:
+                    cur.execute('BEGIN')
+                cur.execute('SAVEPOINT save_objects')
+                savepoint = True
+
+                ids = []
+                if inserts:
+                    # executemany() does not report the row IDs, so assign
+                    # them here, like SQLite would do for each INSERT
+                    next_id = (self.get('SELECT MAX(id) FROM %s' % table) or 0) + 1
+                    rows = []
+                    for o in inserts:
+                        rows.append([next_id] + [util.convert_bytes(getattr(o, name)) for name in columns])
+                        next_id += 1
+
+                    qmarks = ', '.join('?' * (len(columns) + 1))
+                    sql = 'INSERT INTO %s (id, %s) VALUES (%s)' % (table, ', '.join(columns), qmarks)
+                    cur.executemany(sql, rows)
+                    ids = [row[0] for row in rows]
+
+                for changed, group in updates.items():
+                    rows = []
+                    for o in group:
+                        rows.append([util.convert_bytes(getattr(o, name)) for name in changed] + [o.id])
+
+                    qmarks = ', '.join('%s = ?' % name for name in changed)
+                    sql = 'UPDATE %s SET %s WHERE id = ?' % (table, qmarks)
+                    cur.executemany(sql, rows)
+
+                cur.execute('RELEASE save_objects')
+                for o, id in zip(inserts, ids):
+                    o.id = id
+            except Exception as e:
+                logger.error('Cannot save %d objects in %s: %s', len(inserts) + sum(len(group) for group in updates.values()),
+                             table, e, exc_info=True)
+                if savepoint:
+                    cur.execute('ROLLBACK TO save_objects')
+                    cur.execute('RELEASE save_objects')
+                for o in inserts:
+                    o.mark_unsaved(columns)
+                for changed, group in updates.items():
+                    for o in group:
+                        o.mark_unsaved(changed)
+
+            cur.close()
 
+    @telemetry.timed('db')
     def _save_object(self, o, table, columns):
         with self.lock:
+            # Only write the columns that were modified since the last save,
+            # changes made while saving are written by the next save
+            changed = o.take_changed_columns(columns)
+            if o.id is not None:
+                columns = changed
+                if not columns:
+                    return
+
             try:
-                cur = self.cursor()
+                cur = self._write_cursor()
                 values = [util.convert_bytes(getattr(o, name))
                         for name in columns]
 
@@ -218,9 +818,11 @@ class Database(object):
                     cur.execute(sql, values)
             except Exception as e:
                 logger.error('Cannot save %s: %s', o, e, exc_info=True)
+                o.mark_unsaved(changed)
 
             cur.close()
 
+    @telemetry.timed('db')
     def get(self, sql, params=None):
         """
         Returns the first cell of a query result, useful for COUNT()s.
@@ -265,8 +867,31 @@ class Database(object):
         """
         Look up the most recent publish date of a podcast.
         """
-        return self.get('SELECT MAX(published) FROM %s WHERE podcast_id = ?' % self.TABLE_EPISODE, (podcast.id,))
+        return self.get('SELECT published FROM %s WHERE podcast_id = ? ORDER BY published DESC LIMIT 1' % self.TABLE_EPISODE,
+                        (podcast.id,))
+
+    def get_youtube_duration(self, video_id):
+        """
+        Look up the cached duration of a YouTube video.
+        Returns (total_time, checked) or None if it is not cached.
+        """
+        with self.lock:
+            cur = self.cursor()
+            cur.execute('SELECT total_time, checked FROM %s WHERE video_id = ?' % self.TABLE_YOUTUBE_DURATION,
+                        (video_id,))
+            row = cur.fetchone()
+            cur.close()
 
+        return row
+
+    def set_youtube_duration(self, video_id, total_time):
+        with self.lock:
+            cur = self._write_cursor()
+            cur.execute('INSERT OR REPLACE INTO %s (video_id, total_time, checked) VALUES (?, ?, ?)' %
+                        self.TABLE_YOUTUBE_DURATION, (video_id, total_time, int(time.time())))
+            cur.close()
+
+    @telemetry.timed('db')
     def delete_episode_by_guid(self, guid, podcast_id):
         """
         Deletes episodes that have a specific GUID for
@@ -275,7 +900,8 @@ class Database(object):
         """
         guid = util.convert_bytes(guid)
 
+        self._forget_episode_texts()
         with self.lock:
-            cur = self.cursor()
+            cur = self._write_cursor()
             cur.execute('DELETE FROM %s WHERE podcast_id = ? AND guid = ?' %
                     self.TABLE_EPISODE, (podcast_id, guid))
@@ -36,8 +36,6 @@ import time
 import urllib.error
 from abc import ABC, abstractmethod
 
-import requests
-from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, HTTPError, RequestException
 from requests.packages.urllib3.exceptions import MaxRetryError
 from requests.packages.urllib3.util.retry import Retry
@@ -227,22 +225,21 @@ class DownloadURLOpener:
         self.channel = channel
         self.max_retries = max_retries
 
-    def init_session(self):
-        """ init a session with our own retry codes + retry count """
+    def retry_strategy(self):
+        """ our own retry codes + retry count """
         # I add a few retries for redirects but it means that I will allow max_retries + REDIRECT_RETRIES
         # if encountering max_retries connect and REDIRECT_RETRIES read for instance
-        retry_strategy = Retry(
+        return Retry(
             total=self.max_retries + REDIRECT_RETRIES,
             connect=self.max_retries,
             read=self.max_retries,
             redirect=max(REDIRECT_RETRIES, self.max_retries),
             status=self.max_retries,
             status_forcelist=Retry.RETRY_AFTER_STATUS_CODES.union((408, 418, 504, 598, 599,)))
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        http = requests.Session()
-        http.mount("https://", adapter)
-        http.mount("http://", adapter)
-        return http
+
+    def init_session(self):
+        """ get a shared session using our retry strategy (see util.get_session) """
+        return util.get_session('download-%d' % self.max_retries, self.retry_strategy)
 
 # The following is based on Python's urllib.py "URLopener.retrieve"
 # Also based on http://mail.python.org/pipermail/python-list/2001-October/110069.html
@@ -37,7 +37,7 @@ import os
 import re
 
 import gpodder
-from gpodder import util
+from gpodder import telemetry, util
 
 _ = gpodder.gettext
 
@@ -74,7 +74,8 @@ def call_extensions(func):
 
                 # If the results are lists, concatenate them to show all
                 # possible items that are generated by all extension together
-                cb_res = callback(*args, **kwargs)
+                with telemetry.phase('hooks'):
+                    cb_res = callback(*args, **kwargs)
                 if isinstance(result, list) and isinstance(cb_res, list):
                     result.extend(cb_res)
                 elif cb_res is not None:
@@ -22,12 +22,15 @@
 # Thomas Perl <thp@gpodder.org>; 2009-06-11
 #
 
+import email.utils
 import logging
+import threading
+import time
 import urllib.parse
 from html.parser import HTMLParser
 from io import BytesIO
 
-from gpodder import util, youtube
+from gpodder import telemetry, util, youtube
 
 logger = logging.getLogger(__name__)
 
@@ -43,12 +46,14 @@ class ExceptionWithData(Exception):
 
 
 # Temporary errors
+# For "429 Too Many Requests" and "503 Service Unavailable", retry_after
+# is the number of seconds the server asked us to wait (or None)
 class BadRequest(Exception):
-    pass
+    retry_after = None
 
 
 class InternalServerError(Exception):
-    pass
+    retry_after = None
 
 
 class WifiLogin(ExceptionWithData):
@@ -80,13 +85,90 @@ class AuthenticationRequired(Exception):
 
 
 # Successful status codes
-UPDATED_FEED, NEW_LOCATION, NOT_MODIFIED = list(range(3))
+# SKIPPED: not requested, the last response is still fresh
+# or the server asked us to retry later
+UPDATED_FEED, NEW_LOCATION, NOT_MODIFIED, SKIPPED = list(range(4))
+
+# Upper limit for the time a feed is considered fresh, and for the time
+# we wait because of Retry-After, so a broken server can't stop updates
+MAX_FRESHNESS = 24 * 60 * 60
+MAX_RETRY_AFTER = 7 * 24 * 60 * 60
 
 
 class Result:
-    def __init__(self, status, feed=None):
+    def __init__(self, status, feed=None, expires=None, location_result=None):
         self.status = status
         self.feed = feed
+        # Unix timestamp until which the response is fresh (or None)
+        self.expires = expires
+        # For NEW_LOCATION: the Result of the new URL, if it has been
+        # fetched already (None: it has to be fetched)
+        self.location_result = location_result
+
+
+def _parse_http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def get_expires(headers, now=None):
+    """Return the time until which a response is fresh, or None
+
+    Uses max-age from Cache-Control, or else the Expires header (relative
+    to the Date header, in case the clocks differ).
+    """
+    if now is None:
+        now = time.time()
+
+    directives = {}
+    for directive in headers.get('cache-control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+
+    if 'no-cache' in directives or 'no-store' in directives:
+        return None
+
+    lifetime = None
+    if 'max-age' in directives:
+        try:
+            lifetime = int(directives['max-age'])
+        except ValueError:
+            return None
+        try:
+            lifetime -= int(headers.get('age', 0))
+        except ValueError:
+            pass
+    elif 'expires' in headers:
+        expires = _parse_http_date(headers['expires'])
+        if expires is None:
+            # Invalid dates (like "0") mean already expired
+            return None
+        lifetime = expires - (_parse_http_date(headers.get('date')) or now)
+
+    if lifetime is None or lifetime <= 0:
+        return None
+    return now + min(lifetime, MAX_FRESHNESS)
+
+
+def get_retry_after(headers, now=None):
+    """Return the seconds to wait according to Retry-After, or None"""
+    if now is None:
+        now = time.time()
+
+    value = headers.get('retry-after', '').strip()
+    if value.isdigit():
+        seconds = int(value)
+    else:
+        retry_at = _parse_http_date(value)
+        if retry_at is None:
+            return None
+        seconds = retry_at - now
+
+    if seconds <= 0:
+        return None
+    return min(seconds, MAX_RETRY_AFTER)
 
 
 class FeedAutodiscovery(HTMLParser):
@@ -116,9 +198,23 @@ class FeedAutodiscovery(HTMLParser):
 
 
 class FetcherFeedData:
-    def __init__(self, text, content):
-        self.text = text
-        self.content = content
+    """Raw data of a fetched feed
+
+    The body is only read (and decoded to text) on first access, so
+    that a parser reading the response stream can skip keeping a copy.
+    """
+    def __init__(self, response):
+        self._response = response
+
+    @property
+    def text(self):
+        with telemetry.phase('transfer'):
+            return self._response.text
+
+    @property
+    def content(self):
+        with telemetry.phase('transfer'):
+            return self._response.content
 
 
 class Fetcher(object):
@@ -129,6 +225,36 @@ class Fetcher(object):
                   'application/xml',
                   'text/xml')
 
+    # If True, parse_feed() gets the (decompressed) response body as a
+    # stream that is read while it is being downloaded, instead of a
+    # BytesIO of the complete body.
+    STREAMING = False
+
+    # Feed URLs found for web pages (autodiscovery), shared by all fetchers:
+    # page URL -> (feed URL, time when the entry expires)
+    LOCATION_CACHE_TTL = 24 * 60 * 60
+    LOCATION_CACHE_SIZE = 1000
+    _location_cache = {}
+    _location_cache_lock = threading.Lock()
+
+    @classmethod
+    def _get_cached_location(cls, url):
+        with cls._location_cache_lock:
+            location, expires = cls._location_cache.get(url, (None, 0))
+            if expires < time.time():
+                cls._location_cache.pop(url, None)
+                return None
+            return location
+
+    @classmethod
+    def _cache_location(cls, url, location):
+        with cls._location_cache_lock:
+            cls._location_cache.pop(url, None)
+            cls._location_cache[url] = (location, time.time() + cls.LOCATION_CACHE_TTL)
+            while len(cls._location_cache) > cls.LOCATION_CACHE_SIZE:
+                # Dicts are ordered, drop the oldest entry
+                del cls._location_cache[next(iter(cls._location_cache))]
+
     def _resolve_url(self, url):
         """Provide additional ways of resolving an URL
 
@@ -167,7 +293,9 @@ class Fetcher(object):
         """
         kwargs are passed from Fetcher.fetch
         :param str url: real url
-        :param data_stream: file-like object to read from (bytes mode)
+        :param FetcherFeedData feed_data: raw response data (read on demand)
+        :param data_stream: file-like object to read from (bytes mode),
+                            not seekable if STREAMING is set
         :param dict-like headers: response headers (may be empty)
         :param int status: always UPDATED_FEED for now
         :return Result: Result(status, model.Feed from parsed data_stream)
@@ -182,6 +310,12 @@ class Fetcher(object):
             stream = open(url)
             return self.parse_feed(url, None, stream, {}, UPDATED_FEED, **kwargs)
 
+        if autodiscovery:
+            location = self._get_cached_location(url)
+            if location is not None:
+                logger.debug('Feed autodiscovery (cached): %s => %s', url, location)
+                return Result(NEW_LOCATION, location)
+
         # remote feed
         headers = {}
         if modified is not None:
@@ -189,18 +323,45 @@ class Fetcher(object):
         if etag is not None:
             headers['If-None-Match'] = etag
 
-        stream = util.urlopen(url, headers)
-
+        # Time until the response headers arrived (without streaming, the body too)
+        with telemetry.phase('ttfb'):
+            stream = util.urlopen(url, headers, stream=self.STREAMING)
+        try:
+            return self._handle_response(url, stream, autodiscovery, **kwargs)
+        finally:
+            # Bytes received, before decompression
+            telemetry.add_bytes(stream.raw.tell())
+            stream.close()
+
+    def _handle_response(self, url, stream, autodiscovery, **kwargs):
         responses = stream.history + [stream]
         for i, resp in enumerate(responses):
             if resp.is_permanent_redirect:
                 # there should always be a next response when a redirect is encountered
                 # If max redirects is reached, TooManyRedirects is raised
-                # TODO: since we've got the end contents anyway, modify model.py to accept contents on NEW_LOCATION
-                return Result(NEW_LOCATION, responses[i + 1].url)
-        res = self._check_statuscode(stream.status_code, stream.url)
+                location = responses[i + 1].url
+                # The content at the new location has been received already,
+                # if it can't be used here, the caller fetches it again
+                try:
+                    location_result = self._handle_content(location, stream, autodiscovery, **kwargs)
+                except Exception:
+                    logger.debug('Cannot use the response from %s', location, exc_info=True)
+                    location_result = None
+                return Result(NEW_LOCATION, location, location_result=location_result)
+
+        return self._handle_content(url, stream, autodiscovery, **kwargs)
+
+    def _handle_content(self, url, stream, autodiscovery, **kwargs):
+        try:
+            res = self._check_statuscode(stream.status_code, stream.url)
+        except (BadRequest, InternalServerError) as e:
+            if stream.status_code in (429, 503):
+                e.retry_after = get_retry_after(stream.headers)
+            raise
+
+        expires = get_expires(stream.headers)
         if res == NOT_MODIFIED:
-            return Result(NOT_MODIFIED, stream.url)
+            return Result(NOT_MODIFIED, stream.url, expires)
 
         if autodiscovery and stream.headers.get('content-type', '').startswith('text/html'):
             ad = FeedAutodiscovery(url)
@@ -208,18 +369,29 @@ class Fetcher(object):
             ad.feed(util.response_text(stream))
             if ad._resolved_url and ad._resolved_url != url:
                 try:
-                    self.fetch(ad._resolved_url, etag=None, modified=None, autodiscovery=False, **kwargs)
-                    return Result(NEW_LOCATION, ad._resolved_url)
+                    # Make sure it is a feed, the caller can use the result for the new location
+                    location_result = self.fetch(ad._resolved_url, etag=None, modified=None, autodiscovery=False, **kwargs)
+                    self._cache_location(url, ad._resolved_url)
+                    return Result(NEW_LOCATION, ad._resolved_url, location_result=location_result)
                 except Exception:
                     logger.warning('Feed autodiscovery failed', exc_info=True)
 
             # Second, try to resolve the URL
             new_url = self._resolve_url(url)
             if new_url and new_url != url:
+                self._cache_location(url, new_url)
                 return Result(NEW_LOCATION, new_url)
 
         # xml documents specify the encoding inline so better pass encoded body.
         # Especially since requests will use ISO-8859-1 for content-type 'text/xml'
         # if the server doesn't specify a charset.
-        return self.parse_feed(url, FetcherFeedData(stream.text, stream.content), BytesIO(stream.content), stream.headers,
-                            UPDATED_FEED, **kwargs)
+        if self.STREAMING:
+            stream.raw.decode_content = True
+            data_stream = stream.raw
+        else:
+            with telemetry.phase('transfer'):
+                data_stream = BytesIO(stream.content)
+        result = self.parse_feed(url, FetcherFeedData(stream), data_stream, stream.headers,
+                                 UPDATED_FEED, **kwargs)
+        result.expires = expires
+        return result
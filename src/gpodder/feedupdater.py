@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2023 The gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# gpodder.feedupdater - Concurrent and scheduled feed updates shared by all UIs
+
+import collections
+import concurrent.futures
+import logging
+import statistics
+import time
+import urllib.parse
+
+from gpodder import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+class FeedUpdater(object):
+    """Update a list of podcasts using a bounded pool of fetch workers
+
+    Fetching and parsing (PodcastChannel.fetch_feed) runs on up to
+    max_workers threads, with no more than max_per_host of them
+    requesting feeds from the same host name at any time.
+
+    The results are applied (PodcastChannel.update_from_result) one by
+    one on the thread that called update(), so all database writes and
+    extension hooks stay serialized.
+    """
+
+    def __init__(self, max_workers=4, max_per_host=2):
+        self.max_workers = max(1, int(max_workers))
+        self.max_per_host = max(1, int(max_per_host))
+
+    @staticmethod
+    def host_of(channel):
+        return urllib.parse.urlsplit(channel.url or '').hostname or ''
+
+    def update(self, channels, max_episodes=0, progress_callback=None,
+               is_cancelled=None, force=False):
+        """Update all podcasts in "channels"
+
+        progress_callback(channel, new_episodes, error, position, total)
+        is called on the calling thread after each podcast has been
+        processed; "error" is the exception or None on success.
+
+        is_cancelled() is checked between podcasts; once it returns
+        True, no new fetches are started. Fetches that are already
+        running are allowed to finish and their results are applied.
+
+        Set "force" when the user asked to update these podcasts: they
+        are fetched even if still fresh or backing off after failed
+        updates (see PodcastChannel.fetch_feed).
+
+        The timings of the updated podcasts are stored for "gpo stats".
+
+        Returns the list of all new episodes.
+        """
+        channels = list(channels)
+        total = len(channels)
+        run = telemetry.UpdateRun()
+
+        # Podcasts waiting for a free worker, grouped by host name
+        pending = collections.OrderedDict()
+        for channel in channels:
+            pending.setdefault(self.host_of(channel), collections.deque()).append(channel)
+
+        running = {}
+        per_host = collections.Counter()
+        position = 0
+        new_episodes = []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                   thread_name_prefix='FeedUpdater') as executor:
+            while pending or running:
+                if is_cancelled is not None and is_cancelled():
+                    if pending:
+                        logger.info('Feed update cancelled')
+                    pending.clear()
+
+                for host in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+
+                    queue = pending[host]
+                    while (queue and len(running) < self.max_workers
+                           and per_host[host] < self.max_per_host):
+                        channel = queue.popleft()
+                        logger.debug('Fetching %s', channel.url)
+                        future = executor.submit(channel.fetch_feed, max_episodes, force)
+                        running[future] = (channel, host)
+                        per_host[host] += 1
+
+                    if not queue:
+                        del pending[host]
+
+                if not running:
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    channel, host = running.pop(future)
+                    per_host[host] -= 1
+                    position += 1
+
+                    episodes, error = self._apply(channel, future, max_episodes)
+                    run.add(getattr(channel, 'last_timings', None))
+                    new_episodes.extend(episodes)
+                    if progress_callback is not None:
+                        progress_callback(channel, episodes, error, position, total)
+
+        run.finish()
+        telemetry.save_run(run)
+        return new_episodes
+
+    def _apply(self, channel, future, max_episodes):
+        try:
+            result = future.result()
+        except Exception as e:
+            channel.update_failed(e)
+            return [], e
+
+        try:
+            return channel.update_from_result(result, max_episodes), None
+        except Exception as e:
+            return [], e
+
+
+class FeedScheduler(object):
+    """Decide when each podcast should be checked for new episodes
+
+    The polling interval of a podcast follows its publishing cadence,
+    the median time between its most recent episodes. A feed is checked
+    a few times per expected episode, and less often for every check in
+    a row that brought nothing new (unchanged_checks). The interval is
+    kept between min_interval and max_interval (in seconds).
+
+    When the next episode is expected before the end of the interval,
+    the podcast is checked at that time instead, so regular podcasts
+    are not delayed by a longer interval.
+    """
+    # Number of recent publish dates used to determine the cadence
+    RECENT_EPISODES = 10
+
+    # Checks per expected episode, and the maximum backoff factor
+    CHECKS_PER_EPISODE = 4
+    MAX_BACKOFF = 4
+
+    # Podcasts due within this many seconds are considered due now
+    TOLERANCE = 60
+
+    def __init__(self, min_interval, max_interval, honor_cache_headers=True):
+        self.min_interval = max(60, int(min_interval))
+        self.max_interval = max(self.min_interval, int(max_interval))
+        self.honor_cache_headers = honor_cache_headers
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a scheduler from the "auto.update" settings"""
+        min_interval = 60 * config.auto.update.frequency
+        if config.auto.update.adaptive:
+            max_interval = 60 * config.auto.update.max_interval
+        else:
+            max_interval = min_interval
+        return cls(min_interval, max_interval, config.limit.feed_updates.honor_cache_headers)
+
+    def cadence(self, channel):
+        """Median seconds between recent episodes, or None if unknown"""
+        published = sorted((e.published for e in channel.children if e.published), reverse=True)
+        published = published[:self.RECENT_EPISODES + 1]
+        if len(published) < 2:
+            return None
+        return statistics.median(a - b for a, b in zip(published, published[1:]))
+
+    def interval(self, channel):
+        """Seconds to wait between two checks of the podcast"""
+        cadence = self.cadence(channel)
+        if cadence is None:
+            return self.min_interval
+
+        backoff = min(1 + channel.unchanged_checks / self.CHECKS_PER_EPISODE, self.MAX_BACKOFF)
+        interval = cadence / self.CHECKS_PER_EPISODE * backoff
+        return int(min(max(interval, self.min_interval), self.max_interval))
+
+    def next_due(self, channel):
+        """Unix timestamp when the podcast should be checked next
+
+        Not before the last response expires, before the time the
+        server asked us to retry after, or while backing off after
+        failed updates. A failed update (also one that doesn't back off,
+        like a missing password) is not retried before min_interval.
+        """
+        due = 0
+        if channel.last_check:
+            due = channel.last_check + self.interval(channel)
+
+            cadence = self.cadence(channel)
+            if cadence is not None:
+                expected = max(e.published for e in channel.children) + cadence
+                if expected > channel.last_check:
+                    due = min(due, max(expected, channel.last_check + self.min_interval))
+
+        if self.honor_cache_headers:
+            due = max(due, channel.http_expires)
+        if channel.last_failed_update:
+            due = max(due, channel.last_failed_update + self.min_interval)
+        return max(due, channel.http_retry_after, channel.next_update_attempt)
+
+    def due(self, channels, now=None):
+        """Return the podcasts in "channels" that should be checked now"""
+        if now is None:
+            now = time.time()
+        return [channel for channel in channels
+                if not channel.pause_subscription and self.next_due(channel) <= now + self.TOLERANCE]
+
+    def seconds_until_due(self, channels, now=None):
+        """Seconds until the next podcast in "channels" is due
+
+        Returns min_interval when none of the podcasts can be checked.
+        """
+        if now is None:
+            now = time.time()
+        due = [self.next_due(channel) for channel in channels if not channel.pause_subscription]
+        if not due:
+            return self.min_interval
+        return max(0, min(due) - now)
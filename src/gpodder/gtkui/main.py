@@ -33,7 +33,8 @@ import requests.exceptions
 import urllib3.exceptions
 
 import gpodder
-from gpodder import common, download, feedcore, my, opml, player, util, youtube
+from gpodder import (common, download, feedcore, feedupdater, my, opml, player,
+                     util, youtube)
 from gpodder.dbusproxy import DBusPodcastsProxy
 from gpodder.model import Model, PodcastEpisode
 from gpodder.syncui import gPodderSyncUI
@@ -68,6 +69,8 @@ N_ = gpodder.ngettext
 
 
 class gPodder(BuilderWidget, dbus.service.Object):
+    # Seconds between incremental vacuum steps of the database
+    INCREMENTAL_VACUUM_INTERVAL = 10 * 60
 
     def __init__(self, app, bus_name, gpodder_core, options):
         dbus.service.Object.__init__(self, object_path=gpodder.dbus_gui_object_path, bus_name=bus_name)
@@ -92,6 +95,12 @@ class gPodder(BuilderWidget, dbus.service.Object):
         self.last_episode_date_refresh = None
         self.refresh_episode_dates()
 
+        # Show the durations of YouTube episodes once they are known
+        self.model.youtube_durations.resolved_callback = self.on_youtube_durations_resolved
+
+        # Give free database pages back to the file system from time to time
+        util.idle_timeout_add(self.INCREMENTAL_VACUUM_INTERVAL * 1000, self.incremental_vacuum)
+
         self.on_episode_list_selection_changed_id = None
 
         observer = gpodder.config.get_network_proxy_observer(self.config)
@@ -1483,7 +1492,8 @@ class gPodder(BuilderWidget, dbus.service.Object):
                 'ui.gtk.episode_list.trim_title_prefix',
                 'ui.gtk.episode_list.always_show_new'):
             self.update_episode_list_model()
-        elif name in ('auto.update.enabled', 'auto.update.frequency'):
+        elif name in ('auto.update.enabled', 'auto.update.frequency',
+                'auto.update.adaptive', 'auto.update.max_interval'):
             self.restart_auto_update_timer()
         elif name in ('ui.gtk.podcast_list.all_episodes',
                 'ui.gtk.podcast_list.sections'):
@@ -2220,6 +2230,10 @@ class gPodder(BuilderWidget, dbus.service.Object):
             # Wrong/invalid call - have to specify at least one parameter
             raise ValueError('Invalid call to update_episode_list_icons')
 
+    def on_youtube_durations_resolved(self, episodes):
+        # Called on a worker thread
+        util.idle_add(self.update_episode_list_icons, {e.url for e in episodes})
+
     def episode_list_status_changed(self, episodes):
         self.update_episode_list_icons({e.url for e in episodes})
         self.update_podcast_list_model({e.channel.url for e in episodes})
@@ -2404,6 +2418,10 @@ class gPodder(BuilderWidget, dbus.service.Object):
         self.update_podcast_list_model()
         self.update_episode_list_icons(urls)
 
+    def incremental_vacuum(self):
+        self.db.incremental_vacuum()
+        return True
+
     def refresh_episode_dates(self):
         t = time.localtime()
         current_day = t[:3]
@@ -2785,7 +2803,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
             self.show_update_feeds_buttons()
 
     def update_feed_cache(self, channels=None,
-                          show_new_episodes_dialog=True):
+                          show_new_episodes_dialog=True, force=False):
         if self.config.check_connection and not util.connection_available():
             self.show_message(_('Please connect to a network, then try again.'),
                     _('No network connection'), important=True)
@@ -2819,30 +2837,22 @@ class gPodder(BuilderWidget, dbus.service.Object):
         def update_feed_cache_proc():
             updated_channels = []
             nr_update_errors = 0
-            new_episodes = []
-            for updated, channel in enumerate(channels):
-                if self.feed_cache_update_cancelled:
-                    break
 
-                def indicate_updating_podcast(channel):
-                    d = {'podcast': channel.title, 'position': updated + 1, 'total': count}
-                    progression = _('Updating %(podcast)s (%(position)d/%(total)d)') % d
-                    logger.info(progression)
-                    self.pbFeedUpdate.set_text(progression)
+            def on_channel_updated(channel, episodes, error, position, total):
+                nonlocal nr_update_errors
 
-                try:
+                if error is None:
                     channel._update_error = None
-                    util.idle_add(indicate_updating_podcast, channel)
-                    new_episodes.extend(channel.update(max_episodes=self.config.limit.episodes))
                     self._update_cover(channel)
-                except Exception as e:
-                    message = str(e)
+                else:
+                    message = str(error)
                     if message:
                         channel._update_error = message
                     else:
                         channel._update_error = '?'
                     nr_update_errors += 1
-                    logger.error('Error updating feed: %s: %s', channel.title, message, exc_info=(e.__class__ not in [
+                    # Don't log tracebacks for expected network/server errors
+                    expected_error = error.__class__ in [
                         gpodder.feedcore.BadRequest,
                         gpodder.feedcore.AuthenticationRequired,
                         gpodder.feedcore.Unsubscribe,
@@ -2853,11 +2863,18 @@ class gPodder(BuilderWidget, dbus.service.Object):
                         requests.exceptions.RetryError,
                         urllib3.exceptions.MaxRetryError,
                         urllib3.exceptions.ReadTimeoutError,
-                    ]))
+                    ]
+                    logger.error('Error updating feed: %s: %s', channel.title, message,
+                                 exc_info=None if expected_error else error)
 
                 updated_channels.append(channel)
 
                 def update_progress(channel):
+                    d = {'podcast': channel.title, 'position': position, 'total': total}
+                    progression = _('Updating %(podcast)s (%(position)d/%(total)d)') % d
+                    logger.info(progression)
+                    self.pbFeedUpdate.set_text(progression)
+
                     self.update_podcast_list_model([channel.url])
 
                     # If the currently-viewed podcast is updated, reload episodes
@@ -2866,10 +2883,15 @@ class gPodder(BuilderWidget, dbus.service.Object):
                         logger.debug('Updated channel is active, updating UI')
                         self.update_episode_list_model()
 
-                    self.pbFeedUpdate.set_fraction(float(updated + 1) / float(count))
+                    self.pbFeedUpdate.set_fraction(float(position) / float(total))
 
                 util.idle_add(update_progress, channel)
 
+            updater = feedupdater.FeedUpdater(self.config.limit.feed_updates.concurrent,
+                                              self.config.limit.feed_updates.concurrent_per_host)
+            new_episodes = updater.update(channels, self.config.limit.episodes,
+                                          on_channel_updated, lambda: self.feed_cache_update_cancelled, force)
+
             if nr_update_errors > 0:
                 self.notification(
                     N_('%(count)d channel failed to update',
@@ -2878,6 +2900,9 @@ class gPodder(BuilderWidget, dbus.service.Object):
                     _('Error while updating feeds'), widget=self.treeChannels)
 
             def update_feed_cache_finish_callback(new_episodes):
+                # Reschedule the auto update now that the podcasts were checked
+                self.restart_auto_update_timer()
+
                 # Process received episode actions for all updated URLs
                 self.process_received_episode_actions()
 
@@ -3203,7 +3228,8 @@ class gPodder(BuilderWidget, dbus.service.Object):
         if getattr(self.active_channel, 'ALL_EPISODES_PROXY', False):
             self.update_feed_cache()
         else:
-            self.update_feed_cache(channels=[self.active_channel])
+            # The user asked for this podcast, update it even if still fresh
+            self.update_feed_cache(channels=[self.active_channel], force=True)
 
     def on_itemUpdate_activate(self, action=None, param=None):
         # Check if we have outstanding subscribe/unsubscribe actions
@@ -3910,24 +3936,34 @@ class gPodder(BuilderWidget, dbus.service.Object):
 
         if (self.config.auto.update.enabled
                 and self.config.auto.update.frequency):
-            interval = 60 * 1000 * self.config.auto.update.frequency
-            logger.debug('Setting up auto update timer with interval %d.',
-                    self.config.auto.update.frequency)
-            self._auto_update_timer_source_id = util.idle_timeout_add(interval, self._on_auto_update_timer)
+            # Wake up when the next podcast is due, but at most once a minute
+            scheduler = feedupdater.FeedScheduler.from_config(self.config)
+            delay = max(60, scheduler.seconds_until_due(self.channels))
+            logger.debug('Setting up auto update timer in %d seconds.', delay)
+            self._auto_update_timer_source_id = util.idle_timeout_add(int(1000 * delay), self._on_auto_update_timer)
 
     def _on_auto_update_timer(self):
+        self._auto_update_timer_source_id = None
+
         if self.config.check_connection and not util.connection_available():
             logger.debug('Skipping auto update (no connection available)')
-            return True
-
-        logger.debug('Auto update timer fired.')
-        self.update_feed_cache()
+            self.restart_auto_update_timer()
+            return False
 
         # Ask web service for sub changes (if enabled)
         if self.mygpo_client.can_access_webservice():
             self.mygpo_client.flush()
 
-        return True
+        channels = feedupdater.FeedScheduler.from_config(self.config).due(self.channels)
+        if not channels:
+            logger.debug('Auto update timer fired, but no podcasts are due.')
+            self.restart_auto_update_timer()
+            return False
+
+        # The timer is restarted once the update has finished
+        logger.debug('Auto update timer fired, updating %d podcasts.', len(channels))
+        self.update_feed_cache(channels)
+        return False
 
     def on_treeDownloads_row_activated(self, widget, *args):
         # Use the standard way of working on the treeview
@@ -178,6 +178,9 @@ class EpisodeListModel(Gtk.ListStore):
         self._view_mode = self.VIEW_ALL
         self._search_term = None
         self._search_term_eql = None
+        # Plain text descriptions of the listed episodes, while they are
+        # shown or searched (see PodcastEpisode.get_text_descriptions())
+        self._descriptions = {}
         self._filter.set_visible_func(self._filter_visible_func)
 
         # Are we currently showing "all episodes"/section or a single channel?
@@ -229,7 +232,7 @@ class EpisodeListModel(Gtk.ListStore):
                 return False
 
             try:
-                return self._search_term_eql.match(episode)
+                return self._search_term_eql.match(episode, self._descriptions)
             except Exception:
                 return True
 
@@ -279,12 +282,22 @@ class EpisodeListModel(Gtk.ListStore):
         if self._search_term != new_term:
             self._search_term = new_term
             self._search_term_eql = query.UserEQL(new_term)
+            if new_term and not self._descriptions:
+                # Searches look at the descriptions of all episodes
+                self._descriptions = model.PodcastEpisode.get_text_descriptions(
+                    row[self.C_EPISODE] for row in self if row[self.C_EPISODE] is not None)
+            elif not new_term and not self._show_descriptions():
+                self._descriptions = {}
             self._filter.refilter()
             self._on_filter_changed(self.has_episodes())
 
     def get_search_term(self):
         return self._search_term
 
+    def _show_descriptions(self):
+        """True if the descriptions are shown in the list (see _format_description)"""
+        return self._config_ui_gtk_episode_list_descriptions and not self._section_view
+
     def _format_description(self, episode):
         d = []
 
@@ -301,7 +314,7 @@ class EpisodeListModel(Gtk.ListStore):
             if self._section_view:
                 d.append(_('from %s') % html.escape(episode.channel.title))
             else:
-                description = episode.one_line_description()
+                description = episode.one_line_description(self._descriptions)
                 if description.startswith(title):
                     description = description[len(title):].strip()
                 d.append(html.escape(description))
@@ -337,6 +350,11 @@ class EpisodeListModel(Gtk.ListStore):
         if self.background_update_tag is not None:
             GLib.source_remove(self.background_update_tag)
 
+        if self._show_descriptions() or self._search_term:
+            self._descriptions = model.PodcastEpisode.get_text_descriptions(episodes)
+        else:
+            self._descriptions = {}
+
         self.background_update = BackgroundUpdate(self, episodes)
         self.background_update_tag = GLib.idle_add(self._update_background)
 
@@ -802,11 +820,7 @@ class PodcastListModel(Gtk.ListStore):
             return ''.join(d)
 
     def _format_error(self, channel):
-        # if channel.parse_error:
-        #     return str(channel.parse_error)
-        # else:
-        #     return None
-        return None
+        return channel.get_backoff_message()
 
     def set_channels(self, db, config, channels):
         # Clear the model and update the list of podcasts
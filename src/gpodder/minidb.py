@@ -44,6 +44,9 @@ import threading
 
 
 class Store(object):
+    # VACUUM on close only when this share of the pages is free
+    VACUUM_THRESHOLD = 0.25
+
     def __init__(self, filename=':memory:'):
         self.db = sqlite.connect(filename, check_same_thread=False)
         self.lock = threading.RLock()
@@ -67,9 +70,13 @@ class Store(object):
 
     def close(self):
         with self.lock:
-            self.db.isolation_level = None
-            self.db.execute('VACUUM')
-            self.db.isolation_level = ''
+            self.db.commit()
+            page_count = self.db.execute('PRAGMA page_count').fetchone()[0]
+            freelist_count = self.db.execute('PRAGMA freelist_count').fetchone()[0]
+            if freelist_count > self.VACUUM_THRESHOLD * page_count:
+                self.db.isolation_level = None
+                self.db.execute('VACUUM')
+                self.db.isolation_level = ''
             self.db.close()
 
     def _register(self, class_):
@@ -24,25 +24,35 @@
 #  Based on libpodcasts.py (thp, 2005-10-29)
 #
 
+import concurrent.futures
 import datetime
 import glob
 import hashlib
+import heapq
+import io
+import itertools
 import json
 import logging
+import multiprocessing
 import os
+import random
 import re
 import shutil
 import string
+import threading
 import time
+from xml import sax
 
 import podcastparser
 
 import gpodder
-from gpodder import coverart, feedcore, registry, schema, util, vimeo, youtube
+from gpodder import (coverart, feedcore, feedupdater, registry, schema,
+                     telemetry, util, vimeo, youtube)
 
 logger = logging.getLogger(__name__)
 
 _ = gpodder.gettext
+N_ = gpodder.ngettext
 
 
 class Feed:
@@ -76,6 +86,14 @@ class Feed:
         """ :return str: optional -- last HTTP Last-Modified header, for conditional request next time """
         return None
 
+    def get_content_digest(self):
+        """ :return str: optional -- digest of the feed content, to detect unchanged feeds next time """
+        return None
+
+    def get_guids(self):
+        """ :return set(str): optional -- GUIDs of the episodes get_new_episodes() would produce, before merging """
+        return None
+
     def get_new_episodes(self, channel, existing_guids):
         """
         Produce new episodes and update old ones.
@@ -97,12 +115,28 @@ class Feed:
         """
         return None
 
+    def has_next_page(self):
+        """
+        :return bool: True if get_next_page() returns a page, so it can be
+                      fetched in the background (see FeedPager)
+        """
+        return False
+
+    def limit_episodes(self, max_episodes):
+        """
+        Only produce the max_episodes most recent episodes in get_new_episodes(),
+        for pages fetched before the exact limit was known.
+        """
+        pass
+
 
 class PodcastParserFeed(Feed):
-    def __init__(self, feed, fetcher, max_episodes=0):
+    def __init__(self, feed, fetcher, max_episodes=0, feed_data=None, content_digest=None):
         self.feed = feed
         self.fetcher = fetcher
         self.max_episodes = max_episodes
+        self.feed_data = feed_data
+        self.content_digest = content_digest
 
     def get_title(self):
         return self.feed.get('title')
@@ -110,13 +144,13 @@ class PodcastParserFeed(Feed):
     def get_link(self):
         vid = youtube.get_youtube_id(self.feed['url'])
         if vid is not None:
-            self.feed['link'] = youtube.get_channel_id_url(self.feed['url'], self.fetcher.feed_data)
+            self.feed['link'] = youtube.get_channel_id_url(self.feed['url'], self.feed_data)
         return self.feed.get('link')
 
     def get_description(self):
         vid = youtube.get_youtube_id(self.feed['url'])
         if vid is not None:
-            self.feed['description'] = youtube.get_channel_desc(self.feed['url'], self.fetcher.feed_data)
+            self.feed['description'] = youtube.get_channel_desc(self.feed['url'], self.feed_data)
         return self.feed.get('description')
 
     def get_cover_url(self):
@@ -131,6 +165,18 @@ class PodcastParserFeed(Feed):
     def get_http_last_modified(self):
         return self.feed.get('headers', {}).get('last-modified')
 
+    def get_content_digest(self):
+        return self.content_digest
+
+    def _get_entries(self):
+        entries = self.feed.get('episodes', [])
+        if self.max_episodes > 0:
+            return heapq.nlargest(self.max_episodes, entries, key=lambda episode: episode['published'])
+        return sorted(entries, key=lambda episode: episode['published'], reverse=True)
+
+    def get_guids(self):
+        return {entry['guid'] for entry in self._get_entries()}
+
     def get_new_episodes(self, channel, existing_guids):
         # Keep track of episode GUIDs currently seen in the feed
         seen_guids = set()
@@ -138,18 +184,26 @@ class PodcastParserFeed(Feed):
         # list of new episodes
         new_episodes = []
 
+        # existing episodes updated from the feed, saved together with the new episodes
+        updated_episodes = []
+
+        # YouTube episodes that need their duration looked up
+        youtube_episodes = []
+
         # We have to sort the entries in descending chronological order,
         # because if the feed lists items in ascending order and has >
         # max_episodes old episodes, new episodes will not be shown.
         # See also: gPodder Bug 1186
-        entries = sorted(self.feed.get('episodes', []), key=lambda episode: episode['published'], reverse=True)
-
         # We can limit the maximum number of entries that gPodder will parse
-        if self.max_episodes > 0 and len(entries) > self.max_episodes:
-            entries = entries[:self.max_episodes]
+        entries = self._get_entries()
 
         num_duplicate_guids = 0
 
+        # The descriptions of the existing episodes are compared below, read them together
+        guids = {entry['guid'] for entry in entries}
+        texts = channel.db.load_episode_texts(episode.id for guid, episode in existing_guids.items()
+                                              if guid in guids and episode.id is not None)
+
         # Search all entries for new episodes
         for entry in entries:
             episode = channel.EpisodeClass.from_podcastparser_entry(entry, channel)
@@ -169,24 +223,35 @@ class PodcastParserFeed(Feed):
             # Detect (and update) existing episode based on GUIDs
             existing_episode = existing_guids.get(episode.guid, None)
             if existing_episode:
+                existing_episode.update_from(episode, texts.get(existing_episode.id))
+                existing_episode.cache_text_description()
+                updated_episodes.append(existing_episode)
                 if existing_episode.total_time == 0 and 'youtube' in episode.url:
                     # query duration for existing youtube episodes that haven't been downloaded or queried
                     # such as live streams after they have ended
-                    existing_episode.total_time = youtube.get_total_time(episode)
-
-                existing_episode.update_from(episode)
-                existing_episode.cache_text_description()
-                existing_episode.save()
+                    youtube_episodes.append(existing_episode)
                 continue
             elif episode.total_time == 0 and 'youtube' in episode.url:
                 # query duration for new youtube episodes
-                episode.total_time = youtube.get_total_time(episode)
+                youtube_episodes.append(episode)
 
             episode.cache_text_description()
-            episode.save()
             new_episodes.append(episode)
+
+        channel.save_episodes(updated_episodes + new_episodes)
+
+        # Durations are filled in later, once the episodes have an ID
+        if youtube_episodes:
+            channel.model.youtube_durations.resolve(youtube_episodes)
+
         return new_episodes, seen_guids
 
+    def has_next_page(self):
+        return 'paged_feed_next' in self.feed
+
+    def limit_episodes(self, max_episodes):
+        self.max_episodes = max_episodes
+
     def get_next_page(self, channel, max_episodes):
         if 'paged_feed_next' in self.feed:
             url = self.feed['paged_feed_next']
@@ -196,12 +261,207 @@ class PodcastParserFeed(Feed):
         return None
 
 
+class FeedPager(object):
+    """
+    Fetch the next page of a paged feed while the current one is merged.
+
+    prefetch() starts Feed.get_next_page() on a worker thread, with an
+    upper bound for the number of episodes as the exact number is only
+    known after the current page has been merged. next_page() applies
+    the exact number to the prefetched page. Pages that are not asked
+    for are cancelled by close().
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.executor = None
+        self.future = None
+
+    def prefetch(self, feed, max_episodes):
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='FeedPager')
+        self.future = self.executor.submit(feed.get_next_page, self.channel, max_episodes)
+
+    def next_page(self, feed, max_episodes):
+        if self.future is None:
+            return feed.get_next_page(self.channel, max_episodes)
+
+        future, self.future = self.future, None
+        result = future.result()
+        if result and result.status == feedcore.UPDATED_FEED:
+            result.feed.limit_episodes(max_episodes)
+        return result
+
+    def close(self):
+        if self.future is not None:
+            if not self.future.cancel():
+                # Already being fetched, the result is thrown away
+                logger.debug('Discarding prefetched page of %s', self.channel.url)
+            self.future = None
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+class gPodderFeedHandler(podcastparser.PodcastHandler):
+    """
+    podcastparser handler that only keeps the episodes we want.
+
+    As long as the feed lists its episodes newest-first, episodes after
+    the first max_episodes ones are dropped as soon as they have been
+    parsed (they would be cut off anyway), so memory use doesn't grow
+    with the size of the feed. The rest of the feed is still parsed:
+    channel elements like the title, image or the link to the next page
+    may come after the episodes. If an episode is newer than the one
+    before it, the feed is not sorted and all episodes are kept.
+    """
+
+    def __init__(self, url, max_episodes=0):
+        # podcastparser applies max_episodes after sorting, we do it here
+        super().__init__(url, 0)
+        self.limit = max_episodes
+        self.newest_first = True
+
+    def endElement(self, name):
+        is_episode = isinstance(podcastparser.MAPPING.get('/'.join(self.path_stack)), podcastparser.EpisodeItem)
+        count = len(self.episodes)
+        super().endElement(name)
+        # invalid episodes are removed by validate_episode()
+        if is_episode and len(self.episodes) == count:
+            self._on_episode(self.episodes[-1])
+
+    def _on_episode(self, entry):
+        if len(self.episodes) > 1 and entry['published'] > self.episodes[-2]['published']:
+            self.newest_first = False
+
+        if self.newest_first and self.limit > 0 and len(self.episodes) > self.limit:
+            # Older than all the episodes that are kept
+            self.episodes.pop()
+
+    @classmethod
+    def parse(cls, url, stream, **kwargs):
+        """Like podcastparser.parse()"""
+        handler = cls(url, **kwargs)
+        try:
+            sax.parse(stream, handler)
+        except sax.SAXParseException as e:
+            raise podcastparser.FeedParseError(e.getMessage(), e.getException(), e._locator)
+        return handler.data
+
+
+class DigestReader(object):
+    """
+    File-like wrapper computing the SHA-1 digest of everything read through it.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, stream, salt=''):
+        self.stream = stream
+        self.digest = hashlib.sha1(salt.encode('utf-8'))
+
+    def read(self, size=-1):
+        with telemetry.phase('transfer'):
+            data = self.stream.read(size)
+        self.digest.update(data)
+        return data
+
+    def close(self):
+        # The SAX parser closes its input when done, but hexdigest() still
+        # needs to read the rest; the underlying stream is closed by its owner
+        pass
+
+    def hexdigest(self):
+        """Read the rest of the stream and return the digest of all of it"""
+        while self.read(self.CHUNK_SIZE):
+            pass
+        return self.digest.hexdigest()
+
+
+def parse_feed_in_process(url, data, **kwargs):
+    """
+    Parse the feed body "data" in a worker process of gPodderFetcher.
+
+    Returns the same as gPodderFeedHandler.parse(), with the plain text
+    of descriptions without HTML added as 'description_text' to the
+    episodes, so only plain data has to be sent back.
+    """
+    try:
+        feed = gPodderFeedHandler.parse(url, io.BytesIO(data), **kwargs)
+    except ValueError as e:
+        # podcastparser.FeedParseError can't be sent back to the parent
+        raise ValueError(str(e))
+
+    for entry in feed['episodes']:
+        if not entry.get('description_html'):
+            entry['description_text'] = util.remove_html_tags(entry['description'] or '')
+    return feed
+
+
 class gPodderFetcher(feedcore.Fetcher):
     """
     This class implements fetching a channel from custom feed handlers
     or the default using podcastparser
     """
-    def fetch_channel(self, channel, max_episodes):
+    # The response body is parsed while it is downloaded
+    STREAMING = True
+
+    def __init__(self):
+        self.parse_processes = 0
+        self.parse_min_size = 0
+        self._parse_pool = None
+        self._parse_pool_lock = threading.Lock()
+        # Skip feeds while the last response is fresh (Cache-Control/Expires)
+        self.honor_cache_headers = True
+
+    def set_parse_processes(self, processes, min_size):
+        """
+        Parse feeds of at least min_size bytes in up to "processes" worker
+        processes, to not be limited by the GIL. 0 processes: never.
+        """
+        with self._parse_pool_lock:
+            if (processes, min_size) == (self.parse_processes, self.parse_min_size):
+                return
+            self.parse_processes = processes
+            self.parse_min_size = min_size
+            self._shutdown_parse_pool()
+
+    def shutdown(self):
+        with self._parse_pool_lock:
+            self._shutdown_parse_pool()
+
+    def _shutdown_parse_pool(self):
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=False)
+            self._parse_pool = None
+
+    def _get_parse_pool(self, headers):
+        """Return the process pool if the feed should be parsed in it, or None"""
+        if self.parse_processes <= 0:
+            return None
+
+        try:
+            size = int(headers.get('content-length'))
+        except (TypeError, ValueError):
+            # Size unknown (chunked response), stream it into the parser
+            return None
+        if size < self.parse_min_size:
+            return None
+
+        with self._parse_pool_lock:
+            if self._parse_pool is None:
+                # Don't fork, the parent has other threads running
+                self._parse_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.parse_processes, mp_context=multiprocessing.get_context('spawn'))
+            return self._parse_pool
+
+    def fetch_channel(self, channel, max_episodes, force=False):
+        """
+        Fetch the feed of a podcast. It is skipped (feedcore.SKIPPED) during
+        Retry-After, and unless "force" is set (the user asked to update
+        this podcast) while backing off after failed updates or while the
+        last response is still fresh.
+        """
         custom_feed = registry.feed_handler.resolve(channel, None, max_episodes)
         if custom_feed is not None:
             return custom_feed
@@ -209,6 +469,19 @@ class gPodderFetcher(feedcore.Fetcher):
         # If we have a username or password, rebuild the url with them included
         # Note: using a HTTPBasicAuthHandler would be pain because we need to
         # know the realm. It can be done, but I think this method works, too
+        now = time.time()
+        if channel.http_retry_after > now:
+            logger.info('Not updating %s before %s (Retry-After)', channel.url,
+                        time.ctime(channel.http_retry_after))
+            return feedcore.Result(feedcore.SKIPPED, channel.url)
+        if not force and channel.next_update_attempt > now:
+            logger.info('Not updating %s before %s (%d failed updates)', channel.url,
+                        time.ctime(channel.next_update_attempt), channel.update_failures)
+            return feedcore.Result(feedcore.SKIPPED, channel.url)
+        if not force and self.honor_cache_headers and channel.http_expires > now:
+            logger.debug('Not updating %s, still fresh', channel.url)
+            return feedcore.Result(feedcore.SKIPPED, channel.url)
+
         url = channel.authenticate_url(channel.url)
         return self.fetch(url, channel.http_etag, channel.http_last_modified, max_episodes=max_episodes)
 
@@ -218,15 +491,44 @@ class gPodderFetcher(feedcore.Fetcher):
         return url
 
     def parse_feed(self, url, feed_data, data_stream, headers, status, max_episodes=0, **kwargs):
-        self.feed_data = feed_data
+        # feed_data is kept on the parsed feed and not on the fetcher, because
+        # a single fetcher instance is shared by concurrent feed updates
+        reader = None
+        if feed_data is not None:
+            if youtube.get_youtube_id(url) is not None:
+                # YouTube feeds need the raw data later on (see get_link()), keep it
+                data_stream = io.BytesIO(feed_data.content)
+            # The digest of the body detects feeds that didn't change even if
+            # the server ignores conditional requests. The parameters that
+            # change the parsing result are part of it.
+            reader = data_stream = DigestReader(data_stream, salt='%d\n' % max_episodes)
+        parse_args = dict(max_episodes=max_episodes)
         try:
-            feed = podcastparser.parse(url, data_stream)
+            with telemetry.phase('parse'):
+                feed, content_digest = self._parse(url, feed_data, data_stream, headers, reader, parse_args)
             feed['url'] = url
             feed['headers'] = headers
-            return feedcore.Result(status, PodcastParserFeed(feed, self, max_episodes))
+            return feedcore.Result(status, PodcastParserFeed(feed, self, max_episodes, feed_data, content_digest))
         except ValueError as e:
             raise feedcore.InvalidFeed('Could not parse feed: {url}: {msg}'.format(url=url, msg=e))
 
+    def _parse(self, url, feed_data, data_stream, headers, reader, parse_args):
+        """Returns (feed, content_digest)"""
+        pool = self._get_parse_pool(headers) if reader is not None else None
+        if pool is not None:
+            # Large feed: download it completely and parse it in a worker process
+            data = feed_data.content
+            reader.digest.update(data)
+            try:
+                feed = pool.submit(parse_feed_in_process, url, data, **parse_args).result()
+            except concurrent.futures.BrokenExecutor:
+                logger.warning('Feed parsing process failed, parsing %s here', url, exc_info=True)
+                feed = gPodderFeedHandler.parse(url, io.BytesIO(data), **parse_args)
+            return feed, reader.digest.hexdigest()
+
+        feed = gPodderFeedHandler.parse(url, data_stream, **parse_args)
+        return feed, reader.hexdigest() if reader is not None else None
+
 
 # Our podcast model:
 #
@@ -245,13 +547,71 @@ class PodcastModelObject(object):
     A generic base class for our podcast model providing common helper
     and utility functions.
     """
-    __slots__ = ('id', 'parent', 'children')
+    __slots__ = ('id', 'parent', 'children', '_changed')
+
+    # Names of the database columns, set by subclasses
+    COLUMNS = frozenset()
+
+    # Guards the _changed sets, objects are modified and saved by different threads
+    _changed_lock = threading.Lock()
+
+    def __setattr__(self, name, value):
+        # Remember which columns were modified since the object was loaded
+        # from or saved to the database. While _changed is unset (new
+        # objects), all columns are written when saving.
+        if name in self.COLUMNS:
+            # Compared outside of the lock: reading lazy columns queries the database
+            modified = getattr(self, '_changed', None) is not None and getattr(self, name, None) != value
+            with self._changed_lock:
+                object.__setattr__(self, name, value)
+                if modified and self._changed is not None:
+                    self._changed.add(name)
+        else:
+            object.__setattr__(self, name, value)
+
+    def get_changed_columns(self, columns):
+        """
+        Return the names in "columns" that need to be written to the
+        database, either all of them or the ones modified since the
+        last call to mark_saved().
+        """
+        changed = getattr(self, '_changed', None)
+        if changed is None:
+            return columns
+        return [name for name in columns if name in changed]
+
+    def mark_saved(self):
+        """Mark all columns as unmodified (stored in the database)"""
+        self._changed = set()
+
+    def take_changed_columns(self, columns):
+        """
+        Like get_changed_columns(), but also mark the returned columns
+        as unmodified, in one step. Columns modified after this are
+        written by the next save. If writing the returned columns
+        fails, call mark_unsaved() to have the next save retry them.
+        """
+        with self._changed_lock:
+            changed = getattr(self, '_changed', None)
+            self._changed = set()
+            if changed is None:
+                return list(columns)
+            self._changed.update(name for name in changed if name not in columns)
+            return [name for name in columns if name in changed]
+
+    def mark_unsaved(self, columns):
+        """Mark "columns" as modified again, after they could not be written"""
+        with self._changed_lock:
+            if getattr(self, '_changed', None) is not None:
+                self._changed.update(columns)
 
     @classmethod
     def create_from_dict(cls, d, *args):
         """
         Create a new object, passing "args" to the constructor
         and then updating the object with the values from "d".
+
+        The values in "d" are considered to be stored already.
         """
         o = cls(*args)
 
@@ -259,6 +619,7 @@ class PodcastModelObject(object):
         for k, v in d.items():
             setattr(o, k, v)
 
+        o.mark_saved()
         return o
 
 
@@ -273,7 +634,26 @@ class PodcastEpisode(PodcastModelObject):
     MAX_FILENAME_LENGTH = 120  # without extension
     MAX_FILENAME_WITH_EXT_LENGTH = 140 - len(".partial.webm")  # with extension
 
-    __slots__ = schema.EpisodeColumns + ('_download_error', '_text_description',)
+    __slots__ = schema.EpisodeColumns + ('_download_error', '_text',)
+    COLUMNS = frozenset(schema.EpisodeColumns)
+
+    # Columns that are left unset when loading episodes, see __getattr__()
+    LAZY_COLUMNS = frozenset(schema.EpisodeLazyColumns)
+
+    def __getattr__(self, name):
+        # Only called for unset attributes: lazy columns not loaded yet are
+        # taken from the database (with a cache), without keeping them here
+        if name in self.LAZY_COLUMNS and self.id is not None:
+            return self.db.get_episode_texts(self.id)[name]
+        raise AttributeError(name)
+
+    @classmethod
+    def create_from_dict(cls, d, *args):
+        o = super().create_from_dict(d, *args)
+        for name in cls.LAZY_COLUMNS:
+            if name not in d:
+                object.__delattr__(o, name)
+        return o
 
     def _deprecated(self):
         raise Exception('Property is deprecated!')
@@ -301,7 +681,9 @@ class PodcastEpisode(PodcastModelObject):
             episode.description = ''
             episode.description_html = entry['description_html']
         else:
-            episode.description = util.remove_html_tags(entry['description'] or '')
+            # Feeds parsed in a worker process come with the text already
+            text = entry.get('description_text')
+            episode.description = text if text is not None else util.remove_html_tags(entry['description'] or '')
             episode.description_html = ''
 
         episode.total_time = entry['total_time']
@@ -408,7 +790,7 @@ class PodcastEpisode(PodcastModelObject):
         self.last_playback = 0
 
         self._download_error = None
-        self._text_description = ''
+        self._text = None
 
     @property
     def channel(self):
@@ -595,21 +977,80 @@ class PodcastEpisode(PodcastModelObject):
 
     age_prop = property(fget=get_age_string)
 
+    @staticmethod
+    def _get_text_description(description, description_html):
+        if description:
+            return description
+        elif description_html:
+            return util.remove_html_tags(description_html)
+        else:
+            return ''
+
+    def _description_loaded(self):
+        """True if the description is set here, not only in the database"""
+        for name in ('description', 'description_html'):
+            try:
+                object.__getattribute__(self, name)
+                return True
+            except AttributeError:
+                pass
+        return self.id is None
+
     def cache_text_description(self):
-        if self.description:
-            self._text_description = self.description
-        elif self.description_html:
-            self._text_description = util.remove_html_tags(self.description_html)
+        """Update the plain text description after the description changed"""
+        if self._description_loaded():
+            self._text = self._get_text_description(self.description, self.description_html)
         else:
-            self._text_description = ''
+            self._text = None
+
+    @classmethod
+    def get_text_descriptions(cls, episodes):
+        """Read the plain text descriptions of many episodes
+
+        For episode lists and searches: the descriptions that are only
+        in the database are read with one query, not one per episode.
+        Returns a dict: episode ID -> text, to be passed to
+        get_text_description(). It is owned by the list or search, and
+        dropped with it.
+        """
+        missing = {}
+        for episode in episodes:
+            if episode._text is None and not episode._description_loaded():
+                missing[episode.id] = episode
+
+        if not missing:
+            return {}
+
+        db = next(iter(missing.values())).db
+        return {episode_id: cls._get_text_description(texts['description'], texts['description_html'])
+                for episode_id, texts in db.load_episode_texts(missing).items()}
+
+    @property
+    def _text_description(self):
+        return self.get_text_description()
+
+    def get_text_description(self, descriptions=None):
+        """The plain text description (descriptions: see get_text_descriptions())"""
+        if self._text is None and self._description_loaded():
+            self.cache_text_description()
+        if self._text is not None:
+            return self._text
+        if descriptions is not None and self.id in descriptions:
+            return descriptions[self.id]
+
+        # Derived when needed, and cached together with the columns
+        texts = self.db.get_episode_texts(self.id)
+        if 'text' not in texts:
+            texts['text'] = self._get_text_description(texts['description'], texts['description_html'])
+        return texts['text']
 
     def html_description(self):
         return self.description_html \
             or util.nice_html_description(self.episode_art_url, self.description or _('No description available'))
 
-    def one_line_description(self):
+    def one_line_description(self, descriptions=None):
         MAX_LINE_LENGTH = 120
-        desc = self._text_description
+        desc = self.get_text_description(descriptions)
         desc = re.sub(r'\s+', ' ', desc).strip()
         if not desc:
             return _('No description available')
@@ -905,10 +1346,22 @@ class PodcastEpisode(PodcastModelObject):
         else:
             return '-'
 
-    def update_from(self, episode):
+    def update_from(self, episode, texts=None):
+        """Update this episode with the values of "episode"
+
+        "texts" can hold the lazy columns of this episode, loaded with
+        Database.load_episode_texts(), to compare them without a query.
+        """
         for k in ('title', 'url', 'episode_art_url', 'description', 'description_html', 'chapters', 'link',
                   'published', 'guid', 'payment_url'):
-            setattr(self, k, getattr(episode, k))
+            # Unchanged lazy columns stay unloaded
+            value = getattr(episode, k)
+            try:
+                current = object.__getattribute__(self, k)
+            except AttributeError:
+                current = texts[k] if texts is not None else getattr(self, k)
+            if current != value:
+                setattr(self, k, value)
         # Don't overwrite file size on downloaded episodes
         # See #648 refreshing a youtube podcast clears downloaded file size
         if self.state != gpodder.STATE_DOWNLOADED:
@@ -916,7 +1369,8 @@ class PodcastEpisode(PodcastModelObject):
 
 
 class PodcastChannel(PodcastModelObject):
-    __slots__ = schema.PodcastColumns + ('_common_prefix', '_update_error',)
+    __slots__ = schema.PodcastColumns + ('_common_prefix', '_update_error', 'last_timings', 'last_failed_update',)
+    COLUMNS = frozenset(schema.PodcastColumns)
 
     UNICODE_TRANSLATE = {ord('ö'): 'o', ord('ä'): 'a', ord('ü'): 'u'}
 
@@ -936,6 +1390,13 @@ class PodcastChannel(PodcastModelObject):
 
     feed_fetcher = gPodderFetcher()
 
+    # Fetch the next page of paged feeds in the background (see FeedPager)
+    PREFETCH_PAGES = True
+
+    # Delay after the first failed update, doubled for every failure in a row
+    UPDATE_BACKOFF_MIN = 15 * 60
+    UPDATE_BACKOFF_MAX = 2 * SECONDS_PER_DAY
+
     def __init__(self, model, channel_id=None):
         self.parent = model
         self.children = []
@@ -953,12 +1414,30 @@ class PodcastChannel(PodcastModelObject):
 
         self.http_last_modified = None
         self.http_etag = None
+        self.http_content_digest = None
+
+        # Number of times the feed was downloaded, but had not changed
+        self.unchanged_responses = 0
+
+        # Time of the last successful check, and the number of checks in
+        # a row without new episodes (see feedupdater.FeedScheduler)
+        self.last_check = 0
+        self.unchanged_checks = 0
+
+        # Unix timestamps until which the last response is fresh, and
+        # before which the server asked us not to retry (Retry-After)
+        self.http_expires = 0
+        self.http_retry_after = 0
+
+        # Number of failed updates in a row, and the time of the next
+        # attempt (see update_failed())
+        self.update_failures = 0
+        self.next_update_attempt = 0
 
         self.auto_archive_episodes = False
         self.download_folder = None
         self.pause_subscription = False
         self.sync_to_mp3_player = True
-        self.cover_thumb = None
 
         self.section = _('Other')
         self._common_prefix = None
@@ -970,6 +1449,12 @@ class PodcastChannel(PodcastModelObject):
 
         self._update_error = None
 
+        # telemetry.FeedTimings of the last update
+        self.last_timings = None
+
+        # Unix timestamp of the last failed update (not stored, see feedupdater.FeedScheduler)
+        self.last_failed_update = 0
+
     @property
     def model(self):
         return self.parent
@@ -1001,6 +1486,11 @@ class PodcastChannel(PodcastModelObject):
         self.url = new_url
         self.http_etag = None
         self.http_last_modified = None
+        self.http_content_digest = None
+        self.http_expires = 0
+        self.http_retry_after = 0
+        self.update_failures = 0
+        self.next_update_attempt = 0
         self.save()
         return new_url
 
@@ -1121,23 +1611,26 @@ class PodcastChannel(PodcastModelObject):
                 tmp.delete()
                 raise
 
-            # Determine the section in which this podcast should appear
-            tmp.section = tmp._get_content_type()
+            tmp._complete_subscription()
+            tmp.save()
 
-            # Determine a new download folder now that we have the title
-            tmp.get_save_dir(force_new=True)
+            gpodder.user_extensions.on_podcast_subscribe(tmp)
 
-            # Mark episodes as downloaded if files already exist (bug 902)
-            tmp.check_download_folder()
+            return tmp
 
-            # Determine common prefix of episode titles
-            tmp._determine_common_prefix()
+    def _complete_subscription(self):
+        """Set up a new podcast after its feed has been loaded"""
+        # Determine the section in which this podcast should appear
+        self.section = self._get_content_type()
 
-            tmp.save()
+        # Determine a new download folder now that we have the title
+        self.get_save_dir(force_new=True)
 
-            gpodder.user_extensions.on_podcast_subscribe(tmp)
+        # Mark episodes as downloaded if files already exist (bug 902)
+        self.check_download_folder()
 
-            return tmp
+        # Determine common prefix of episode titles
+        self._determine_common_prefix()
 
     def episode_factory(self, d):
         """
@@ -1186,10 +1679,6 @@ class PodcastChannel(PodcastModelObject):
                                feed.get_cover_url() or None,
                                feed.get_payment_url() or None)
 
-        # Update values for HTTP conditional requests
-        self.http_etag = feed.get_http_etag() or self.http_etag
-        self.http_last_modified = feed.get_http_last_modified() or self.http_last_modified
-
         # Load all episodes to update them properly.
         existing = self.get_all_episodes()
         # GUID-based existing episode list
@@ -1204,40 +1693,58 @@ class PodcastChannel(PodcastModelObject):
             logger.debug('Episode published in the future for podcast %s', self.title)
             last_published = tomorrow
 
-        # new episodes from feed
-        new_episodes, seen_guids = feed.get_new_episodes(self, existing_guids)
-
-        # pagination
-        next_feed = feed
-        next_max_episodes = max_episodes - len(seen_guids)
-        # want to paginate if:
-        #  - we raised the max episode count so we want more old episodes now
-        #    FIXME: could also be that feed has less episodes than max_episodes and we're paginating for nothing
-        #  - all episodes are new so we continue getting them until max_episodes is reached
-        could_have_more = max_episodes > len(existing) or len(new_episodes) == len(seen_guids)
-        while next_feed and could_have_more:
-            if max_episodes > 0 and next_max_episodes <= 0:
-                logger.debug("stopping pagination: seen enough episodes (%i)", max_episodes)
-                break
-            # brand new: try to load another page!
-            next_result = next_feed.get_next_page(self, next_max_episodes)
-            if next_result and next_result.status == feedcore.UPDATED_FEED:
-                next_feed = next_result.feed
-                for e in new_episodes:
-                    existing_guids[e.guid] = e
-                next_new_episodes, next_seen_guids = next_feed.get_new_episodes(self, existing_guids)
-                logger.debug("next page has %i new episodes, %i seen episodes", len(next_new_episodes), len(next_seen_guids))
-                if not next_seen_guids:
-                    logger.debug("breaking out of get_next_page loop because no episode in this page")
+        # Fetch the next page of paged feeds while merging the current one,
+        # when it is going to be needed (see could_have_more below)
+        pager = FeedPager(self)
+        try:
+            if self.PREFETCH_PAGES and feed.has_next_page():
+                guids = feed.get_guids()
+                if max_episodes > len(existing) or (guids is not None and not guids & existing_guids.keys()):
+                    pager.prefetch(feed, max_episodes)
+
+            # new episodes from feed
+            new_episodes, seen_guids = feed.get_new_episodes(self, existing_guids)
+
+            # pagination
+            next_feed = feed
+            next_max_episodes = max_episodes - len(seen_guids)
+            # want to paginate if:
+            #  - we raised the max episode count so we want more old episodes now
+            #    FIXME: could also be that feed has less episodes than max_episodes and we're paginating for nothing
+            #  - all episodes are new so we continue getting them until max_episodes is reached
+            could_have_more = max_episodes > len(existing) or len(new_episodes) == len(seen_guids)
+            while next_feed and could_have_more:
+                if max_episodes > 0 and next_max_episodes <= 0:
+                    logger.debug("stopping pagination: seen enough episodes (%i)", max_episodes)
                     break
-                next_max_episodes -= len(next_seen_guids)
-                new_episodes += next_new_episodes
-                seen_guids = seen_guids.union(next_seen_guids)
-            else:
-                next_feed = None
+                # brand new: try to load another page!
+                next_result = pager.next_page(next_feed, next_max_episodes)
+                if next_result and next_result.status == feedcore.UPDATED_FEED:
+                    next_feed = next_result.feed
+                    if self.PREFETCH_PAGES and next_feed.has_next_page():
+                        # Not when this page has no episodes or is the last one needed
+                        guids = next_feed.get_guids()
+                        if guids and (max_episodes <= 0 or next_max_episodes - len(guids) > 0):
+                            pager.prefetch(next_feed, next_max_episodes)
+                    for e in new_episodes:
+                        existing_guids[e.guid] = e
+                    next_new_episodes, next_seen_guids = next_feed.get_new_episodes(self, existing_guids)
+                    logger.debug("next page has %i new episodes, %i seen episodes", len(next_new_episodes), len(next_seen_guids))
+                    if not next_seen_guids:
+                        logger.debug("breaking out of get_next_page loop because no episode in this page")
+                        break
+                    next_max_episodes -= len(next_seen_guids)
+                    new_episodes += next_new_episodes
+                    seen_guids = seen_guids.union(next_seen_guids)
+                else:
+                    next_feed = None
+        finally:
+            # Cancel the prefetched page if pagination stopped before it
+            pager.close()
 
         # mark episodes not new
         real_new_episodes = []
+        not_new_episodes = []
         # Search all entries for new episodes
         for episode in new_episodes:
             # Workaround for bug 340: If the episode has been
@@ -1246,88 +1753,222 @@ class PodcastChannel(PodcastModelObject):
             if episode.published < last_published - self.SECONDS_PER_WEEK:
                 logger.debug('Episode with old date: %s', episode.title)
                 episode.is_new = False
-                episode.save()
+                not_new_episodes.append(episode)
 
             if episode.is_new:
                 real_new_episodes.append(episode)
 
             # Only allow a certain number of new episodes per update
             if (self.download_strategy == PodcastChannel.STRATEGY_LATEST
-                    and len(real_new_episodes) > 1):
+                    and len(real_new_episodes) > 1 and episode.is_new):
                 episode.is_new = False
-                episode.save()
+                not_new_episodes.append(episode)
 
+        self.save_episodes(not_new_episodes)
         self.children.extend(new_episodes)
 
         self.remove_unreachable_episodes(existing, seen_guids, max_episodes)
+
+        # Update values for HTTP conditional requests, only now that the feed
+        # is merged: if that fails, the next update gets the whole feed again
+        self.http_etag = feed.get_http_etag() or self.http_etag
+        self.http_last_modified = feed.get_http_last_modified() or self.http_last_modified
+        self.http_content_digest = feed.get_content_digest()
+
         return real_new_episodes
 
     def remove_unreachable_episodes(self, existing, seen_guids, max_episodes):
+        if self.id is None:
+            return
+
         # Remove "unreachable" episodes - episodes that have not been
         # downloaded and that the feed does not list as downloadable anymore
         # Keep episodes that are currently being downloaded, though (bug 1534)
-        if self.id is not None:
-            episodes_to_purge = [e for e in existing if
-                    e.state != gpodder.STATE_DOWNLOADED
-                    and e.guid not in seen_guids and not e.downloading]
+        episodes_to_purge = [e for e in existing if
+                e.state != gpodder.STATE_DOWNLOADED
+                and e.guid not in seen_guids and not e.downloading]
 
-            for episode in episodes_to_purge:
-                logger.debug('Episode removed from feed: %s (%s)',
-                        episode.title, episode.guid)
-                gpodder.user_extensions.on_episode_removed_from_podcast(episode)
-                self.db.delete_episode_by_guid(episode.guid, self.id)
+        for episode in episodes_to_purge:
+            logger.debug('Episode removed from feed: %s (%s)',
+                    episode.title, episode.guid)
+            gpodder.user_extensions.on_episode_removed_from_podcast(episode)
 
-                # Remove the episode from the "children" episodes list
-                if self.children is not None:
-                    self.children.remove(episode)
+        removed_ids = {episode.id for episode in episodes_to_purge}
+        self.db.delete_episodes(removed_ids)
 
         # This *might* cause episodes to be skipped if there were more than
         # limit.episodes items added to the feed between updates.
         # The benefit is that it prevents old episodes from appearing as new
         # in certain situations (see bug #340).
-        self.db.purge(max_episodes, self.id)  # TODO: Remove from self.children!
+        removed_ids.update(self.db.purge(max_episodes, self.id))
 
-        # Sort episodes by pubdate, descending
-        self.children.sort(key=lambda e: e.published, reverse=True)
+        # Remove the episodes from the "children" episodes list,
+        # and sort the remaining ones by pubdate, descending
+        self.children[:] = sorted((e for e in self.children if e.id not in removed_ids),
+                                  key=lambda e: e.published, reverse=True)
 
-    def update(self, max_episodes=0):
-        max_episodes = int(max_episodes)
-        new_episodes = []
-        try:
-            result = self.feed_fetcher.fetch_channel(self, max_episodes)
+    def fetch_feed(self, max_episodes=0, force=False):
+        """Fetch and parse the feed of this podcast
 
-            if result.status == feedcore.UPDATED_FEED:
-                new_episodes = self._consume_updated_feed(result.feed, max_episodes)
-            elif result.status == feedcore.NEW_LOCATION:
-                # FIXME: could return the feed because in autodiscovery it is parsed already
-                url = result.feed
-                logger.info('New feed location: %s => %s', self.url, url)
-                if url in {x.url for x in self.model.get_podcasts()}:
-                    raise Exception('Already subscribed to ' + url)
-                self.url = url
-                # With the updated URL, fetch the feed again
-                self.update(max_episodes)
-                return new_episodes
-            elif result.status == feedcore.NOT_MODIFIED:
-                pass
+        This is the network-bound part of update(). It does not touch
+        the database, so it can run on a worker thread while another
+        thread consumes the results with update_from_result().
 
-            self.save()
+        Set "force" for updates the user asked for explicitly, see
+        gPodderFetcher.fetch_channel().
+
+        Returns a feedcore.Result, raises on errors.
+        """
+        timings = telemetry.current() or telemetry.FeedTimings(self.url, self.title)
+        self.last_timings = timings
+        with telemetry.recording(timings):
+            try:
+                return self.feed_fetcher.fetch_channel(self, int(max_episodes), force)
+            except Exception as e:
+                timings.status = 'error: ' + type(e).__name__
+                raise
+
+    def update(self, max_episodes=0, force=False):
+        try:
+            result = self.fetch_feed(max_episodes, force)
         except Exception as e:
-            #  "Not really" errors
-            # feedcore.AuthenticationRequired
-            #  Temporary errors
-            # feedcore.Offline
-            # feedcore.BadRequest
-            # feedcore.InternalServerError
-            # feedcore.WifiLogin
-            #  Permanent errors
-            # feedcore.Unsubscribe
-            # feedcore.NotFound
-            # feedcore.InvalidFeed
-            # feedcore.UnknownStatusCode
-            gpodder.user_extensions.on_podcast_update_failed(self, e)
+            self.update_failed(e)
             raise
 
+        return self.update_from_result(result, max_episodes)
+
+    def update_failed(self, error):
+        """Handle an exception raised while updating this podcast
+
+        The podcast is not updated again before an exponentially growing
+        (randomized) delay, or the server-provided Retry-After, is over.
+        """
+        self.last_failed_update = int(time.time())
+        if self.id is not None and not isinstance(error, feedcore.AuthenticationRequired):
+            now = time.time()
+            self.update_failures += 1
+            delay = min(self.UPDATE_BACKOFF_MIN * 2 ** (self.update_failures - 1), self.UPDATE_BACKOFF_MAX)
+            next_attempt = now + delay * random.uniform(0.5, 1.0)
+
+            retry_after = getattr(error, 'retry_after', None)
+            if retry_after:
+                self.http_retry_after = int(now + retry_after)
+                next_attempt = max(next_attempt, self.http_retry_after)
+
+            self.next_update_attempt = int(next_attempt)
+            logger.info('Update of %s failed %d time(s), next attempt at %s', self.url,
+                        self.update_failures, time.ctime(self.next_update_attempt))
+            self.save()
+            self.db.commit()
+
+        gpodder.user_extensions.on_podcast_update_failed(self, error)
+
+    def seconds_until_next_attempt(self):
+        """Seconds until the next update after failures, 0 if not failing"""
+        return max(0, self.next_update_attempt - time.time())
+
+    def get_backoff_message(self):
+        """Describe why the podcast is not updated at the moment, or None"""
+        seconds = self.seconds_until_next_attempt()
+        if not seconds:
+            return None
+
+        # Minutes are precise enough
+        delay = util.format_seconds_to_hour_min_sec(max(60, seconds - seconds % 60))
+        return N_('%(count)d failed update, next attempt in %(delay)s',
+                  '%(count)d failed updates, next attempt in %(delay)s',
+                  self.update_failures) % {'count': self.update_failures, 'delay': delay}
+
+    def was_skipped(self):
+        """True if the last update did not check the feed (see gPodderFetcher.fetch_channel)"""
+        return self.last_timings is not None and self.last_timings.status == 'skipped'
+
+    def get_skip_message(self):
+        """Describe why the last update was skipped"""
+        message = self.get_backoff_message()
+        if message is not None:
+            return message
+
+        # Still fresh (Cache-Control/Expires)
+        seconds = max(0, self.http_expires - time.time())
+        delay = util.format_seconds_to_hour_min_sec(max(60, seconds - seconds % 60))
+        return _('Up to date, next check in %(delay)s') % {'delay': delay}
+
+    def update_from_result(self, result, max_episodes=0):
+        """Apply the result of fetch_feed() to this podcast and the database
+
+        Returns the list of new episodes.
+        """
+        if self.last_timings is None:
+            self.last_timings = telemetry.FeedTimings(self.url, self.title)
+        timings = self.last_timings
+        with telemetry.recording(timings):
+            try:
+                return self._apply_result(result, int(max_episodes))
+            except Exception as e:
+                #  "Not really" errors
+                # feedcore.AuthenticationRequired
+                #  Temporary errors
+                # feedcore.Offline
+                # feedcore.BadRequest
+                # feedcore.InternalServerError
+                # feedcore.WifiLogin
+                #  Permanent errors
+                # feedcore.Unsubscribe
+                # feedcore.NotFound
+                # feedcore.InvalidFeed
+                # feedcore.UnknownStatusCode
+                timings.status = 'error: ' + type(e).__name__
+                self.update_failed(e)
+                raise
+
+    def _apply_result(self, result, max_episodes):
+        new_episodes = []
+        timings = telemetry.current()
+        if (result.status == feedcore.UPDATED_FEED and self.http_content_digest is not None
+                and result.feed.get_content_digest() == self.http_content_digest):
+            # The server sent the same feed again, handle it like NOT_MODIFIED
+            logger.debug('Feed content has not changed: %s', self.url)
+            self.unchanged_responses += 1
+            timings.status = 'unchanged'
+        elif result.status == feedcore.UPDATED_FEED:
+            with telemetry.phase('diff'):
+                new_episodes = self._consume_updated_feed(result.feed, max_episodes)
+            timings.status = 'updated'
+        elif result.status == feedcore.NEW_LOCATION:
+            url = result.feed
+            logger.info('New feed location: %s => %s', self.url, url)
+            if url in {x.url for x in self.model.get_podcasts()}:
+                raise Exception('Already subscribed to ' + url)
+            self.url = url
+            self.http_content_digest = None
+            self.http_expires = 0
+            # Use the feed at the new URL if it has been fetched already (redirects
+            # and autodiscovery), or else fetch it with the updated URL
+            location_result = result.location_result
+            if location_result is None:
+                location_result = self.fetch_feed(max_episodes)
+            return self._apply_result(location_result, max_episodes)
+        elif result.status == feedcore.NOT_MODIFIED:
+            timings.status = 'not modified'
+        elif result.status == feedcore.SKIPPED:
+            # Not checked, so the schedule and the statistics stay the same
+            timings.status = 'skipped'
+            return new_episodes
+
+        self.http_expires = int(result.expires or 0)
+        self.http_retry_after = 0
+        self.update_failures = 0
+        self.next_update_attempt = 0
+
+        self.last_check = int(time.time())
+        if new_episodes:
+            self.unchanged_checks = 0
+        else:
+            self.unchanged_checks += 1
+
+        self.save()
+
         gpodder.user_extensions.on_podcast_updated(self)
 
         # Re-determine the common prefix for all episodes
@@ -1349,6 +1990,13 @@ class PodcastChannel(PodcastModelObject):
         self.db.save_podcast(self)
         self.model._append_podcast(self)
 
+    def save_episodes(self, episodes):
+        """Save many episodes of this podcast at once, like PodcastEpisode.save()"""
+        episodes = list(episodes)
+        for episode in episodes:
+            gpodder.user_extensions.on_episode_save(episode)
+        self.db.save_episodes(episodes)
+
     def get_statistics(self):
         if self.id is None:
             return (0, 0, 0, 0, 0)
@@ -1492,6 +2140,18 @@ class PodcastChannel(PodcastModelObject):
     def cover_file(self):
         return os.path.join(self.save_dir, 'folder')
 
+    @property
+    def cover_thumb(self):
+        """Thumbnail of the cover art (PNG data), stored in its own table"""
+        if self.id is None:
+            return None
+        return self.db.get_cover_thumb(self.id)
+
+    @cover_thumb.setter
+    def cover_thumb(self, data):
+        if self.id is not None:
+            self.db.save_cover_thumb(self.id, data)
+
 
 class Model(object):
     PodcastClass = PodcastChannel
@@ -1499,6 +2159,7 @@ class Model(object):
     def __init__(self, db):
         self.db = db
         self.children = None
+        self.youtube_durations = youtube.DurationResolver(db)
 
     def _append_podcast(self, podcast):
         if podcast not in self.children:
@@ -1508,12 +2169,25 @@ class Model(object):
         self.children.remove(podcast)
         gpodder.user_extensions.on_podcast_delete(podcast)
 
+    def load_episodes(self, podcasts):
+        """Load the episodes of many podcasts with a single query
+
+        For the podcasts of the model, all at once or in chunks.
+        """
+        episodes = self.db.load_all_episodes({podcast.id: podcast.episode_factory for podcast in podcasts})
+        for podcast in podcasts:
+            podcast.children = episodes[podcast.id]
+            podcast._determine_common_prefix()
+
     def get_podcasts(self):
         def podcast_factory(dct, db):
-            return self.PodcastClass.create_from_dict(dct, self, dct['id'])
+            # Without the ID, the episodes are not loaded for each podcast
+            return self.PodcastClass.create_from_dict(dct, self)
 
         if self.children is None:
-            self.children = self.db.load_podcasts(podcast_factory)
+            podcasts = self.db.load_podcasts(podcast_factory)
+            self.load_episodes(podcasts)
+            self.children = podcasts
 
             # Check download folders for changes (bug 902)
             for podcast in self.children:
@@ -1534,6 +2208,98 @@ class Model(object):
                                       authentication_tokens,
                                       max_episodes)
 
+    def save_podcasts(self, podcasts):
+        """Save many podcasts at once, like PodcastChannel.save()"""
+        podcasts = list(podcasts)
+        for podcast in podcasts:
+            if podcast.download_folder is None:
+                podcast.get_save_dir()
+            gpodder.user_extensions.on_podcast_save(podcast)
+
+        self.db.save_podcasts(podcasts)
+        for podcast in podcasts:
+            self._append_podcast(podcast)
+
+    def subscribe_podcasts(self, entries, max_episodes=0, max_workers=4, max_per_host=2,
+                           progress_callback=None, batch_size=50):
+        """Subscribe to many podcasts at once, e.g. from an OPML file
+
+        "entries" is an iterable of (url, title) pairs; title can be None
+        to use the title of the feed. It is consumed in batches of
+        batch_size podcasts, so it can be a generator still reading the
+        list. The feeds of a batch are fetched concurrently (see
+        feedupdater.FeedUpdater) and each batch is committed at once.
+
+        progress_callback(url, podcast, error) is called for each URL
+        that is not subscribed yet; podcast is None if subscribing failed.
+
+        Returns (podcasts, failed), the list of new podcasts and a list
+        of (url, exception) for the URLs that failed.
+        """
+        updater = feedupdater.FeedUpdater(max_workers, max_per_host)
+        known_urls = {podcast.url for podcast in self.get_podcasts()}
+        podcasts = []
+        failed = []
+
+        def fail(url, error):
+            failed.append((url, error))
+            if progress_callback is not None:
+                progress_callback(url, None, error)
+
+        def on_progress(podcast, episodes, error, position, total):
+            if error is not None:
+                errors.add(podcast)
+                podcast.remove_downloaded()
+                podcast.delete()
+                fail(podcast.url, error)
+            elif progress_callback is not None:
+                progress_callback(podcast.url, podcast, None)
+
+        entries = iter(entries)
+        while True:
+            batch = []
+            titles = {}
+            for original_url, title in itertools.islice(entries, batch_size):
+                url = util.normalize_feed_url(original_url)
+                if url is None:
+                    fail(original_url, ValueError(_('Invalid url: %s') % original_url))
+                    continue
+
+                url = youtube.parse_youtube_url(url)
+                if url in known_urls:
+                    logger.info('Already subscribed to %s', url)
+                    continue
+                known_urls.add(url)
+
+                podcast = self.PodcastClass(self)
+                podcast.url = url
+                if title:
+                    podcast.title = titles[podcast] = title
+                batch.append(podcast)
+
+            if not batch:
+                break
+
+            errors = set()
+            with self.db.deferred_commits():
+                # Save the podcasts, so they get an ID assigned before their episodes are saved
+                self.save_podcasts(batch)
+                updater.update(batch, max_episodes, progress_callback=on_progress)
+
+                subscribed = [podcast for podcast in batch if podcast not in errors]
+                for podcast in subscribed:
+                    if podcast in titles:
+                        # Prefer the title from the subscription list (bug 1711)
+                        podcast.title = titles[podcast]
+                    podcast._complete_subscription()
+                self.save_podcasts(subscribed)
+
+            for podcast in subscribed:
+                gpodder.user_extensions.on_podcast_subscribe(podcast)
+            podcasts.extend(subscribed)
+
+        return podcasts, failed
+
     @classmethod
     def podcast_sort_key(cls, podcast):
         return cls.PodcastClass.sort_key(podcast)
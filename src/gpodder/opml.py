@@ -34,12 +34,12 @@ objects to valid OPML 1.1 files that can be used to backup
 or distribute gPodder's channel subscriptions.
 """
 
-import io
 import logging
 import os
 import os.path
-import xml.dom.minidom
+import xml.etree.ElementTree
 from email.utils import formatdate
+from xml.sax.saxutils import escape, quoteattr
 
 import gpodder
 from gpodder import util
@@ -47,6 +47,69 @@ from gpodder import util
 logger = logging.getLogger(__name__)
 
 
+def parse(url):
+    """Yield the channels of an OPML file or URL while it is parsed
+
+    Each channel is a dict with the keys "url", "title" and
+    "description". Only the current outline is kept in memory, so
+    large files can be imported while they are being read.
+    """
+    if os.path.exists(url):
+        with open(url, 'rb') as fp:
+            yield from _parse_stream(fp)
+    else:
+        with util.urlopen(url, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            yield from _parse_stream(response.raw)
+
+
+def _parse_stream(stream):
+    # Elements being parsed, from the root down
+    parents = []
+    for event, outline in xml.etree.ElementTree.iterparse(stream, events=('start', 'end')):
+        if event == 'end':
+            # The attributes have been used on "start" already, remove the
+            # element so that the tree doesn't grow with each outline
+            parents.pop()
+            if parents:
+                parents[-1].remove(outline)
+            continue
+
+        parents.append(outline)
+        if outline.tag != 'outline':
+            continue
+
+        # Make sure we are dealing with a valid link type (ignore case)
+        otl_type = outline.get('type')
+        if otl_type is None or otl_type.lower() not in Importer.VALID_TYPES:
+            continue
+
+        if outline.get('xmlUrl') or outline.get('url'):
+            channel = {
+                'url':
+                    outline.get('xmlUrl')
+                    or outline.get('url'),
+                'title':
+                    outline.get('title')
+                    or outline.get('text')
+                    or outline.get('xmlUrl')
+                    or outline.get('url'),
+                'description':
+                    outline.get('text')
+                    or outline.get('xmlUrl')
+                    or outline.get('url'),
+            }
+
+            if channel['description'] == channel['title']:
+                channel['description'] = channel['url']
+
+            for attr in ('url', 'title', 'description'):
+                channel[attr] = channel[attr].strip()
+
+            yield channel
+
+
 class Importer(object):
     """
     Helper class to import an OPML feed from protocols
@@ -55,6 +118,9 @@ class Importer(object):
 
     This class should support standard OPML feeds and
     contains workarounds to support odeo.com feeds.
+
+    To import large files without reading them completely
+    first, use parse() instead.
     """
 
     VALID_TYPES = ('rss', 'link')
@@ -64,41 +130,7 @@ class Importer(object):
         Parses the OPML feed from the given URL into
         a local data structure containing channel metadata.
         """
-        self.items = []
-        if os.path.exists(url):
-            doc = xml.dom.minidom.parse(url)
-        else:
-            doc = xml.dom.minidom.parse(io.BytesIO(util.urlopen(url).content))
-
-        for outline in doc.getElementsByTagName('outline'):
-            # Make sure we are dealing with a valid link type (ignore case)
-            otl_type = outline.getAttribute('type')
-            if otl_type is None or otl_type.lower() not in self.VALID_TYPES:
-                continue
-
-            if outline.getAttribute('xmlUrl') or outline.getAttribute('url'):
-                channel = {
-                    'url':
-                        outline.getAttribute('xmlUrl')
-                        or outline.getAttribute('url'),
-                    'title':
-                        outline.getAttribute('title')
-                        or outline.getAttribute('text')
-                        or outline.getAttribute('xmlUrl')
-                        or outline.getAttribute('url'),
-                    'description':
-                        outline.getAttribute('text')
-                        or outline.getAttribute('xmlUrl')
-                        or outline.getAttribute('url'),
-                }
-
-                if channel['description'] == channel['title']:
-                    channel['description'] = channel['url']
-
-                for attr in ('url', 'title', 'description'):
-                    channel[attr] = channel[attr].strip()
-
-                self.items.append(channel)
+        self.items = list(parse(url))
         if not len(self.items):
             logger.info('OPML import finished, but no items found: %s', url)
 
@@ -113,6 +145,12 @@ class Exporter(object):
 
     FEED_TYPE = 'rss'
 
+    # We want to have at least 512 KiB free disk space after
+    # saving the opml data, if this is not possible, don't
+    # keep the new file, but keep the old one so we don't
+    # end up with a clobbed, empty opml file.
+    FREE_DISK_SPACE_AFTER = 1024 * 512
+
     def __init__(self, filename):
         if filename is None:
             self.filename = None
@@ -121,33 +159,41 @@ class Exporter(object):
         else:
             self.filename = '%s.opml' % (filename, )
 
-    def create_node(self, doc, name, content):
+    def create_outline(self, channel):
         """
-        Creates a simple XML Element node in a document
-        with tag name "name" and text content "content",
-        as in <name>content</name> and returns the element.
+        Creates a OPML outline element (as a string)
+        for the supplied channel.
         """
-        node = doc.createElement(name)
-        node.appendChild(doc.createTextNode(content))
-        return node
+        return '<outline title=%s text=%s xmlUrl=%s type=%s/>' % (
+            quoteattr(channel.title), quoteattr(channel.description),
+            quoteattr(channel.url), quoteattr(self.FEED_TYPE))
 
-    def create_outline(self, doc, channel):
+    def write_document(self, fp, channels):
         """
-        Creates a OPML outline as XML Element node in a
-        document for the supplied channel.
+        Writes the OPML document to the binary file object "fp",
+        one outline at a time while iterating over "channels".
         """
-        outline = doc.createElement('outline')
-        outline.setAttribute('title', channel.title)
-        outline.setAttribute('text', channel.description)
-        outline.setAttribute('xmlUrl', channel.url)
-        outline.setAttribute('type', self.FEED_TYPE)
-        return outline
+        def line(indent, text):
+            fp.write(('    ' * indent + text + os.linesep).encode('utf-8'))
+
+        line(0, '<?xml version="1.0" encoding="utf-8"?>')
+        line(0, '<opml version="2.0">')
+        line(1, '<head>')
+        line(2, '<title>%s</title>' % escape('gPodder subscriptions'))
+        line(2, '<dateCreated>%s</dateCreated>' % escape(formatdate(localtime=True)))
+        line(1, '</head>')
+        line(1, '<body>')
+        for channel in channels:
+            line(2, self.create_outline(channel))
+        line(1, '</body>')
+        line(0, '</opml>')
 
     def write(self, channels):
         """
-        Creates a XML document containing metadata for each
+        Writes a XML document containing metadata for each
         channel object in the "channels" parameter, which
-        should be a list of channel objects.
+        can be any iterable of channel objects. The outlines
+        are written while iterating, so it can be a generator.
 
         OPML 2.0 specification: http://www.opml.org/spec2
 
@@ -157,44 +203,27 @@ class Exporter(object):
         if self.filename is None:
             return False
 
-        doc = xml.dom.minidom.Document()
-
-        opml = doc.createElement('opml')
-        opml.setAttribute('version', '2.0')
-        doc.appendChild(opml)
-
-        head = doc.createElement('head')
-        head.appendChild(self.create_node(doc, 'title', 'gPodder subscriptions'))
-        head.appendChild(self.create_node(doc, 'dateCreated', formatdate(localtime=True)))
-        opml.appendChild(head)
-
-        body = doc.createElement('body')
-        for channel in channels:
-            body.appendChild(self.create_outline(doc, channel))
-        opml.appendChild(body)
-
+        path = os.path.dirname(self.filename) or os.path.curdir
+        tmp_filename = self.filename + '.tmp'
         try:
-            data = doc.toprettyxml(encoding='utf-8', indent='    ', newl=os.linesep)
-            # We want to have at least 512 KiB free disk space after
-            # saving the opml data, if this is not possible, don't
-            # try to save the new file, but keep the old one so we
-            # don't end up with a clobbed, empty opml file.
-            FREE_DISK_SPACE_AFTER = 1024 * 512
-            path = os.path.dirname(self.filename) or os.path.curdir
+            with open(tmp_filename, 'wb') as fp:
+                self.write_document(fp, channels)
+
             available = util.get_free_disk_space(path)
-            if available != -1 and available < 2 * len(data) + FREE_DISK_SPACE_AFTER:
+            if available != -1 and available < self.FREE_DISK_SPACE_AFTER:
                 # On Windows, if we have zero bytes available, assume that we have
                 # not had the win32file module available + assume enough free space
                 if not gpodder.ui.win32 or available > 0:
                     logger.error('Not enough free disk space to save channel list to %s', self.filename)
+                    os.remove(tmp_filename)
                     return False
-            fp = open(self.filename + '.tmp', 'wb')
-            fp.write(data)
-            fp.close()
-            util.atomic_rename(self.filename + '.tmp', self.filename)
+
+            util.atomic_rename(tmp_filename, self.filename)
         except:
             logger.error('Could not open file for writing: %s', self.filename,
                     exc_info=True)
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
             return False
 
         return True
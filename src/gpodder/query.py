@@ -26,6 +26,7 @@ import datetime
 import re
 
 import gpodder
+from gpodder import model
 
 
 class Matcher(object):
@@ -35,8 +36,12 @@ class Matcher(object):
     EQL statements against episode objects.
     """
 
-    def __init__(self, episode):
+    def __init__(self, episode, descriptions=None):
         self._episode = episode
+        self._descriptions = descriptions
+
+    def _text_description(self):
+        return self._episode.get_text_description(self._descriptions)
 
     def match(self, term):
         try:
@@ -46,7 +51,7 @@ class Matcher(object):
                     return (needle in haystack)
                 if needle in self._episode.title:
                     return True
-                return (needle in self._episode._text_description)
+                return (needle in self._text_description())
 
             # case-insensitive search in haystack, or both title and description if no haystack
             def s(needle, haystack=None):
@@ -55,7 +60,7 @@ class Matcher(object):
                     return (needle in haystack.casefold())
                 if needle in self._episode.title.casefold():
                     return True
-                return (needle in self._episode._text_description.casefold())
+                return (needle in self._text_description().casefold())
 
             # case-sensitive regular expression search in haystack, or both title and description if no haystack
             def R(needle, haystack=None):
@@ -64,7 +69,7 @@ class Matcher(object):
                     return regexp.search(haystack)
                 if regexp.search(self._episode.title):
                     return True
-                return regexp.search(self._episode._text_description)
+                return regexp.search(self._text_description())
 
             # case-insensitive regular expression search in haystack, or both title and description if no haystack
             def r(needle, haystack=None):
@@ -73,7 +78,7 @@ class Matcher(object):
                     return regexp.search(haystack)
                 if regexp.search(self._episode.title):
                     return True
-                return regexp.search(self._episode._text_description)
+                return regexp.search(self._text_description())
 
             return bool(eval(term, {'__builtins__': None, 'S': S, 's': s, 'R': R, 'r': r}, self))
         except Exception:
@@ -113,7 +118,7 @@ class Matcher(object):
         elif k == 'title':
             return episode.title
         elif k == 'description':
-            return episode._text_description
+            return self._text_description()
         elif k == 'since':
             return (datetime.datetime.now() - datetime.datetime.fromtimestamp(episode.published)).days
         elif k == 'age':
@@ -219,19 +224,23 @@ class EQL(object):
             except Exception:
                 self._query = None
 
-    def match(self, episode):
+    def match(self, episode, descriptions=None):
+        """descriptions: see model.PodcastEpisode.get_text_descriptions()"""
         if self._query is None:
             return False
 
         if self._regex:
             return re.search(self._query, episode.title, self._flags) is not None
         elif self._string:
-            return self._query in episode.title.lower() or self._query in episode._text_description.lower()
+            return self._query in episode.title.lower() or self._query in episode.get_text_description(descriptions).lower()
 
-        return Matcher(episode).match(self._query)
+        return Matcher(episode, descriptions).match(self._query)
 
     def filter(self, episodes):
-        return list(filter(self.match, episodes))
+        episodes = list(episodes)
+        # Descriptions may be searched, read them together
+        descriptions = model.PodcastEpisode.get_text_descriptions(episodes) if not self._regex else None
+        return [episode for episode in episodes if self.match(episode, descriptions)]
 
 
 def UserEQL(query):
@@ -25,6 +25,7 @@ import shutil
 import time
 from sqlite3 import dbapi2 as sqlite
 
+import gpodder
 from gpodder import util
 
 logger = logging.getLogger(__name__)
@@ -54,6 +55,13 @@ EpisodeColumns = (
     'chapters',
 )
 
+# Large episode columns, not loaded with the episodes but when they are used
+EpisodeLazyColumns = (
+    'description',
+    'description_html',
+    'chapters',
+)
+
 PodcastColumns = (
     'title',
     'url',
@@ -71,10 +79,70 @@ PodcastColumns = (
     'payment_url',
     'download_strategy',
     'sync_to_mp3_player',
-    'cover_thumb',
+    'http_content_digest',
+    'unchanged_responses',
+    'last_check',
+    'unchanged_checks',
+    'http_expires',
+    'http_retry_after',
+    'update_failures',
+    'next_update_attempt',
+)
+
+CURRENT_VERSION = 16
+
+# Episode counters of the podcast_statistics table: (column, condition)
+StatisticsCounters = (
+    ('total', '1'),
+    ('deleted', 'state = %d' % gpodder.STATE_DELETED),
+    ('new', 'state = %d AND is_new' % gpodder.STATE_NORMAL),
+    ('downloaded', 'state = %d' % gpodder.STATE_DOWNLOADED),
+    ('unplayed', 'state = %d AND is_new' % gpodder.STATE_DOWNLOADED),
 )
 
-CURRENT_VERSION = 8
+# Statements creating the table for cover thumbnails, one per line
+COVER_THUMB_SQL = """
+CREATE TABLE podcast_cover_thumb (podcast_id INTEGER PRIMARY KEY NOT NULL, data BLOB NOT NULL)
+CREATE TRIGGER podcast_cover_thumb_delete AFTER DELETE ON podcast BEGIN DELETE FROM podcast_cover_thumb WHERE podcast_id = OLD.id; END
+"""
+
+
+def statistics_count_sql():
+    """Query counting the StatisticsCounters of all podcasts
+
+    With idx_episode_podcast_state, it only reads the index, not the episode table.
+    """
+    counts = ', '.join('SUM(%s)' % condition for name, condition in StatisticsCounters)
+    return 'SELECT podcast_id, %s FROM episode GROUP BY podcast_id' % counts
+
+
+def _statistics_sql():
+    """Statements creating the podcast_statistics table, one per line
+
+    The table is kept up to date by triggers on the episode table.
+    """
+    def change(row, sign):
+        def qualified(condition):
+            return condition.replace('state', row + '.state').replace('is_new', row + '.is_new')
+
+        counters = ', '.join('%s = %s %s (%s)' % (name, name, sign, qualified(condition))
+                             for name, condition in StatisticsCounters)
+        return 'UPDATE podcast_statistics SET %s WHERE podcast_id = %s.podcast_id;' % (counters, row)
+
+    create_row = 'INSERT OR IGNORE INTO podcast_statistics (podcast_id) VALUES (NEW.podcast_id);'
+    columns = ', '.join('%s INTEGER NOT NULL DEFAULT 0' % name for name, condition in StatisticsCounters)
+
+    return '\n'.join((
+        'CREATE TABLE podcast_statistics (podcast_id INTEGER PRIMARY KEY NOT NULL, %s)' % columns,
+        'INSERT INTO podcast_statistics %s' % statistics_count_sql(),
+        'CREATE TRIGGER episode_statistics_insert AFTER INSERT ON episode BEGIN %s %s END' % (
+            create_row, change('NEW', '+')),
+        'CREATE TRIGGER episode_statistics_delete AFTER DELETE ON episode BEGIN %s END' % change('OLD', '-'),
+        'CREATE TRIGGER episode_statistics_update AFTER UPDATE OF podcast_id, state, is_new ON episode BEGIN %s %s %s END' % (
+            change('OLD', '-'), create_row, change('NEW', '+')),
+        'CREATE TRIGGER podcast_statistics_delete AFTER DELETE ON podcast BEGIN '
+        'DELETE FROM podcast_statistics WHERE podcast_id = OLD.id; END',
+    ))
 
 
 # SQL commands to upgrade old database versions to new ones
@@ -123,6 +191,56 @@ UPGRADE_SQL = [
         ALTER TABLE episode ADD COLUMN chapters TEXT NULL DEFAULT NULL
         UPDATE podcast SET http_last_modified=NULL, http_etag=NULL
         """),
+
+        # Version 9: Digest of the last feed body, for servers that always send the same feed
+        # (to force a feed update, also reset http_content_digest in addition to the http_* fields)
+        (8, 9, """
+        ALTER TABLE podcast ADD COLUMN http_content_digest TEXT NULL DEFAULT NULL
+        ALTER TABLE podcast ADD COLUMN unchanged_responses INTEGER NOT NULL DEFAULT 0
+        """),
+
+        # Version 10: Time of the last feed check and number of checks in a row without
+        # new episodes, for scheduling feed updates
+        (9, 10, """
+        ALTER TABLE podcast ADD COLUMN last_check INTEGER NOT NULL DEFAULT 0
+        ALTER TABLE podcast ADD COLUMN unchanged_checks INTEGER NOT NULL DEFAULT 0
+        """),
+
+        # Version 11: Cache for the duration of YouTube videos
+        (10, 11, """
+        CREATE TABLE youtube_duration (video_id TEXT PRIMARY KEY, total_time INTEGER NOT NULL DEFAULT 0, checked INTEGER NOT NULL DEFAULT 0)
+        """),
+
+        # Version 12: Freshness of the last feed response (Cache-Control/Expires) and
+        # the time the server asked us to retry after (Retry-After)
+        (11, 12, """
+        ALTER TABLE podcast ADD COLUMN http_expires INTEGER NOT NULL DEFAULT 0
+        ALTER TABLE podcast ADD COLUMN http_retry_after INTEGER NOT NULL DEFAULT 0
+        """),
+
+        # Version 13: Failed updates in a row, and when to try again (exponential backoff)
+        (12, 13, """
+        ALTER TABLE podcast ADD COLUMN update_failures INTEGER NOT NULL DEFAULT 0
+        ALTER TABLE podcast ADD COLUMN next_update_attempt INTEGER NOT NULL DEFAULT 0
+        """),
+
+        # Version 14: Episode counts per podcast, maintained by triggers
+        (13, 14, _statistics_sql()),
+
+        # Version 15: Cover thumbnails in their own table, loaded when needed
+        # (podcast.cover_thumb is not used anymore)
+        (14, 15, COVER_THUMB_SQL.strip() + """
+        INSERT INTO podcast_cover_thumb SELECT id, cover_thumb FROM podcast WHERE cover_thumb IS NOT NULL
+        UPDATE podcast SET cover_thumb = NULL
+        """),
+
+        # Version 16: Indexes for the episodes of a podcast by date (loading, purging)
+        # and by state (statistics), idx_episode_podcast_id is a prefix of both
+        (15, 16, """
+        CREATE INDEX idx_episode_podcast_published ON episode (podcast_id, published DESC)
+        CREATE INDEX idx_episode_podcast_state ON episode (podcast_id, state, is_new)
+        DROP INDEX idx_episode_podcast_id
+        """),
 ]
 
 
@@ -147,7 +265,15 @@ def initialize_database(db):
         payment_url TEXT NULL DEFAULT NULL,
         download_strategy INTEGER NOT NULL DEFAULT 0,
         sync_to_mp3_player INTEGER NOT NULL DEFAULT 1,
-        cover_thumb BLOB NULL DEFAULT NULL
+        cover_thumb BLOB NULL DEFAULT NULL, -- unused, see podcast_cover_thumb
+        http_content_digest TEXT NULL DEFAULT NULL,
+        unchanged_responses INTEGER NOT NULL DEFAULT 0,
+        last_check INTEGER NOT NULL DEFAULT 0,
+        unchanged_checks INTEGER NOT NULL DEFAULT 0,
+        http_expires INTEGER NOT NULL DEFAULT 0,
+        http_retry_after INTEGER NOT NULL DEFAULT 0,
+        update_failures INTEGER NOT NULL DEFAULT 0,
+        next_update_attempt INTEGER NOT NULL DEFAULT 0
     )
     """)
 
@@ -188,7 +314,8 @@ def initialize_database(db):
     """)
 
     INDEX_SQL = """
-    CREATE INDEX idx_episode_podcast_id ON episode (podcast_id)
+    CREATE INDEX idx_episode_podcast_published ON episode (podcast_id, published DESC)
+    CREATE INDEX idx_episode_podcast_state ON episode (podcast_id, state, is_new)
     CREATE UNIQUE INDEX idx_episode_download_filename ON episode (podcast_id, download_filename)
     CREATE UNIQUE INDEX idx_episode_guid ON episode (podcast_id, guid)
     CREATE INDEX idx_episode_state ON episode (state)
@@ -200,6 +327,23 @@ def initialize_database(db):
     for sql in INDEX_SQL.strip().split('\n'):
         db.execute(sql)
 
+    # Create table for the duration of YouTube videos, by video ID
+    db.execute("""
+    CREATE TABLE youtube_duration (
+        video_id TEXT PRIMARY KEY,
+        total_time INTEGER NOT NULL DEFAULT 0,
+        checked INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+    # Create table for cover thumbnails
+    for sql in COVER_THUMB_SQL.strip().split('\n'):
+        db.execute(sql)
+
+    # Create table for the episode counts of each podcast
+    for sql in _statistics_sql().split('\n'):
+        db.execute(sql)
+
     # Create table for version info / metadata + insert initial data
     db.execute("""CREATE TABLE version (version integer)""")
     db.execute("INSERT INTO version (version) VALUES (%d)" % CURRENT_VERSION)
@@ -278,6 +422,14 @@ def convert_gpodder2_db(old_db, new_db):
                 0,
                 row['sync_to_devices'],
                 None,
+                None,
+                0,
+                0,
+                0,
+                0,
+                0,
+                0,
+                0,
         )
         new_db.execute("""
         INSERT INTO podcast VALUES (%s)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2023 The gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# gpodder.telemetry - Where the time goes when updating feeds
+
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import gpodder
+
+logger = logging.getLogger(__name__)
+
+
+# Phases of a feed update, in order. "other" is the time not spent in
+# any of the other phases.
+PHASES = ('connect', 'ttfb', 'transfer', 'parse', 'diff', 'db', 'hooks', 'other')
+
+# Number of update runs kept in the statistics file
+MAX_RUNS = 10
+
+
+class FeedTimings(object):
+    """Time spent in each phase while updating one podcast
+
+    Phases can be nested, the time of a phase does not include the
+    time of the phases inside it.
+    """
+
+    def __init__(self, url, title=''):
+        self.url = url
+        self.title = title
+        self.phases = collections.Counter()
+        self.bytes = 0
+        self.status = None
+        self._stack = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] += elapsed - self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'title': self.title,
+            'status': self.status,
+            'bytes': self.bytes,
+            'total': round(self.total, 4),
+            'phases': {name: round(self.phases[name], 4) for name in PHASES if self.phases[name]},
+        }
+
+
+_local = threading.local()
+
+
+def current():
+    """Return the FeedTimings recorded in this thread, or None"""
+    return getattr(_local, 'timings', None)
+
+
+@contextlib.contextmanager
+def recording(timings):
+    """Record the phases of this thread in "timings" (can be nested)"""
+    previous = current()
+    if previous is timings:
+        yield timings
+        return
+
+    _local.timings = timings
+    try:
+        with timings.phase('other'):
+            yield timings
+    finally:
+        _local.timings = previous
+
+
+def phase(name):
+    """Context manager adding the time spent to the current recording"""
+    timings = current()
+    if timings is None:
+        return contextlib.nullcontext()
+    return timings.phase(name)
+
+
+def timed(name):
+    """Decorator recording the time spent in a function as phase "name" """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_bytes(count):
+    timings = current()
+    if timings is not None:
+        timings.bytes += count
+
+
+class UpdateRun(object):
+    """Timings of the podcasts updated together"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.duration = None
+        self.feeds = []
+
+    def add(self, timings):
+        if timings is not None:
+            self.feeds.append(timings)
+
+    def finish(self):
+        self.duration = time.time() - self.started
+
+    def to_dict(self):
+        return {
+            'started': int(self.started),
+            'duration': round(self.duration or 0, 4),
+            'feeds': [timings.to_dict() for timings in self.feeds],
+        }
+
+
+def stats_file():
+    return os.path.join(gpodder.home, 'UpdateStats.json')
+
+
+def load_runs():
+    """Return the stored update runs (as dicts), oldest first"""
+    try:
+        with open(stats_file(), 'r') as fp:
+            return json.load(fp)['runs']
+    except FileNotFoundError:
+        return []
+    except Exception:
+        logger.warning('Cannot read update statistics', exc_info=True)
+        return []
+
+
+def save_run(run):
+    """Store an update run, keeping the last MAX_RUNS ones"""
+    if gpodder.home is None or not run.feeds:
+        return
+
+    runs = load_runs()
+    runs.append(run.to_dict())
+    filename = stats_file()
+    try:
+        with open(filename + '.tmp', 'w') as fp:
+            json.dump({'runs': runs[-MAX_RUNS:]}, fp)
+        os.replace(filename + '.tmp', filename)
+    except Exception:
+        logger.warning('Cannot write update statistics', exc_info=True)
+
+
+def report(runs, count=10):
+    """Summarize update runs
+
+    Returns a dict with the share of time spent per phase, and the
+    "count" slowest and largest feeds (averaged over all runs).
+    """
+    phases = collections.Counter()
+    per_feed = collections.OrderedDict()
+    for run in runs:
+        for feed in run['feeds']:
+            phases.update(feed['phases'])
+            entry = per_feed.setdefault(feed['url'], {'url': feed['url'], 'updates': 0, 'total': 0.0, 'bytes': 0})
+            entry['title'] = feed['title']
+            entry['status'] = feed['status']
+            entry['updates'] += 1
+            entry['total'] += feed['total']
+            entry['bytes'] += feed['bytes']
+
+    feeds = []
+    for entry in per_feed.values():
+        feeds.append(dict(entry, total=round(entry['total'] / entry['updates'], 4),
+                          bytes=entry['bytes'] // entry['updates']))
+
+    total = sum(phases.values())
+    return {
+        'runs': len(runs),
+        'updates': sum(feed['updates'] for feed in feeds),
+        'duration': round(sum(run['duration'] for run in runs), 4),
+        'phases': {name: round(phases[name] / total, 4) if total else 0.0 for name in PHASES},
+        'slowest': sorted(feeds, key=lambda feed: feed['total'], reverse=True)[:count],
+        'largest': sorted(feeds, key=lambda feed: feed['bytes'], reverse=True)[:count],
+    }
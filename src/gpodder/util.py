@@ -34,6 +34,7 @@ import datetime
 import email
 import glob
 import http.client
+import http.cookiejar
 import itertools
 import locale
 import logging
@@ -59,6 +60,7 @@ from html.parser import HTMLParser
 
 import requests
 import requests.exceptions
+import urllib3
 from requests.packages.urllib3.util.retry import Retry
 
 import gpodder
@@ -1239,6 +1241,116 @@ def url_add_authentication(url, username, password):
     return urllib.parse.urlunsplit(url_parts)
 
 
+# Long-lived HTTP sessions shared by all threads, see get_session()
+class _TimedConnectMixin(object):
+    """Record the time for DNS lookups, TCP and TLS handshakes (see gpodder.telemetry)"""
+    def connect(self):
+        from gpodder import telemetry
+        with telemetry.phase('connect'):
+            return super().connect()
+
+
+class _TimedHTTPConnection(_TimedConnectMixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def reset_sessions():
+    """Close all shared HTTP sessions
+
+    New sessions will be created on demand. This is called when the
+    network settings (proxy, connection pool size) change.
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+
+    for session in sessions:
+        session.close()
+
+
+def get_session(name='urlopen', retry_strategy=None):
+    """Get a shared requests.Session with pooled connections
+
+    Connections (and TLS handshakes) are reused between requests to the
+    same host. There is one session per "name" and proxy configuration;
+    retry_strategy is a callable returning the urllib3 Retry to use when
+    the session has to be created. Callers with a different retry
+    strategy must use a different name.
+
+    Cookies are not kept between requests, each request only sends the
+    cookies passed to it.
+    """
+    from gpodder import config
+    proxies = config._proxies
+    key = (name, tuple(sorted(proxies.items())) if proxies else None)
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            logger.debug('Creating HTTP session %s (proxies: %s)', name, proxies)
+            pool_connections, pool_maxsize = config._connection_pool
+            session = requests.Session()
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            adapter = _TimedHTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                max_retries=retry_strategy() if retry_strategy is not None else 0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+
+    return session
+
+
+class _RetryStrategy(Retry):
+    """Retry, but don't wait for a long Retry-After
+
+    When the server asks to wait more than MAX_RETRY_AFTER seconds, the
+    response is returned to the caller instead, which can decide to try
+    again later (see feedcore.get_retry_after()).
+    """
+    MAX_RETRY_AFTER = 10
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and (self.get_retry_after(response) or 0) > self.MAX_RETRY_AFTER:
+            raise urllib3.exceptions.MaxRetryError(_pool, url, urllib3.exceptions.ResponseError(
+                'Retry-After: %s' % response.headers.get('Retry-After')))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def _urlopen_retry_strategy():
+    # The last response is returned when retries are exhausted, callers check the status code
+    return _RetryStrategy(
+        total=3,
+        raise_on_status=False,
+        status_forcelist=Retry.RETRY_AFTER_STATUS_CODES.union((408, 418, 504, 598, 599,)))
+
+
 def urlopen(url, headers=None, data=None, timeout=None, **kwargs):
     """
     An URL opener with the User-agent set to gPodder (with version)
@@ -1252,13 +1364,7 @@ def urlopen(url, headers=None, data=None, timeout=None, **kwargs):
     if not timeout:
         timeout = gpodder.SOCKET_TIMEOUT
 
-    retry_strategy = Retry(
-        total=3,
-        status_forcelist=Retry.RETRY_AFTER_STATUS_CODES.union((408, 418, 504, 598, 599,)))
-    s = requests.Session()
-    a = requests.adapters.HTTPAdapter(max_retries=retry_strategy)
-    s.mount('http://', a)
-    s.mount('https://', a)
+    s = get_session('urlopen', _urlopen_retry_strategy)
     headers.update({'User-agent': gpodder.user_agent})
     proxies = config._proxies
     logger.debug(f"urlopen: url: {url}, proxies: {proxies}")
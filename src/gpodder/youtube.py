@@ -20,10 +20,13 @@
 #  Justin Forest <justin.forest@gmail.com> 2008-10-13
 #
 
+import collections
 import io
 import json
 import logging
 import re
+import threading
+import time
 import urllib
 import xml.etree.ElementTree
 from functools import lru_cache
@@ -262,6 +265,111 @@ def get_total_time(episode):
         return 0
 
 
+class DurationResolver(object):
+    """Look up the duration of YouTube episodes in the background
+
+    Lookups run on at most max_workers threads, so feed updates don't
+    wait for them. Results are cached in the database by video ID.
+    Videos without a duration (live streams, failed lookups) are not
+    looked up again for RETRY_UNKNOWN seconds.
+
+    Found durations are committed, and resolved_callback (if set) is
+    called with the updated episodes, on the worker thread, in batches
+    of at most BATCH_SIZE episodes.
+    """
+    RETRY_UNKNOWN = 6 * 60 * 60
+    BATCH_SIZE = 20
+
+    def __init__(self, db, max_workers=2):
+        self.db = db
+        self.max_workers = max_workers
+        self.resolved_callback = None
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        self._queued = set()
+        self._workers = []
+
+    def resolve(self, episodes):
+        """Fill in total_time of saved YouTube episodes that don't have one"""
+        for episode in episodes:
+            if episode.total_time:
+                continue
+
+            vid = get_youtube_id(episode.url)
+            if vid is None:
+                continue
+
+            cached = self.db.get_youtube_duration(vid)
+            if cached is not None:
+                total_time, checked = cached
+                if total_time:
+                    self._set_total_time(episode, total_time)
+                    continue
+                elif checked + self.RETRY_UNKNOWN > time.time():
+                    continue
+
+            with self._lock:
+                if vid in self._queued:
+                    continue
+                self._queued.add(vid)
+                self._queue.append((vid, episode))
+                self._workers = [t for t in self._workers if t.is_alive()]
+                if len(self._workers) < self.max_workers:
+                    worker = threading.Thread(target=self._worker, name='DurationResolver', daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+
+    def _worker(self):
+        resolved = []
+        try:
+            while True:
+                with self._lock:
+                    if not self._queue:
+                        return
+                    vid, episode = self._queue.popleft()
+
+                try:
+                    total_time = get_total_time(episode)
+                    logger.debug('Duration of YouTube video %s: %d', vid, total_time)
+                    self.db.set_youtube_duration(vid, total_time)
+                    if total_time:
+                        self._set_total_time(episode, total_time)
+                        resolved.append(episode)
+                finally:
+                    with self._lock:
+                        self._queued.discard(vid)
+
+                if len(resolved) >= self.BATCH_SIZE:
+                    self._resolved(resolved)
+                    resolved = []
+        finally:
+            self._resolved(resolved)
+
+    def _resolved(self, episodes):
+        self.db.commit()
+        if episodes and self.resolved_callback is not None:
+            self.resolved_callback(episodes)
+
+    def _set_total_time(self, episode, total_time):
+        episode.total_time = total_time
+        self.db.save_episode(episode)
+
+    def wait(self):
+        """Wait until all queued lookups are done"""
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            worker.join()
+
+    def shutdown(self):
+        """Drop queued lookups and wait for the running ones"""
+        with self._lock:
+            for vid, episode in self._queue:
+                self._queued.discard(vid)
+            self._queue.clear()
+        self.wait()
+
+
 def get_real_download_url(url, allow_partial, preferred_fmt_ids=None):
     if not preferred_fmt_ids:
         preferred_fmt_ids, _, _ = formats_dict[22]  # MP4 720p
@@ -0,0 +1,712 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2023 The gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import time
+from sqlite3 import dbapi2 as sqlite
+
+import pytest
+
+import gpodder
+from gpodder import feedcore, model, query, schema
+from gpodder.dbsqlite import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'Database'))
+    yield db
+    db.close()
+
+
+def trace_statements(db):
+    statements = []
+
+    def trace(sql):
+        # The statement is reported again for each statement of its triggers
+        if not statements or statements[-1] != sql:
+            statements.append(sql)
+
+    db.db.set_trace_callback(trace)
+    return statements
+
+
+@pytest.fixture
+def statements(db):
+    return trace_statements(db)
+
+
+def make_podcast():
+    podcast = model.PodcastChannel(None)
+    podcast.id = 1
+    return podcast
+
+
+def make_episode():
+    episode = model.PodcastEpisode(make_podcast())
+    episode.url = 'http://example.com/episode.mp3'
+    episode.guid = 'episode'
+    return episode
+
+
+def test_save_only_changed_columns(db, statements):
+    episode = make_episode()
+    db.save_episode(episode)
+    assert statements[-1].startswith('INSERT INTO episode')
+
+    del statements[:]
+    db.save_episode(episode)
+    assert statements == []
+
+    # Setting the same value again is not a change
+    episode.title = episode.title
+    episode.total_time = 123
+    episode.is_new = not episode.is_new
+    db.save_episode(episode)
+    assert statements == ['UPDATE episode SET is_new = %d, total_time = 123 WHERE id = %d' % (episode.is_new, episode.id)]
+
+    del statements[:]
+    db.save_episode(episode)
+    assert statements == []
+
+
+def test_failed_save_is_retried(db):
+    episode = make_episode()
+    db.save_episode(episode)
+
+    db.db.execute("CREATE TEMP TRIGGER fail BEFORE UPDATE ON episode BEGIN SELECT RAISE(ABORT, 'failed'); END")
+    episode.title = 'Title'
+    db.save_episode(episode)
+    assert db.get('SELECT title FROM episode') == ''
+
+    # The column is still marked as changed
+    db.db.execute('DROP TRIGGER fail')
+    db.save_episode(episode)
+    assert db.get('SELECT title FROM episode') == 'Title'
+
+
+def test_failed_bulk_save_is_retried(tmp_path):
+    db = Database(str(tmp_path / 'Database'), write_behind=True)
+    episodes = [make_episode() for i in range(3)]
+    for i, episode in enumerate(episodes):
+        episode.guid = str(i)
+    db.save_episodes(episodes)
+
+    db.db.execute("CREATE TEMP TRIGGER fail BEFORE UPDATE ON episode BEGIN SELECT RAISE(ABORT, 'failed'); END")
+    for episode in episodes:
+        episode.title = 'Title'
+    db.save_episodes(episodes)
+    db.flush()
+    assert db.get("SELECT COUNT(*) FROM episode WHERE title = 'Title'") == 0
+
+    db.db.execute('DROP TRIGGER fail')
+    db.save_episodes(episodes)
+    db.flush()
+    assert db.get("SELECT COUNT(*) FROM episode WHERE title = 'Title'") == 3
+    db.close()
+
+
+def test_failed_bulk_insert(db):
+    # The third episode has the same GUID as the first one
+    episodes = [make_episode() for i in range(3)]
+    episodes[1].guid = 'other'
+    db.save_episodes(episodes)
+    assert [e.id for e in episodes] == [None, None, None]
+    assert db.get('SELECT COUNT(*) FROM episode') == 0
+
+    episodes[2].guid = 'third'
+    db.save_episodes(episodes)
+    assert [e.id for e in episodes] == [1, 2, 3]
+    assert db.get('SELECT COUNT(*) FROM episode') == 3
+
+
+def test_loaded_objects_are_unchanged(db, statements):
+    episode = make_episode()
+    episode.title = 'Title'
+    db.save_episode(episode)
+    db.commit()
+
+    podcast = make_podcast()
+    loaded = db.load_episodes(podcast, lambda d: model.PodcastEpisode.create_from_dict(d, podcast))
+    assert [e.title for e in loaded] == ['Title']
+
+    del statements[:]
+    db.save_episode(loaded[0])
+    assert statements == []
+
+
+def test_save_episodes(db, statements):
+    existing = make_episode()
+    db.save_episode(existing)
+    first_id = existing.id
+
+    episodes = [make_episode() for i in range(3)]
+    for i, episode in enumerate(episodes):
+        episode.guid = 'new-%d' % i
+    existing.title = 'Changed'
+
+    del statements[:]
+    db.save_episodes([existing] + episodes)
+    assert [e.id for e in episodes] == [first_id + 1, first_id + 2, first_id + 3]
+    assert len([sql for sql in statements if sql.startswith('INSERT')]) == 3
+    assert [sql for sql in statements if sql.startswith('UPDATE')] == [
+        "UPDATE episode SET title = 'Changed' WHERE id = %d" % first_id]
+
+    del statements[:]
+    db.save_episodes([existing] + episodes)
+    assert statements == []
+
+    assert db.get('SELECT COUNT(*) FROM episode') == 4
+
+
+class FakeExtensions:
+    def __init__(self):
+        self.removed = []
+
+    def on_episode_removed_from_podcast(self, episode):
+        self.removed.append(episode.guid)
+
+    def on_podcast_update_failed(self, podcast, exception):
+        pass
+
+    def on_episode_save(self, episode):
+        pass
+
+
+class FakeModel:
+    def __init__(self, db):
+        self.db = db
+
+
+def test_remove_unreachable_episodes(db, statements, monkeypatch):
+    extensions = FakeExtensions()
+    monkeypatch.setattr(gpodder, 'user_extensions', extensions)
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.id = 1
+
+    for i in range(10):
+        episode = model.PodcastEpisode(podcast)
+        episode.url = 'http://example.com/%d.mp3' % i
+        episode.guid = str(i)
+        episode.published = i
+        podcast.children.append(episode)
+    podcast.children[0].state = gpodder.STATE_DOWNLOADED
+    db.save_episodes(podcast.children)
+
+    del statements[:]
+    # 7 and 8 are gone from the feed, keep 5 episodes: 0 is downloaded,
+    # the other ones older than the 5 newest ones are purged
+    seen = {str(i) for i in range(10)} - {'7', '8'}
+    podcast.remove_unreachable_episodes(podcast.children, seen, 5)
+
+    assert extensions.removed == ['7', '8']
+    assert len([sql for sql in statements if sql.startswith('DELETE')]) == 2
+    assert [e.guid for e in podcast.children] == ['9', '6', '5', '4', '3', '0']
+    assert [row[0] for row in db.db.execute('SELECT guid FROM episode ORDER BY published DESC')] == \
+        [e.guid for e in podcast.children]
+
+
+def test_wal_readers(tmp_path):
+    db = Database(str(tmp_path / 'Database'), wal=True)
+    assert db.db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    episode = make_episode()
+    db.save_episode(episode)
+
+    # This thread sees its uncommitted changes
+    assert db.get_podcast_statistics(1)[0] == 1
+
+    # Other threads read the committed state, without waiting for the writer
+    results = []
+
+    def read():
+        results.append(db.get_podcast_statistics(1)[0])
+        results.append(list(db.get_content_types(1)))
+
+    with db.lock:
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join(5)
+        assert results == [0, []]
+
+    db.commit()
+    assert db.get_podcast_statistics(1)[0] == 1
+    podcast = make_podcast()
+    assert [e.guid for e in db.load_episodes(podcast, lambda d: model.PodcastEpisode.create_from_dict(d, podcast))] == \
+        ['episode']
+    db.close()
+
+    # Switching back to the rollback journal
+    db = Database(str(tmp_path / 'Database'))
+    assert db.db.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    assert db.get_podcast_statistics(1)[0] == 1
+    db.close()
+
+
+def test_lazy_episode_texts(db, statements, monkeypatch):
+    monkeypatch.setattr(db._episode_texts, 'size', 2)
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.id = 1
+    for i in range(3):
+        episode = model.PodcastEpisode(podcast)
+        episode.guid = str(i)
+        episode.published = i
+        episode.description_html = '<p>Episode <b>%d</b></p>' % i
+        episode.chapters = '[]'
+        db.save_episode(episode)
+    db.commit()
+
+    del statements[:]
+    episodes = db.load_episodes(podcast, podcast.episode_factory)
+    assert 'description' not in statements[-1]
+
+    # Loaded (and derived) when used
+    assert episodes[0]._text_description == 'Episode 2'
+    assert episodes[0].chapters == '[]'
+    assert len(statements) == 2
+    assert episodes[0].html_description() == '<p>Episode <b>2</b></p>'
+    assert len(statements) == 2
+    assert [e._text_description for e in episodes] == ['Episode 2', 'Episode 1', 'Episode 0']
+    assert len(db._episode_texts) == 2
+
+    # Unchanged descriptions are not kept in the episode, changed ones are saved
+    new = model.PodcastEpisode(podcast)
+    new.guid = '2'
+    new.published = 2
+    new.description_html = '<p>Episode <b>2</b></p>'
+    new.chapters = '[]'
+    episodes[0].update_from(new)
+    episodes[0].cache_text_description()
+    assert episodes[0].get_changed_columns(schema.EpisodeColumns) == []
+    new.description_html = '<p>Changed</p>'
+    episodes[0].update_from(new)
+    episodes[0].cache_text_description()
+    assert episodes[0]._text_description == 'Changed'
+    db.save_episode(episodes[0])
+    assert statements[-1].startswith('UPDATE episode SET description_html = ')
+    assert db.get_episode_texts(episodes[0].id)['description_html'] == '<p>Changed</p>'
+
+
+def test_get_text_descriptions(db, statements):
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.id = 1
+    for i in range(Database.MAX_IDS_PER_STATEMENT + 10):
+        episode = model.PodcastEpisode(podcast)
+        episode.guid = str(i)
+        episode.published = i
+        episode.description_html = '<p>Episode <b>%d</b></p>' % i
+        db.save_episode(episode)
+    db.commit()
+    episodes = db.load_episodes(podcast, podcast.episode_factory)
+
+    # One query per MAX_IDS_PER_STATEMENT episodes, none when they are used
+    del statements[:]
+    descriptions = model.PodcastEpisode.get_text_descriptions(episodes)
+    assert len(statements) == 2
+    assert episodes[0].one_line_description(descriptions) == 'Episode %d' % (Database.MAX_IDS_PER_STATEMENT + 9)
+    assert all(e.get_text_description(descriptions) == 'Episode %s' % e.guid for e in episodes)
+    assert len(statements) == 2
+    # The episodes don't keep them
+    assert all(e._text is None for e in episodes)
+
+    del statements[:]
+    matches = query.UserEQL('episode 1').filter(episodes)
+    assert {e.guid for e in matches} == {e.guid for e in episodes if e.guid.startswith('1')}
+    assert len(statements) == 2
+
+    # Updating from a feed compares the descriptions without a query per episode
+    new = model.PodcastEpisode(podcast)
+    new.guid = '0'
+    new.description_html = '<p>Episode <b>0</b></p>'
+    texts = db.load_episode_texts(e.id for e in episodes)
+    del statements[:]
+    episodes[-1].update_from(new, texts[episodes[-1].id])
+    assert statements == []
+    assert episodes[-1].get_changed_columns(schema.EpisodeColumns) == []
+
+
+class BrokenFeed(model.Feed):
+    def get_http_etag(self):
+        return '"new"'
+
+    def get_content_digest(self):
+        return 'new'
+
+    def get_new_episodes(self, channel, existing_guids):
+        raise ValueError('cannot merge')
+
+
+def test_update_failed_keeps_validators(db, monkeypatch):
+    monkeypatch.setattr(gpodder, 'user_extensions', FakeExtensions())
+    monkeypatch.setattr(model.PodcastChannel, 'save', lambda self: self.db.save_podcast(self))
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.url = 'http://example.com/feed.xml'
+    podcast.download_folder = 'feed'
+    podcast.http_etag = '"old"'
+    podcast.http_content_digest = 'old'
+    podcast.save()
+
+    # The episodes of the feed were not merged, so it is fetched again next time
+    with pytest.raises(ValueError):
+        podcast.update_from_result(feedcore.Result(feedcore.UPDATED_FEED, BrokenFeed()))
+    row = db.db.execute('SELECT http_etag, http_content_digest, update_failures FROM podcast').fetchone()
+    assert row == ('"old"', 'old', 1)
+
+
+class PagedFeed(model.Feed):
+    def __init__(self, guids, requests):
+        self.guids = guids
+        self.requests = requests
+
+    def get_guids(self):
+        return set(self.guids)
+
+    def get_new_episodes(self, channel, existing_guids):
+        new_episodes = []
+        for guid in self.guids:
+            if guid not in existing_guids:
+                episode = model.PodcastEpisode(channel)
+                episode.guid = guid
+                new_episodes.append(episode)
+        channel.save_episodes(new_episodes)
+        return new_episodes, set(self.guids)
+
+    def has_next_page(self):
+        return True
+
+    def get_next_page(self, channel, max_episodes):
+        self.requests.append(max_episodes)
+        return None
+
+
+def test_prefetch_only_needed_pages(db, monkeypatch):
+    monkeypatch.setattr(gpodder, 'user_extensions', FakeExtensions())
+    monkeypatch.setattr(model.PodcastChannel, 'save', lambda self: self.db.save_podcast(self))
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.url = 'http://example.com/feed.xml'
+    podcast.download_folder = 'feed'
+    podcast.save()
+
+    requests = []
+    podcast._consume_updated_feed(PagedFeed(['1', '2'], requests), 5)
+    assert requests == [5]
+
+    # Nothing new on the first page: the second page is not needed
+    del requests[:]
+    podcast._consume_updated_feed(PagedFeed(['1', '2'], requests), 2)
+    assert requests == []
+
+
+def count_statistics(db, podcast_id):
+    cur = db.db.execute('SELECT %s FROM episode WHERE podcast_id = ?' % ', '.join(
+        'IFNULL(SUM(%s), 0)' % condition for name, condition in schema.StatisticsCounters), (podcast_id,))
+    return cur.fetchone()
+
+
+def test_podcast_statistics(db, statements):
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.url = 'http://example.com/feed.xml'
+    podcast.download_folder = 'feed'
+    db.save_podcast(podcast)
+
+    episodes = []
+    for i in range(6):
+        episode = model.PodcastEpisode(podcast)
+        episode.guid = str(i)
+        episode.state = (gpodder.STATE_NORMAL, gpodder.STATE_DOWNLOADED, gpodder.STATE_DELETED)[i % 3]
+        episodes.append(episode)
+    db.save_episodes(episodes)
+    assert db.get_podcast_statistics(podcast.id) == count_statistics(db, podcast.id) == (6, 2, 2, 2, 2)
+
+    # Read once for all podcasts, until something changes
+    del statements[:]
+    assert db.get_podcast_statistics() == (6, 2, 2, 2, 2)
+    assert db.get_podcast_statistics(podcast.id + 1) == (0, 0, 0, 0, 0)
+    assert statements == []
+
+    episodes[0].is_new = False
+    episodes[1].state = gpodder.STATE_DELETED
+    db.save_episodes(episodes)
+    db.delete_episodes([episodes[4].id])
+    assert db.get_podcast_statistics(podcast.id) == count_statistics(db, podcast.id) == (5, 3, 1, 0, 0)
+
+    db.delete_podcast(podcast)
+    assert db.get_podcast_statistics() == (0, 0, 0, 0, 0)
+    assert db.get('SELECT COUNT(*) FROM podcast_statistics') == 0
+
+
+def test_upgrade_from_version_13(tmp_path):
+    filename = str(tmp_path / 'Database')
+    db = Database(filename)
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.url = 'http://example.com/feed.xml'
+    podcast.download_folder = 'feed'
+    db.save_podcast(podcast)
+    episode = make_episode()
+    episode.podcast_id = podcast.id
+    db.save_episode(episode)
+    db.commit()
+    db.close()
+
+    # Back to version 13: without statistics, with thumbnails in the podcast table
+    # and without the composite episode indexes
+    conn = sqlite.connect(filename)
+    conn.execute('DROP INDEX idx_episode_podcast_published')
+    conn.execute('DROP INDEX idx_episode_podcast_state')
+    conn.execute('CREATE INDEX idx_episode_podcast_id ON episode (podcast_id)')
+    for name in ('episode_statistics_insert', 'episode_statistics_delete', 'episode_statistics_update',
+                 'podcast_statistics_delete', 'podcast_cover_thumb_delete'):
+        conn.execute('DROP TRIGGER %s' % name)
+    conn.execute('DROP TABLE podcast_statistics')
+    conn.execute('DROP TABLE podcast_cover_thumb')
+    conn.execute("UPDATE podcast SET cover_thumb = x'89504e47'")
+    conn.execute('UPDATE version SET version = 13')
+    conn.commit()
+    conn.close()
+
+    db = Database(filename)
+    assert db.get_podcast_statistics(podcast.id) == (1, 0, 1, 0, 0)
+    assert db.get_cover_thumb(podcast.id) == b'\x89PNG'
+    assert db.get('SELECT COUNT(*) FROM podcast WHERE cover_thumb IS NOT NULL') == 0
+    indexes = {name for (name,) in db.db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_episode_podcast_published', 'idx_episode_podcast_state'} <= indexes
+    assert 'idx_episode_podcast_id' not in indexes
+    db.close()
+
+
+def test_convert_gpodder2_db(tmp_path):
+    old_filename = str(tmp_path / 'database.sqlite')
+    conn = sqlite.connect(old_filename)
+    conn.execute('CREATE TABLE channels (id, url, title, override_title, link, description, image, username, password, '
+                 'last_modified, etag, channel_is_locked, foldername, feed_update_enabled, sync_to_devices)')
+    conn.execute("INSERT INTO channels VALUES (1, 'http://example.com/feed.xml', 'Feed', '', '', '', '', '', '', "
+                 "NULL, NULL, 0, 'feed', 1, 1)")
+    conn.execute('CREATE TABLE episodes (id, channel_id, title, description, url, pubDate, guid, link, length, '
+                 'mimetype, state, played, locked, filename, total_time, current_position, current_position_updated)')
+    conn.execute("INSERT INTO episodes VALUES (1, 1, 'Episode', '', 'http://example.com/episode.mp3', 0, 'episode', "
+                 "'', 0, 'audio/mpeg', 0, 0, 0, NULL, 0, 0, 0)")
+    conn.commit()
+    conn.close()
+
+    filename = str(tmp_path / 'Database')
+    schema.convert_gpodder2_db(old_filename, filename)
+    db = Database(filename)
+    podcast, = db.load_podcasts(lambda row, id: row)
+    assert podcast['url'] == 'http://example.com/feed.xml'
+    assert podcast['update_failures'] == podcast['next_update_attempt'] == podcast['http_expires'] == 0
+    assert db.get_podcast_statistics(1) == (1, 0, 1, 0, 0)
+    db.close()
+
+
+def test_cover_thumb(db, statements):
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.url = 'http://example.com/feed.xml'
+    podcast.download_folder = 'feed'
+    assert podcast.cover_thumb is None
+    db.save_podcast(podcast)
+
+    podcast.cover_thumb = b'thumbnail'
+    del statements[:]
+    # Not part of the podcast row, and not written again when unchanged
+    podcast.title = 'Title'
+    db.save_podcast(podcast)
+    podcast.cover_thumb = b'thumbnail'
+    assert statements == ["UPDATE podcast SET title = 'Title' WHERE id = %d" % podcast.id]
+
+    db.commit()
+    other = Database(db.database_file)
+    assert other.get_cover_thumb(podcast.id) == b'thumbnail'
+    other.close()
+    assert db.load_podcasts(lambda d, db: d)[0].keys() == {'id'} | set(schema.PodcastColumns)
+
+    podcast.cover_thumb = None
+    assert db.get_cover_thumb(podcast.id) is None
+    podcast.cover_thumb = b'thumbnail'
+    db.delete_podcast(podcast)
+    assert db.get('SELECT COUNT(*) FROM podcast_cover_thumb') == 0
+
+
+def test_load_all_episodes(db, statements, monkeypatch):
+    podcasts = []
+    for podcast_id in (1, 2, 3):
+        podcast = model.PodcastChannel(FakeModel(db))
+        podcast.id = podcast_id
+        podcasts.append(podcast)
+        for i in range(podcast_id):
+            episode = model.PodcastEpisode(podcast)
+            episode.guid = '%d-%d' % (podcast_id, i)
+            episode.published = i
+            db.save_episode(episode)
+    db.commit()
+
+    def load(podcasts):
+        return db.load_all_episodes({podcast.id: podcast.episode_factory for podcast in podcasts})
+
+    del statements[:]
+    episodes = load(podcasts)
+    assert len([sql for sql in statements if sql.startswith('SELECT')]) == 1
+    assert {podcast_id: [e.guid for e in group] for podcast_id, group in episodes.items()} == {
+        1: ['1-0'], 2: ['2-1', '2-0'], 3: ['3-2', '3-1', '3-0']}
+    assert all(e.parent is podcasts[1] for e in episodes[2])
+
+    # A chunk of podcasts, or all of them with one scan of the table
+    assert [e.guid for e in load(podcasts[1:2])[2]] == ['2-1', '2-0']
+    monkeypatch.setattr(db, 'MAX_IDS_PER_STATEMENT', 1)
+    del statements[:]
+    assert sorted(load(podcasts[:2])) == [1, 2]
+    assert 'WHERE' not in statements[-1]
+    assert load([]) == {}
+
+
+def test_write_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(Database, 'WRITE_BEHIND_DELAY', 60)
+    db = Database(str(tmp_path / 'Database'), write_behind=True)
+    statements = trace_statements(db)
+
+    # New episodes are inserted right away, they need an ID
+    episode = make_episode()
+    db.save_episode(episode)
+    assert episode.id is not None
+
+    # Changes of existing rows are written together, later
+    del statements[:]
+    for position in range(10):
+        episode.current_position = position
+        db.save_episode(episode)
+    episode.is_new = False
+    db.save_episode(episode)
+    db.commit()
+    assert statements == []
+
+    # Queries on the writer connection see them
+    assert db.get('SELECT current_position FROM episode WHERE id = ?', (episode.id,)) == 9
+    assert [sql for sql in statements if sql.startswith('UPDATE')] == [
+        'UPDATE episode SET is_new = 0, current_position = 9 WHERE id = %d' % episode.id]
+    assert 'COMMIT' not in statements
+
+    # Committed by the writer thread after the delay, or by flush()
+    episode.current_position = 10
+    db.save_episode(episode)
+    db.flush()
+    assert statements[-3:] == ['UPDATE episode SET current_position = 10 WHERE id = %d' % episode.id,
+                               'RELEASE save_objects', 'COMMIT']
+
+    db.close()
+
+    monkeypatch.setattr(Database, 'WRITE_BEHIND_DELAY', 0.01)
+    db = Database(str(tmp_path / 'Database'), write_behind=True)
+    statements = trace_statements(db)
+    episode.current_position = 11
+    db.save_episode(episode)
+    db.commit()
+    expected = ['UPDATE episode SET current_position = 11 WHERE id = %d' % episode.id, 'RELEASE save_objects', 'COMMIT']
+    for i in range(100):
+        if statements[-3:] == expected:
+            break
+        time.sleep(0.05)
+    assert statements[-3:] == expected
+    db.close()
+
+
+def test_vacuum(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'Database')
+    db = Database(filename, vacuum_threshold=0.95)
+    assert db.get_page_statistics()['auto_vacuum'] == Database.AUTO_VACUUM_INCREMENTAL
+    podcast = make_podcast()
+    episodes = []
+    for i in range(200):
+        episode = model.PodcastEpisode(podcast)
+        episode.guid = str(i)
+        episode.description = 'x' * 2000
+        episodes.append(episode)
+    db.save_episodes(episodes)
+    db.commit()
+    db.delete_episodes([e.id for e in episodes])
+    db.commit()
+    assert db._vacuum_needed(db.get_page_statistics()) is False
+
+    # Below the threshold, free pages are given back incrementally
+    statements = trace_statements(db)
+    monkeypatch.setattr(db, 'INCREMENTAL_VACUUM_PAGES', 10)
+    free = db.get_page_statistics()['freelist_count']
+    db.incremental_vacuum()
+    assert db.get_page_statistics()['freelist_count'] == free - 10
+    db.close()
+    assert 'VACUUM' not in statements
+
+    # Above the threshold, and for databases without incremental vacuum
+    db = Database(filename, vacuum_threshold=0.01)
+    statements = trace_statements(db)
+    db.close()
+    assert 'VACUUM' in statements
+
+    conn = sqlite.connect(filename)
+    conn.execute('PRAGMA auto_vacuum = NONE')
+    conn.execute('VACUUM')
+    conn.close()
+    db = Database(filename)
+    before, after = db.maintenance()
+    assert before['auto_vacuum'] == 0
+    assert after['auto_vacuum'] == Database.AUTO_VACUUM_INCREMENTAL
+    assert db.get('SELECT COUNT(*) FROM sqlite_master WHERE name = ?', ('sqlite_stat1',)) == 1
+    db.close()
+
+
+def query_plan(db, sql, params=()):
+    return ' / '.join(row[-1] for row in db.db.execute('EXPLAIN QUERY PLAN ' + sql, params))
+
+
+def test_episode_indexes(db, statements):
+    podcast = model.PodcastChannel(FakeModel(db))
+    podcast.url = 'http://example.com/feed.xml'
+    podcast.download_folder = 'feed'
+    db.save_podcast(podcast)
+
+    episodes = []
+    for i in range(20):
+        episode = model.PodcastEpisode(podcast)
+        episode.guid = str(i)
+        episode.published = (i * 7) % 20
+        if i % 4 == 0:
+            episode.state = gpodder.STATE_DOWNLOADED
+        episodes.append(episode)
+    db.save_episodes(episodes)
+    assert db.get_last_published(podcast) == 19
+
+    # Same episodes as the NOT IN (... LIMIT ?) query it replaces
+    newest = {e.id for e in sorted(episodes, key=lambda e: e.published, reverse=True)[:8]}
+    expected = {e.id for e in episodes if e.id not in newest and e.state != gpodder.STATE_DOWNLOADED}
+    del statements[:]
+    assert set(db.purge(8, podcast.id)) == expected
+    assert len(expected) == 9
+    assert db.get('SELECT COUNT(*) FROM episode') == 11
+
+    # Neither the purge nor the last publish date need sorting
+    purge, = [sql for sql in statements if 'OFFSET' in sql]
+    plan = query_plan(db, purge)
+    assert 'idx_episode_podcast_published' in plan
+    assert 'TEMP B-TREE' not in plan
+    plan = query_plan(db, 'SELECT published FROM episode WHERE podcast_id = 1 ORDER BY published DESC LIMIT 1')
+    assert 'COVERING INDEX idx_episode_podcast_published' in plan
+
+    # The statistics are counted from an index, without reading the episodes
+    plan = query_plan(db, schema.statistics_count_sql())
+    assert 'COVERING INDEX idx_episode_podcast_state' in plan
+    assert 'TEMP B-TREE' not in plan
+    db.db.execute('UPDATE podcast_statistics SET total = 0')
+    db.recount_statistics()
+    assert db.get_podcast_statistics(podcast.id) == count_statistics(db, podcast.id)
@@ -21,7 +21,9 @@ import io
 import pytest
 import requests.exceptions
 
-from gpodder.feedcore import Fetcher, NEW_LOCATION, Result, UPDATED_FEED
+from gpodder.feedcore import (Fetcher, InternalServerError, NEW_LOCATION, Result, UPDATED_FEED, get_expires,
+                              get_retry_after)
+from gpodder.model import DigestReader, FeedPager, gPodderFeedHandler, gPodderFetcher, parse_feed_in_process
 
 
 class MyFetcher(Fetcher):
@@ -87,6 +89,34 @@ def test_redirect(httpserver):
     res = MyFetcher().fetch(httpserver.url_for('/permanentfeed'))
     assert res.status == NEW_LOCATION
     assert res.feed == httpserver.url_for('/endfeed')
+    # the content of the new location is parsed already
+    assert res.location_result.status == UPDATED_FEED
+    assert res.location_result.feed['parse_feed']['url'] == httpserver.url_for('/endfeed')
+
+
+def test_autodiscovery(httpserver, monkeypatch):
+    monkeypatch.setattr(Fetcher, '_location_cache', {})
+    page = '<html><head><link rel="alternate" type="application/rss+xml" href="/feed"></head></html>'
+    httpserver.expect_oneshot_request('/page').respond_with_data(page, content_type='text/html')
+    httpserver.expect_request('/feed').respond_with_data(SIMPLE_RSS, content_type='text/xml')
+
+    res = MyFetcher().fetch(httpserver.url_for('/page'))
+    assert res.status == NEW_LOCATION
+    assert res.feed == httpserver.url_for('/feed')
+    assert res.location_result.status == UPDATED_FEED
+    assert res.location_result.feed['parse_feed']['url'] == httpserver.url_for('/feed')
+
+    # the feed URL is remembered, the page is not requested again
+    res = MyFetcher().fetch(httpserver.url_for('/page'))
+    assert res.status == NEW_LOCATION
+    assert res.feed == httpserver.url_for('/feed')
+    assert res.location_result is None
+    assert len([r for r, _ in httpserver.log if r.path == '/page']) == 1
+
+    # until it expires
+    monkeypatch.setattr(Fetcher, 'LOCATION_CACHE_TTL', -1)
+    Fetcher._cache_location(httpserver.url_for('/page'), httpserver.url_for('/feed'))
+    assert Fetcher._get_cached_location(httpserver.url_for('/page')) is None
 
 
 def test_redirect_loop(httpserver):
@@ -114,3 +144,154 @@ def test_temporary_error_retry(httpserver):
     args = res.feed['parse_feed']
     assert args['headers']['content-type'] == 'text/xml'
     assert args['url'] == httpserver.url_for('/feed')
+
+
+def test_cache_headers():
+    now = 1000000000
+    assert get_expires({}, now) is None
+    assert get_expires({'cache-control': 'public, max-age=3600'}, now) == now + 3600
+    assert get_expires({'cache-control': 'max-age=3600', 'age': '600'}, now) == now + 3000
+    assert get_expires({'cache-control': 'no-cache, max-age=3600'}, now) is None
+    assert get_expires({'cache-control': 'max-age=31536000'}, now) == now + 24 * 60 * 60
+    # Expires is relative to the server's Date
+    assert get_expires({'expires': 'Sun, 09 Sep 2001 02:46:40 GMT',
+                        'date': 'Sun, 09 Sep 2001 01:46:40 GMT'}, now) == now + 3600
+    assert get_expires({'expires': '0'}, now) is None
+
+    assert get_retry_after({'retry-after': '120'}, now) == 120
+    assert get_retry_after({'retry-after': 'Sun, 09 Sep 2001 02:46:40 GMT'}, now) == 3600
+    assert get_retry_after({'retry-after': 'soon'}, now) is None
+
+
+def test_retry_after(httpserver):
+    httpserver.expect_request('/fresh').respond_with_data(SIMPLE_RSS, content_type='text/xml',
+                                                          headers={'Cache-Control': 'max-age=600'})
+    res = MyFetcher().fetch(httpserver.url_for('/fresh'))
+    assert res.status == UPDATED_FEED
+    assert res.expires is not None
+
+    # Long delays are not waited for, but passed to the caller
+    httpserver.expect_request('/busy').respond_with_data(status=503, headers={'Retry-After': '3600'})
+    with pytest.raises(InternalServerError) as excinfo:
+        MyFetcher().fetch(httpserver.url_for('/busy'))
+    assert excinfo.value.retry_after == 3600
+
+
+class MyStreamingFetcher(MyFetcher):
+    STREAMING = True
+
+    def parse_feed(self, url, feed_data, data_stream, headers, status, **kwargs):
+        # the stream is closed once fetch() returns, read it now
+        return Result(status, data_stream.read())
+
+
+def test_streaming(httpserver):
+    httpserver.expect_request('/feed').respond_with_data(SIMPLE_RSS, content_type='text/xml')
+    res = MyStreamingFetcher().fetch(httpserver.url_for('/feed'))
+    assert res.status == UPDATED_FEED
+    assert res.feed.decode('utf-8') == SIMPLE_RSS
+
+
+def make_rss(guids, next_url=None):
+    items = ''.join("""
+        <item>
+        <title>Episode {0}</title>
+        <guid isPermaLink="false">{0}</guid>
+        <pubDate>Sun, {0:02d} Nov 2018 17:28:03 +0000</pubDate>
+        <enclosure url="/ep{0}.ogg" type="audio/ogg" length="100000"/>
+        </item>""".format(guid) for guid in guids)
+    if next_url is not None:
+        items = '<atom:link rel="next" href="{}"/>'.format(next_url) + items
+    return ('<rss xmlns:atom="http://www.w3.org/2005/Atom"><channel><title>Feed Name</title>{}</channel></rss>'
+            .format(items).encode('utf-8'))
+
+
+def test_drop_episodes_newest_first():
+    feed = make_rss(range(20, 0, -1))
+
+    parsed = gPodderFeedHandler.parse('http://example.com/', io.BytesIO(feed), max_episodes=5)
+    assert [e['guid'] for e in parsed['episodes']] == ['20', '19', '18', '17', '16']
+
+
+def test_keep_episodes_unsorted():
+    feed = make_rss(list(range(1, 21)))
+
+    parsed = gPodderFeedHandler.parse('http://example.com/', io.BytesIO(feed), max_episodes=5)
+    assert len(parsed['episodes']) == 20
+
+
+def test_channel_elements_after_episodes():
+    feed = make_rss(range(20, 0, -1)).replace(b'</channel>', b"""
+        <description>Feed Description</description>
+        <itunes:image xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" href="http://example.com/cover.jpg"/>
+        <atom:link rel="next" href="http://example.com/page2"/>
+        </channel>""")
+
+    parsed = gPodderFeedHandler.parse('http://example.com/', io.BytesIO(feed), max_episodes=5)
+    assert len(parsed['episodes']) == 5
+    assert parsed['description'] == 'Feed Description'
+    assert parsed['cover_url'] == 'http://example.com/cover.jpg'
+    assert parsed['paged_feed_next'] == 'http://example.com/page2'
+
+
+def test_digest_covers_whole_feed():
+    feed = make_rss(range(20, 0, -1))
+    changed = feed.replace(b'Episode 1<', b'Episode one<')
+
+    def digest(data):
+        reader = DigestReader(io.BytesIO(data))
+        gPodderFeedHandler.parse('http://example.com/', reader, max_episodes=5)
+        return reader.hexdigest()
+
+    assert digest(feed) == digest(feed)
+    # the change is in an episode that is dropped
+    assert digest(feed) != digest(changed)
+
+
+class FakeChannel:
+    url = 'http://example.com/feed'
+
+    def authenticate_url(self, url):
+        return url
+
+
+def test_feed_pager(httpserver):
+    httpserver.expect_request('/page1').respond_with_data(make_rss(range(30, 20, -1), '/page2'), content_type='text/xml')
+    httpserver.expect_request('/page2').respond_with_data(make_rss(range(20, 10, -1), '/page3'), content_type='text/xml')
+    httpserver.expect_request('/page3').respond_with_data(make_rss(range(10, 0, -1)), content_type='text/xml')
+
+    first = gPodderFetcher().fetch(httpserver.url_for('/page1'), max_episodes=15)
+    assert first.feed.has_next_page()
+
+    pager = FeedPager(FakeChannel())
+    # fetched with an upper bound, the exact limit is applied afterwards
+    pager.prefetch(first.feed, 15)
+    second = pager.next_page(first.feed, 5)
+    assert second.status == UPDATED_FEED
+    assert second.feed.max_episodes == 5
+    assert [e['guid'] for e in second.feed.feed['episodes']][:5] == ['20', '19', '18', '17', '16']
+
+    assert second.feed.has_next_page()
+    pager.prefetch(second.feed, 5)
+    pager.close()
+    assert pager.future is None
+
+
+def test_parse_in_process(httpserver):
+    feed = make_rss(range(20, 0, -1)).replace(b'<title>Episode 1</title>',
+                                              b'<title>Episode 1</title><description>A &amp; <b>B</b></description>')
+    parsed = parse_feed_in_process('http://example.com/', feed)
+    assert parsed['episodes'][-1]['description_text'] == 'A & B'
+
+    httpserver.expect_request('/feed').respond_with_data(feed, content_type='text/xml')
+    fetcher = gPodderFetcher()
+    streamed = fetcher.fetch(httpserver.url_for('/feed'), max_episodes=5)
+    fetcher.set_parse_processes(1, 100)
+    try:
+        offloaded = fetcher.fetch(httpserver.url_for('/feed'), max_episodes=5)
+    finally:
+        fetcher.shutdown()
+    assert [e['guid'] for e in offloaded.feed.feed['episodes']] == ['20', '19', '18', '17', '16']
+    assert [e['guid'] for e in streamed.feed.feed['episodes']] == ['20', '19', '18', '17', '16']
+    assert all('description_text' in e for e in offloaded.feed.feed['episodes'])
+    assert offloaded.feed.get_content_digest() == streamed.feed.get_content_digest()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2023 The gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import collections
+import threading
+import time
+
+import gpodder
+from gpodder import feedcore, model
+from gpodder.feedupdater import FeedScheduler, FeedUpdater
+
+
+class FakeExtensions:
+    def __init__(self):
+        self.failed = []
+
+    def on_podcast_update_failed(self, podcast, exception):
+        self.failed.append(podcast)
+
+
+class FakeChannel:
+    lock = threading.Lock()
+    running = collections.Counter()
+    max_running = collections.Counter()
+
+    def __init__(self, url, fail=False):
+        self.url = url
+        self.fail = fail
+        self.fetch_thread = None
+        self.apply_thread = None
+
+    def fetch_feed(self, max_episodes=0, force=False):
+        host = FeedUpdater.host_of(self)
+        with self.lock:
+            self.running[host] += 1
+            self.running['*'] += 1
+            self.max_running[host] = max(self.max_running[host], self.running[host])
+            self.max_running['*'] = max(self.max_running['*'], self.running['*'])
+        time.sleep(0.02)
+        with self.lock:
+            self.running[host] -= 1
+            self.running['*'] -= 1
+        self.fetch_thread = threading.current_thread()
+        if self.fail:
+            raise ValueError('fetch failed')
+        return self.url
+
+    def update_from_result(self, result, max_episodes=0):
+        self.apply_thread = threading.current_thread()
+        return [result]
+
+    def update_failed(self, error):
+        gpodder.user_extensions.on_podcast_update_failed(self, error)
+
+
+def setup_function(function):
+    FakeChannel.running.clear()
+    FakeChannel.max_running.clear()
+
+
+def test_concurrency_limits(monkeypatch):
+    monkeypatch.setattr(gpodder, 'user_extensions', FakeExtensions())
+    channels = [FakeChannel('http://a.example.com/%d' % i) for i in range(6)]
+    channels += [FakeChannel('http://b.example.com/%d' % i) for i in range(6)]
+
+    new_episodes = FeedUpdater(max_workers=3, max_per_host=2).update(channels)
+
+    assert sorted(new_episodes) == sorted(c.url for c in channels)
+    assert FakeChannel.max_running['a.example.com'] <= 2
+    assert FakeChannel.max_running['b.example.com'] <= 2
+    assert FakeChannel.max_running['*'] <= 3
+    # results are applied on the calling thread only
+    assert all(c.apply_thread is threading.current_thread() for c in channels)
+    assert all(c.fetch_thread is not threading.current_thread() for c in channels)
+
+
+def test_errors_and_progress(monkeypatch):
+    extensions = FakeExtensions()
+    monkeypatch.setattr(gpodder, 'user_extensions', extensions)
+    good = FakeChannel('http://a.example.com/good')
+    bad = FakeChannel('http://b.example.com/bad', fail=True)
+    progress = []
+
+    def on_progress(channel, episodes, error, position, total):
+        progress.append((channel, episodes, error, position, total))
+
+    new_episodes = FeedUpdater().update([good, bad], progress_callback=on_progress)
+
+    assert new_episodes == [good.url]
+    assert extensions.failed == [bad]
+    assert sorted(p[3] for p in progress) == [1, 2]
+    assert all(p[4] == 2 for p in progress)
+    errors = {p[0]: p[2] for p in progress}
+    assert errors[good] is None
+    assert isinstance(errors[bad], ValueError)
+
+
+def test_cancel(monkeypatch):
+    monkeypatch.setattr(gpodder, 'user_extensions', FakeExtensions())
+    channels = [FakeChannel('http://a.example.com/%d' % i) for i in range(10)]
+    done = []
+
+    FeedUpdater(max_workers=1).update(channels, progress_callback=lambda c, *args: done.append(c),
+                                      is_cancelled=lambda: len(done) >= 2)
+
+    assert len(done) == 2
+
+
+class FakeEpisode:
+    def __init__(self, published):
+        self.published = published
+
+
+class FakePodcast:
+    def __init__(self, published, last_check=0, unchanged_checks=0):
+        self.children = [FakeEpisode(p) for p in published]
+        self.last_check = last_check
+        self.unchanged_checks = unchanged_checks
+        self.pause_subscription = False
+        self.http_expires = 0
+        self.http_retry_after = 0
+        self.next_update_attempt = 0
+        self.last_failed_update = 0
+
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+def test_scheduler_interval():
+    scheduler = FeedScheduler(20 * 60, DAY)
+
+    # Daily podcast: a few checks per day
+    daily = FakePodcast([i * DAY for i in range(10)], last_check=10 * DAY)
+    assert scheduler.interval(daily) == DAY / 4
+
+    # Checks without new episodes back off, but not beyond max_interval
+    daily.unchanged_checks = 4
+    assert scheduler.interval(daily) == DAY / 2
+    daily.unchanged_checks = 100
+    assert scheduler.interval(daily) == DAY
+
+    # Unknown cadence and very frequent podcasts use min_interval
+    assert scheduler.interval(FakePodcast([DAY])) == 20 * 60
+    assert scheduler.interval(FakePodcast([i * 60 for i in range(10)])) == 20 * 60
+
+
+def test_scheduler_due():
+    scheduler = FeedScheduler(20 * 60, 7 * DAY)
+    now = 100 * DAY
+
+    never_checked = FakePodcast([now - DAY], last_check=0)
+    just_checked = FakePodcast([now - 3 * DAY, now - 2 * DAY], last_check=now - HOUR)
+    rare = FakePodcast([now - 250 * DAY, now - 150 * DAY], last_check=now - 6 * DAY, unchanged_checks=10)
+    paused = FakePodcast([], last_check=0)
+    paused.pause_subscription = True
+
+    assert scheduler.due([never_checked, just_checked, rare, paused], now=now) == [never_checked]
+    assert scheduler.due([rare], now=now + DAY) == [rare]
+
+    # The next episode of a weekly podcast is expected before the backoff runs out
+    weekly = FakePodcast([now - 21 * DAY + HOUR, now - 14 * DAY + HOUR, now - 7 * DAY + HOUR], last_check=now - HOUR,
+                         unchanged_checks=20)
+    assert scheduler.next_due(weekly) == now + HOUR
+    assert scheduler.seconds_until_due([just_checked, weekly], now=now) == HOUR
+
+
+def test_scheduler_cache_headers():
+    now = 100 * DAY
+    podcast = FakePodcast([], last_check=now - DAY)
+    assert FeedScheduler(20 * 60, DAY).next_due(podcast) == now - DAY + 20 * 60
+
+    podcast.http_expires = now + HOUR
+    assert FeedScheduler(20 * 60, DAY).next_due(podcast) == now + HOUR
+    assert FeedScheduler(20 * 60, DAY, honor_cache_headers=False).next_due(podcast) == now - DAY + 20 * 60
+
+    # Retry-After is always honored, also for podcasts never checked
+    podcast = FakePodcast([], last_check=0)
+    podcast.http_retry_after = now + DAY
+    assert FeedScheduler(20 * 60, DAY, honor_cache_headers=False).due([podcast], now=now) == []
+
+
+def test_scheduler_failed_update(monkeypatch):
+    monkeypatch.setattr(gpodder, 'user_extensions', FakeExtensions())
+    scheduler = FeedScheduler(20 * 60, DAY)
+
+    # Failures without backoff are not retried before min_interval either
+    podcast = make_podcast(1)
+    podcast.update_failed(feedcore.AuthenticationRequired('authentication required'))
+    assert podcast.next_update_attempt == 0
+    assert scheduler.due([podcast]) == []
+    assert scheduler.seconds_until_due([podcast]) > 20 * 60 - 5
+    assert scheduler.due([podcast], now=podcast.last_failed_update + 20 * 60) == [podcast]
+
+
+class FakeDatabase:
+    def commit(self):
+        pass
+
+
+class FakeModel:
+    db = FakeDatabase()
+
+
+def make_podcast(podcast_id):
+    podcast = model.PodcastChannel(FakeModel())
+    podcast.id = podcast_id
+    return podcast
+
+
+def test_update_backoff(monkeypatch):
+    monkeypatch.setattr(gpodder, 'user_extensions', FakeExtensions())
+    monkeypatch.setattr(model.PodcastChannel, 'save', lambda self: None)
+    podcast = make_podcast(1)
+
+    delays = []
+    for i in range(12):
+        podcast.update_failed(feedcore.InternalServerError('internal server error'))
+        delays.append(podcast.seconds_until_next_attempt())
+
+    assert podcast.update_failures == 12
+    assert model.PodcastChannel.UPDATE_BACKOFF_MIN / 2 - 1 <= delays[0] <= model.PodcastChannel.UPDATE_BACKOFF_MIN
+    assert delays[4] >= 8 * model.PodcastChannel.UPDATE_BACKOFF_MIN
+    assert max(delays) <= model.PodcastChannel.UPDATE_BACKOFF_MAX
+    assert podcast.get_backoff_message().startswith('12 failed updates')
+
+    # The fetcher doesn't request podcasts that are backing off
+    result = model.PodcastChannel.feed_fetcher.fetch_channel(podcast, 0)
+    assert result.status == feedcore.SKIPPED
+
+    # Retry-After is used when it is longer than the backoff
+    error = feedcore.BadRequest('bad request')
+    error.retry_after = 7 * DAY
+    podcast.update_failed(error)
+    assert podcast.seconds_until_next_attempt() > 6 * DAY
+
+    # Unless the user asked to update it, but not before Retry-After
+    monkeypatch.setattr(model.gPodderFetcher, 'fetch', lambda self, url, *args, **kwargs: feedcore.Result(feedcore.NOT_MODIFIED))
+    podcast = make_podcast(3)
+    podcast.url = 'http://example.com/feed.xml'
+    podcast.update_failed(feedcore.InternalServerError('internal server error'))
+    podcast.http_expires = time.time() + DAY
+    assert model.PodcastChannel.feed_fetcher.fetch_channel(podcast, 0).status == feedcore.SKIPPED
+    assert model.PodcastChannel.feed_fetcher.fetch_channel(podcast, 0, force=True).status == feedcore.NOT_MODIFIED
+    podcast.http_retry_after = time.time() + DAY
+    assert model.PodcastChannel.feed_fetcher.fetch_channel(podcast, 0, force=True).status == feedcore.SKIPPED
+
+    # Authentication errors need the user to act, they don't back off
+    podcast = make_podcast(2)
+    podcast.update_failed(feedcore.AuthenticationRequired('authentication required'))
+    assert podcast.update_failures == 0
+    assert podcast.get_backoff_message() is None
+
+
+def test_skipped_update(monkeypatch):
+    monkeypatch.setattr(gpodder, 'user_extensions', FakeExtensions())
+    monkeypatch.setattr(model.PodcastChannel, 'save', lambda self: None)
+    podcast = make_podcast(1)
+    podcast.url = 'http://example.com/feed.xml'
+    podcast.http_expires = time.time() + 2 * 60 * 60
+
+    assert podcast.update() == []
+    assert podcast.was_skipped()
+    assert podcast.get_skip_message().startswith('Up to date, next check in')
+
+    podcast.update_failed(feedcore.InternalServerError('internal server error'))
+    assert podcast.get_skip_message() == podcast.get_backoff_message()
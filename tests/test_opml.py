@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2023 The gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import xml.etree.ElementTree
+
+import gpodder
+from gpodder import feedcore, model, opml, util
+from gpodder.dbsqlite import Database
+
+OPML = """<?xml version="1.0" encoding="utf-8"?>
+<opml version="2.0">
+  <body>
+    <outline text="Podcasts">
+      <outline type="rss" text="First" xmlUrl="%(first)s"/>
+      <outline type="RSS" title="Second" text="Description" xmlUrl="%(second)s"/>
+      <outline type="link" url="%(third)s"/>
+    </outline>
+    <outline type="rss" text="No URL"/>
+  </body>
+</opml>
+"""
+
+RSS = """<rss><channel><title>%s</title>
+<item><title>Episode</title><guid>%s/1</guid><enclosure url="/1.mp3" type="audio/mpeg"/></item>
+</channel></rss>
+"""
+
+
+def test_parse(tmp_path):
+    filename = str(tmp_path / 'subscriptions.opml')
+    with open(filename, 'w') as fp:
+        fp.write(OPML % {'first': 'http://a/1', 'second': 'http://a/2', 'third': 'http://a/3'})
+
+    assert list(opml.parse(filename)) == [
+        {'url': 'http://a/1', 'title': 'First', 'description': 'http://a/1'},
+        {'url': 'http://a/2', 'title': 'Second', 'description': 'Description'},
+        {'url': 'http://a/3', 'title': 'http://a/3', 'description': 'http://a/3'},
+    ]
+    assert opml.Importer(filename).items == list(opml.parse(filename))
+
+
+def test_parse_removes_elements(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'subscriptions.opml')
+    with open(filename, 'w') as fp:
+        fp.write('<opml><body><outline text="Podcasts">%s</outline></body></opml>' % ''.join(
+            '<outline type="rss" xmlUrl="http://a/%d"/>' % i for i in range(10000)))
+
+    roots = []
+    iterparse = xml.etree.ElementTree.iterparse
+
+    def recording_iterparse(*args, **kwargs):
+        for event, element in iterparse(*args, **kwargs):
+            if not roots:
+                roots.append(element)
+            yield event, element
+
+    monkeypatch.setattr(xml.etree.ElementTree, 'iterparse', recording_iterparse)
+    sizes = [len(list(roots[0].iter())) for channel in opml.parse(filename)]
+    # Only the elements of the chunk being parsed are in the tree
+    assert len(sizes) == 10000
+    assert max(sizes) < 1000
+
+
+class FakeExtensions:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def test_subscribe_podcasts(httpserver, tmp_path, monkeypatch):
+    monkeypatch.setattr(gpodder, 'user_extensions', FakeExtensions())
+    monkeypatch.setattr(gpodder, 'downloads', str(tmp_path))
+    monkeypatch.setattr(util, 'make_directory', lambda path: os.makedirs(path, exist_ok=True) or True)
+    monkeypatch.setattr(model.PodcastChannel, 'feed_fetcher', model.gPodderFetcher())
+    for i in range(5):
+        httpserver.expect_request('/%d' % i).respond_with_data(RSS % ('Feed %d' % i, i), content_type='text/xml')
+    httpserver.expect_request('/missing').respond_with_data('', status=404)
+
+    db = Database(str(tmp_path / 'Database'))
+    podcasts = model.Model(db)
+    try:
+        entries = [(httpserver.url_for('/%d' % i), None) for i in range(5)]
+        entries += [(httpserver.url_for('/missing'), 'Missing'), (httpserver.url_for('/0'), None), ('', None)]
+        progress = []
+        subscribed, failed = podcasts.subscribe_podcasts(
+            entries, batch_size=2, progress_callback=lambda url, podcast, error: progress.append(url))
+
+        assert sorted(p.title for p in subscribed) == ['Feed %d' % i for i in range(5)]
+        assert all(len(p.children) == 1 for p in subscribed)
+        assert [url for url, error in failed] == [httpserver.url_for('/missing'), '']
+        assert isinstance(failed[0][1], feedcore.NotFound)
+        assert len(progress) == 7
+
+        # The podcasts are in the database, the failed one is not
+        assert db.get('SELECT COUNT(*) FROM podcast') == 5
+        assert db.get('SELECT COUNT(*) FROM episode') == 5
+        assert podcasts.get_podcasts() == subscribed
+    finally:
+        podcasts.youtube_durations.shutdown()
+        db.close()
+
+
+class Channel:
+    def __init__(self, i):
+        self.title = 'Podcast <%d> & "friends"' % i
+        self.description = 'Line 1\nLine 2'
+        self.url = 'http://example.com/feed?id=%d&format=rss' % i
+
+
+def test_export(tmp_path):
+    filename = str(tmp_path / 'subscriptions.opml')
+
+    # Any iterable of podcasts can be exported, e.g. a generator
+    assert opml.Exporter(filename).write(Channel(i) for i in range(3))
+
+    assert [(c['url'], c['title'], c['description']) for c in opml.parse(filename)] == [
+        (c.url, c.title, c.description) for c in (Channel(i) for i in range(3))]
+    assert not os.path.exists(filename + '.tmp')
+
+    # Errors while writing keep the old file
+    def broken_podcasts():
+        yield Channel(4)
+        raise ValueError('database error')
+
+    assert not opml.Exporter(filename).write(broken_podcasts())
+    assert len(list(opml.parse(filename))) == 3
+    assert not os.path.exists(filename + '.tmp')
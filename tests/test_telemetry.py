@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2023 The gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+
+import gpodder
+from gpodder import telemetry
+
+
+def test_nested_phases():
+    timings = telemetry.FeedTimings('http://example.com/feed', 'Example')
+    with telemetry.recording(timings):
+        with telemetry.phase('parse'):
+            time.sleep(0.02)
+            with telemetry.phase('db'):
+                time.sleep(0.02)
+        telemetry.add_bytes(100)
+        with telemetry.recording(timings):
+            telemetry.add_bytes(10)
+
+    # outside of a recording, phases are not recorded
+    with telemetry.phase('parse'):
+        telemetry.add_bytes(1000)
+
+    assert telemetry.current() is None
+    assert timings.bytes == 110
+    assert 0.02 <= timings.phases['parse'] < 0.04
+    assert 0.02 <= timings.phases['db'] < 0.04
+    assert timings.phases['other'] < 0.01
+    assert abs(timings.total - sum(timings.phases.values())) < 1e-9
+
+
+def test_save_and_report(tmpdir, monkeypatch):
+    monkeypatch.setattr(gpodder, 'home', str(tmpdir))
+
+    for i in range(telemetry.MAX_RUNS + 2):
+        run = telemetry.UpdateRun()
+        for url, seconds, size in (('http://a/', 1.0, 100), ('http://b/', 3.0, 50)):
+            timings = telemetry.FeedTimings(url, url)
+            timings.phases['transfer'] = seconds
+            timings.phases['parse'] = seconds
+            timings.bytes = size
+            run.add(timings)
+        run.finish()
+        telemetry.save_run(run)
+
+    runs = telemetry.load_runs()
+    assert len(runs) == telemetry.MAX_RUNS
+
+    report = telemetry.report(runs, count=1)
+    assert report['updates'] == 2 * telemetry.MAX_RUNS
+    assert report['phases']['transfer'] == report['phases']['parse'] == 0.5
+    assert [feed['url'] for feed in report['slowest']] == ['http://b/']
+    assert report['slowest'][0]['total'] == 6.0
+    assert [feed['url'] for feed in report['largest']] == ['http://a/']
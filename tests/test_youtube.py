@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2023 The gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import time
+
+from gpodder import youtube
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.durations = {}
+        self.saved = []
+        self.commits = 0
+
+    def get_youtube_duration(self, video_id):
+        return self.durations.get(video_id)
+
+    def set_youtube_duration(self, video_id, total_time):
+        self.durations[video_id] = (total_time, int(time.time()))
+
+    def save_episode(self, episode):
+        self.saved.append(episode)
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakeEpisode:
+    def __init__(self, vid, total_time=0):
+        self.url = 'https://www.youtube.com/watch?v=' + vid
+        self.total_time = total_time
+
+
+def test_duration_resolver(monkeypatch):
+    lock = threading.Lock()
+    looked_up = []
+    running = [0, 0]
+
+    def get_total_time(episode):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+            looked_up.append(episode)
+        # live streams have no duration yet
+        return 0 if 'live' in episode.url else 60
+
+    monkeypatch.setattr(youtube, 'get_total_time', get_total_time)
+    db = FakeDatabase()
+    resolver = youtube.DurationResolver(db, max_workers=2)
+    resolved = []
+    resolver.resolved_callback = resolved.extend
+
+    episodes = [FakeEpisode('video%05d' % i) for i in range(6)]
+    live = FakeEpisode('live0000000')
+    resolver.resolve(episodes + [live, FakeEpisode('known000000', total_time=10)])
+    resolver.wait()
+
+    assert sorted(looked_up, key=id) == sorted(episodes + [live], key=id)
+    assert running[1] <= 2
+    assert all(e.total_time == 60 for e in episodes)
+    assert live.total_time == 0
+    assert db.durations['live0000000'][0] == 0
+    # The durations found are committed and reported
+    assert db.commits >= 1
+    assert sorted(resolved, key=id) == sorted(episodes, key=id)
+
+    # Cached durations are used, live streams are not looked up again for now
+    del looked_up[:]
+    again = FakeEpisode('video00000')
+    resolver.resolve([again, FakeEpisode('live0000000')])
+    resolver.wait()
+    assert looked_up == []
+    assert again.total_time == 60
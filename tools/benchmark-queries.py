@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# benchmark-queries.py: Query plans and timings of the episode queries,
+# with the indexes of database version 15 and the current ones
+#
+# Usage: python3 tools/benchmark-queries.py [--episodes 1000000] [--podcasts 2000]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gpodder  # noqa: E402
+from gpodder import schema  # noqa: E402
+from gpodder.dbsqlite import Database  # noqa: E402
+
+OLD_INDEXES = """
+DROP INDEX idx_episode_podcast_published
+DROP INDEX idx_episode_podcast_state
+CREATE INDEX idx_episode_podcast_id ON episode (podcast_id)
+"""
+
+NEW_INDEXES = """
+DROP INDEX idx_episode_podcast_id
+CREATE INDEX idx_episode_podcast_published ON episode (podcast_id, published DESC)
+CREATE INDEX idx_episode_podcast_state ON episode (podcast_id, state, is_new)
+"""
+
+# (name, query before, query after); parameters are podcast_id, max_episodes, state
+QUERIES = (
+    ('purge', """
+        SELECT id FROM episode
+        WHERE podcast_id = :podcast_id
+        AND state <> :state
+        AND id NOT IN
+        (SELECT id FROM episode WHERE podcast_id = :podcast_id
+        ORDER BY published DESC LIMIT :max_episodes)""", """
+        SELECT id FROM
+        (SELECT id, state FROM episode WHERE podcast_id = :podcast_id
+        ORDER BY published DESC LIMIT -1 OFFSET :max_episodes)
+        WHERE state <> :state"""),
+    ('last published',
+     'SELECT MAX(published) FROM episode WHERE podcast_id = :podcast_id',
+     'SELECT published FROM episode WHERE podcast_id = :podcast_id ORDER BY published DESC LIMIT 1'),
+    ('load episodes',
+     'SELECT id, published FROM episode WHERE podcast_id = :podcast_id ORDER BY published DESC',
+     'SELECT id, published FROM episode WHERE podcast_id = :podcast_id ORDER BY published DESC'),
+    ('count statistics', schema.statistics_count_sql(), schema.statistics_count_sql()),
+)
+
+
+def create_database(filename, episodes, podcasts):
+    db = Database(filename)
+    conn = db.db
+    conn.executemany('INSERT INTO podcast (id, url, download_folder) VALUES (?, ?, ?)',
+                     ((i, 'http://example.com/%d.xml' % i, 'podcast%d' % i) for i in range(1, podcasts + 1)))
+    states = (gpodder.STATE_NORMAL, gpodder.STATE_DOWNLOADED, gpodder.STATE_DELETED)
+    rows = ((random.randint(1, podcasts), 'http://example.com/%d.mp3' % i, str(i),
+             random.randint(0, 2**31), random.choice(states), random.random() < 0.2) for i in range(episodes))
+    conn.executemany('INSERT INTO episode (podcast_id, url, guid, published, state, is_new) VALUES (?, ?, ?, ?, ?, ?)',
+                     rows)
+    db.commit()
+    db.close()
+
+
+def run_queries(conn, label, column, podcasts, repeat):
+    print('== %s ==' % label)
+    for query in QUERIES:
+        name, sql = query[0], query[column]
+        params = {'podcast_id': 1, 'max_episodes': 200, 'state': gpodder.STATE_DOWNLOADED}
+        print('-- %s' % name)
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            print('   ' + row[-1])
+
+        # The statistics are counted for all podcasts at once
+        count = 1 if 'GROUP BY' in sql else repeat
+        start = time.perf_counter()
+        for i in range(count):
+            params['podcast_id'] = random.randint(1, podcasts)
+            conn.execute(sql, params).fetchall()
+        print('   %.3f ms per query' % ((time.perf_counter() - start) * 1000 / count))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the episode queries with the old and new indexes')
+    parser.add_argument('--episodes', type=int, default=1000000, help='number of episodes (default: %(default)s)')
+    parser.add_argument('--podcasts', type=int, default=2000, help='number of podcasts (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=200, help='queries per measurement (default: %(default)s)')
+    parser.add_argument('--database', help='database file to use (default: a temporary file)')
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = args.database or os.path.join(tmp, 'Database')
+        if not os.path.exists(filename):
+            print('Creating %d episodes in %d podcasts...' % (args.episodes, args.podcasts))
+            create_database(filename, args.episodes, args.podcasts)
+
+        db = Database(filename)
+        conn = db.db
+        conn.executescript(';'.join(OLD_INDEXES.strip().splitlines()))
+        conn.execute('ANALYZE')
+        run_queries(conn, 'Before (version 15 indexes)', 1, args.podcasts, args.repeat)
+
+        conn.executescript(';'.join(NEW_INDEXES.strip().splitlines()))
+        conn.execute('ANALYZE')
+        run_queries(conn, 'After (version 16 indexes)', 2, args.podcasts, args.repeat)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()